@@ -0,0 +1,87 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Client to export access logs of all types."""
+
+import logging
+import urllib
+import urllib2
+
+from cauliflowervest.client import base_client
+
+
+# Header of export responses which holds the start_next token, if logs are
+# left; see cauliflowervest.server.handlers.logs.Export.
+EXPORT_NEXT_HEADER = 'X-Export-Next'
+
+
+class ExportError(base_client.RequestError):
+  """The export failed; it can be resumed from start_next."""
+
+  def __init__(self, message, start_next):
+    super(ExportError, self).__init__(message)
+    self.start_next = start_next
+
+
+class LogExportClient(base_client.CauliflowerVestClient):
+  """Client to export access logs as NDJSON or CSV."""
+
+  ESCROW_PATH = '/logs/export'
+
+  def Export(self, out, export_format='ndjson', start_time=None,
+             end_time=None, start_next=None):
+    """Writes all logs to out, one response at a time.
+
+    Only one response is held in memory. A response is written to out only
+    once it is read completely, so an export which failed can be resumed
+    from ExportError.start_next without duplicate or missing logs.
+
+    Args:
+      out: file to write the logs to.
+      export_format: str, ndjson or csv.
+      start_time: str, optional, YYYY-MM-DDTHH:MM:SS UTC time of the oldest
+          log to export.
+      end_time: str, optional, logs from this time on are not exported.
+      start_next: str, optional, token to resume an export from.
+    Returns:
+      int, number of responses written.
+    Raises:
+      ExportError: a request failed.
+    """
+    params = {'format': export_format}
+    if start_time:
+      params['start_time'] = start_time
+    if end_time:
+      params['end_time'] = end_time
+
+    responses = 0
+    while True:
+      if start_next:
+        params['start_next'] = start_next
+      request = urllib2.Request(
+          '%s?%s' % (self.escrow_url, urllib.urlencode(params)))
+      try:
+        response = self._RetryRequest(request, 'Exporting logs')
+        content = response.read()
+      except (base_client.RequestError, IOError) as e:
+        raise ExportError(str(e), start_next)
+
+      out.write(content)
+      out.flush()
+      responses += 1
+
+      start_next = response.info().getheader(EXPORT_NEXT_HEADER)
+      if not start_next:
+        return responses
+      logging.debug('Export continues from %s', start_next)
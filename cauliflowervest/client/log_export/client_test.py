@@ -0,0 +1,76 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for log_export client module."""
+
+import StringIO
+import urllib2
+import urlparse
+
+
+
+from absl.testing import absltest
+import mock
+
+from cauliflowervest.client import base_client
+from cauliflowervest.client.log_export import client
+
+
+def _Response(content, start_next=None):
+  response = mock.Mock()
+  response.read.return_value = content
+  response.info.return_value.getheader.return_value = start_next
+  return response
+
+
+class LogExportClientTest(absltest.TestCase):
+
+  def setUp(self):
+    super(LogExportClientTest, self).setUp()
+    self.opener = mock.Mock(spec=urllib2.OpenerDirector)
+    self.c = client.LogExportClient('https://example.com', self.opener)
+
+  def _Params(self, call_index):
+    request = self.opener.open.call_args_list[call_index][0][0]
+    return urlparse.parse_qs(urlparse.urlparse(request.get_full_url()).query)
+
+  def testExport(self):
+    self.opener.open.side_effect = [
+        _Response('a\n', start_next='t1'), _Response('b\n')]
+    out = StringIO.StringIO()
+
+    self.assertEqual(2, self.c.Export(out, start_time='2017-01-01T00:00:00'))
+
+    self.assertEqual('a\nb\n', out.getvalue())
+    self.assertNotIn('start_next', self._Params(0))
+    self.assertEqual(['t1'], self._Params(1)['start_next'])
+    self.assertEqual(['2017-01-01T00:00:00'], self._Params(1)['start_time'])
+
+  def testExportFailureCanBeResumed(self):
+    self.c.MAX_TRIES = 1
+    self.opener.open.side_effect = [
+        _Response('a\n', start_next='t1'), urllib2.URLError('down')]
+    out = StringIO.StringIO()
+
+    with self.assertRaises(client.ExportError) as cm:
+      self.c.Export(out, export_format='csv', start_next='t0')
+
+    self.assertIsInstance(cm.exception, base_client.RequestError)
+    self.assertEqual('t1', cm.exception.start_next)
+    self.assertEqual('a\n', out.getvalue())
+    self.assertEqual(['csv'], self._Params(0)['format'])
+
+
+if __name__ == '__main__':
+  absltest.main()
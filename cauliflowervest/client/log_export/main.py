@@ -0,0 +1,74 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Exports access logs of all types as NDJSON or CSV."""
+
+import logging
+import sys
+
+
+
+from absl import app
+from absl import flags
+
+from cauliflowervest.client import base_client
+from cauliflowervest.client import base_flags
+from cauliflowervest.client.log_export import client
+
+
+flags.DEFINE_enum(
+    'format', 'ndjson', ['ndjson', 'csv'], 'Format of the exported logs.')
+flags.DEFINE_string(
+    'start_time', None,
+    'YYYY-MM-DDTHH:MM:SS UTC time of the oldest log to export.')
+flags.DEFINE_string(
+    'end_time', None,
+    'YYYY-MM-DDTHH:MM:SS UTC time; later logs are not exported.')
+flags.DEFINE_string(
+    'start_next', None,
+    'Token printed by a failed export to resume it from.')
+flags.DEFINE_string(
+    'output', None,
+    'File to write the logs to, default stdout. When resuming an export the '
+    'logs are appended to it.')
+
+
+@base_flags.HandleBaseFlags
+def main(options):
+  if options.login_type == 'oauth2':
+    credentials = base_client.GetOauthCredentials()
+    opener = base_client.BuildOauth2Opener(credentials)
+  else:
+    raise NotImplementedError('Unsupported login type: %s', options.login_type)
+
+  c = client.LogExportClient(options.server_url, opener)
+
+  out = sys.stdout
+  if options.output:
+    out = open(options.output, 'a' if options.start_next else 'w')
+  try:
+    c.Export(out, export_format=options.format,
+             start_time=options.start_time, end_time=options.end_time,
+             start_next=options.start_next)
+  except client.ExportError as e:
+    logging.error('%s\nResume the export with --start_next=%s',
+                  e, e.start_next)
+    return 1
+  finally:
+    if out is not sys.stdout:
+      out.close()
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,33 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Writes AccessLog entities queued by access_log_queue to Datastore."""
+import logging
+import webapp2
+
+from cauliflowervest.server import util
+from cauliflowervest.server.models import access_log_queue
+# Imported so that queued logs of all kinds can be loaded.
+from cauliflowervest.server.models import backups  # pylint: disable=unused-import
+from cauliflowervest.server.models import firmware  # pylint: disable=unused-import
+from cauliflowervest.server.models import volumes  # pylint: disable=unused-import
+
+
+class AccessLogFlush(webapp2.RequestHandler):
+  """Flushes the access-log pull queue."""
+
+  @util.CronJob
+  def get(self):
+    written = access_log_queue.Flush()
+    logging.info('Wrote %d queued access logs.', written)
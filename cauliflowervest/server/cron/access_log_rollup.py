@@ -0,0 +1,136 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rolls up and deletes AccessLog entities older than the retention period.
+
+Each log type and day is a shard, handled by a chain of deferred tasks.
+The logs of the day are first counted into its base.AccessLogDailySummary
+batch by batch, then deleted batch by batch.
+"""
+import datetime
+import logging
+import webapp2
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
+
+from cauliflowervest.server import permissions
+from cauliflowervest.server import settings
+from cauliflowervest.server import util
+from cauliflowervest.server.models import base
+from cauliflowervest.server.models import util as models_util
+
+
+_QUEUE_NAME = 'cron'
+_COUNT_BATCH_SIZE = 1000
+_DELETE_BATCH_SIZE = 500
+
+
+def _DayQuery(log_model, day):
+  start = datetime.datetime.combine(day, datetime.time())
+  end = start + datetime.timedelta(days=1)
+  query = log_model.query(log_model.mtime >= start, log_model.mtime < end)
+  return query.order(log_model.mtime)
+
+
+def _Defer(log_type, day, counted):
+  """Defers the next step of a shard, unless it is deferred already."""
+  try:
+    deferred.defer(
+        _RollupDay, log_type, day, counted, _queue=_QUEUE_NAME,
+        _name='access-log-rollup-%s-%s-%d' % (log_type, day, counted))
+  except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+    pass
+
+
+@ndb.transactional
+def _PutCounts(summary, counted):
+  """Puts summary if it still has counted logs, returns True if it was put."""
+  current = summary.key.get()
+  if (current.total if current else 0) != counted:
+    return False
+  summary.put()
+  return True
+
+
+def _RollupDay(log_type, day, counted):
+  """Counts or deletes one batch of the logs of log_type of day.
+
+  Args:
+    log_type: str, one of permissions.TYPES.
+    day: datetime.date.
+    counted: int, number of logs counted by earlier steps. A task for which
+        this does not match the summary, e.g. a retry of a step which
+        succeeded, does nothing.
+  """
+  log_model = models_util.TypeNameToLogModel(log_type)
+  key = base.AccessLogDailySummary.KeyFor(log_type, day)
+  summary = key.get() or base.AccessLogDailySummary(
+      key=key, log_type=log_type, date=day)
+  if summary.total != counted:
+    return
+
+  if not summary.complete:
+    start_cursor = Cursor(urlsafe=summary.cursor) if summary.cursor else None
+    logs, next_cursor, more = _DayQuery(log_model, day).fetch_page(
+        _COUNT_BATCH_SIZE, start_cursor=start_cursor)
+    for log in logs:
+      summary.Count(log)
+    if more and next_cursor:
+      summary.cursor = next_cursor.urlsafe()
+    else:
+      summary.cursor = None
+      summary.complete = True
+    # The counts and the cursor are put together, so no log is counted twice.
+    if _PutCounts(summary, counted):
+      _Defer(log_type, day, summary.total)
+    return
+
+  keys = _DayQuery(log_model, day).fetch(_DELETE_BATCH_SIZE, keys_only=True)
+  if not keys:
+    logging.info('Rolled up %d %s logs of %s.', summary.total, log_type, day)
+    return
+  ndb.delete_multi(keys)
+  deferred.defer(_RollupDay, log_type, day, counted, _queue=_QUEUE_NAME)
+
+
+def _OldestLogDay(log_model):
+  log = log_model.query().order(log_model.mtime).get()
+  return log.mtime.date() if log else None
+
+
+class AccessLogRollup(webapp2.RequestHandler):
+  """Starts the rollup of logs older than ACCESS_LOG_RETENTION_DAYS."""
+
+  @util.CronJob
+  def get(self):
+    if settings.ACCESS_LOG_RETENTION_DAYS is None:
+      logging.info('ACCESS_LOG_RETENTION_DAYS is not set; logs are kept.')
+      return
+
+    cutoff = (datetime.datetime.utcnow() - datetime.timedelta(
+        days=settings.ACCESS_LOG_RETENTION_DAYS)).date()
+    for log_type in permissions.TYPES:
+      day = _OldestLogDay(models_util.TypeNameToLogModel(log_type))
+      while day is not None and day < cutoff:
+        summary = base.AccessLogDailySummary.KeyFor(log_type, day).get()
+        if summary and summary.complete:
+          # Deleting logs twice is harmless, so deletes are not named.
+          deferred.defer(
+              _RollupDay, log_type, day, summary.total, _queue=_QUEUE_NAME)
+        else:
+          _Defer(log_type, day, summary.total if summary else 0)
+        day += datetime.timedelta(days=1)
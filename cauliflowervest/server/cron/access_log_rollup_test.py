@@ -0,0 +1,94 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""access_log_rollup module tests."""
+
+import datetime
+
+
+
+from absl.testing import absltest
+import mock
+import webtest
+
+from google.appengine.api import users
+
+from cauliflowervest.server import settings
+from cauliflowervest.server.cron import access_log_rollup
+from cauliflowervest.server.cron import main as gae_main
+from cauliflowervest.server.handlers import test_util
+from cauliflowervest.server.models import base
+from cauliflowervest.server.models import volumes
+
+
+@mock.patch.dict(access_log_rollup.__dict__, {
+    '_COUNT_BATCH_SIZE': 2, '_DELETE_BATCH_SIZE': 2})
+class AccessLogRollupTest(test_util.BaseTest):
+
+  def setUp(self):
+    super(AccessLogRollupTest, self).setUp()
+    self.testapp = webtest.TestApp(gae_main.app)
+    self.day = datetime.date(2017, 1, 1)
+
+    def Log(mtime, **kwargs):
+      volumes.LuksAccessLog(mtime=mtime, **kwargs).put()
+    Log(datetime.datetime(2017, 1, 1, 1), message='GET', target_id='t1')
+    Log(datetime.datetime(2017, 1, 1, 2), message='GET', target_id='t1',
+        user=users.User('other@example.com'))
+    Log(datetime.datetime(2017, 1, 1, 3), message='PUT', target_id='t2',
+        successful=False)
+    Log(datetime.datetime(2017, 1, 2), message='GET', target_id='t1')
+    Log(datetime.datetime.utcnow(), message='GET', target_id='t1')
+
+  def _RunTasks(self):
+    for _ in range(10):
+      test_util.RunAllDeferredTasks(self.testbed, 'cron')
+
+  @mock.patch.dict(settings.__dict__, {'ACCESS_LOG_RETENTION_DAYS': 30})
+  def testRollup(self):
+    self.testapp.get('/cron/access_log_rollup')
+    self._RunTasks()
+
+    summary = base.AccessLogDailySummary.KeyFor('luks', self.day).get()
+    self.assertTrue(summary.complete)
+    self.assertEqual(3, summary.total)
+    self.assertEqual(
+        {'stub7@example.com': 2, 'other@example.com': 1}, summary.by_user)
+    self.assertEqual({'GET': 2, 'PUT': 1}, summary.by_action)
+    self.assertEqual({'successful': 2, 'failed': 1}, summary.by_outcome)
+    self.assertEqual({'t1': 2, 't2': 1}, summary.by_target)
+    self.assertEqual(1, base.AccessLogDailySummary.KeyFor(
+        'luks', self.day + datetime.timedelta(days=1)).get().total)
+
+    # Only the recent log is left.
+    self.assertEqual(1, len(volumes.LuksAccessLog.query().fetch()))
+
+  def testRetentionNotSet(self):
+    self.testapp.get('/cron/access_log_rollup')
+    self._RunTasks()
+
+    self.assertEqual([], base.AccessLogDailySummary.query().fetch())
+    self.assertEqual(5, len(volumes.LuksAccessLog.query().fetch()))
+
+  def testStaleStepDoesNothing(self):
+    access_log_rollup._RollupDay('luks', self.day, 0)
+    access_log_rollup._RollupDay('luks', self.day, 0)
+
+    summary = base.AccessLogDailySummary.KeyFor('luks', self.day).get()
+    self.assertEqual(2, summary.total)
+    self.assertFalse(summary.complete)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -18,8 +18,9 @@ import logging
 import webapp2
 
 from google.appengine.api import users
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
+from cauliflowervest.server import permission_cache
 from cauliflowervest.server import permissions
 from cauliflowervest.server import service_factory
 from cauliflowervest.server import settings
@@ -34,8 +35,9 @@ class GroupSync(webapp2.RequestHandler):
     """Performs a batch Datastore operation on a sequence of keys or entities.
 
     Args:
-      op: func, Datastore operation to perform, i.e. db.put or db.delete.
-      entities_or_keys: sequence, db.Key or db.Model instances.
+      op: func, Datastore operation to perform, i.e. ndb.put_multi or
+          ndb.delete_multi.
+      entities_or_keys: sequence, ndb.Key or ndb.Model instances.
       batch_size: int, number of keys or entities to batch per operation.
     """
     for i in xrange(0, len(entities_or_keys), batch_size):
@@ -46,12 +48,12 @@ class GroupSync(webapp2.RequestHandler):
 
     Args:
       email: str, email address of the user.
-      user_perms: dict, dict of permission types with lists of db.User
+      user_perms: dict, dict of permission types with lists of
           permissions. i.e. {'filevault_perms': [RETRIEVE, ESCROW]}
     Returns:
       base.User entity.
     """
-    u = base.User(key_name=email, user=users.User(email=email))
+    u = base.User(id=email, user=users.User(email=email))
     for permission_type in permissions.TYPES:
       u.SetPerms(user_perms.get(permission_type, []), permission_type)
     return u
@@ -103,18 +105,20 @@ class GroupSync(webapp2.RequestHandler):
     group_users = self._GetGroupMembersAndPermissions()
 
     # Get all key names from base.User Datastore kind; set() for O(1) lookup.
-    local_users = set([k.name() for k in base.User.all(keys_only=True)])
+    local_users = set([k.id() for k in base.User.query().iter(keys_only=True)])
 
     # Delete any local users that are no longer in any of the groups.
     users_to_delete = [u for u in local_users if u not in group_users]
-    keys_to_delete = [
-        db.Key.from_path(base.User.__name__, u) for u in users_to_delete]
+    keys_to_delete = [ndb.Key(base.User, u) for u in users_to_delete]
     if keys_to_delete:
       logging.debug('Deleting users: %s', users_to_delete)
-      self._BatchDatastoreOp(db.delete, keys_to_delete)
+      self._BatchDatastoreOp(ndb.delete_multi, keys_to_delete)
 
     # Write all group_users to base.User Datastore kind, overwriting any
     # existing users in case permissions have changed.
     users_to_put = [
         self._MakeUserEntity(u, p) for u, p in group_users.iteritems()]
-    self._BatchDatastoreOp(db.put, users_to_put)
+    self._BatchDatastoreOp(ndb.put_multi, users_to_put)
+
+    # Drop cached permissions, so that changes take effect immediately.
+    permission_cache.BumpGeneration()
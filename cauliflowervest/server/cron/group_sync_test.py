@@ -109,9 +109,10 @@ class GroupSyncTest(absltest.TestCase):
     ret = self.g._GetGroupMembersAndPermissions()
     self.assertEqual(expected_return, ret)
 
-  @mock.patch.object(group_sync.db.Key, 'from_path')
-  @mock.patch.object(base.User, 'all')
-  def testGet(self, all_mock, from_path_mock):
+  @mock.patch.object(group_sync.permission_cache, 'BumpGeneration')
+  @mock.patch.object(group_sync.ndb, 'Key')
+  @mock.patch.object(base.User, 'query')
+  def testGet(self, query_mock, key_mock, bump_generation_mock):
     self.g._BatchDatastoreOp = mock.Mock()
     self.g._GetGroupMembersAndPermissions = mock.Mock()
     self.g._MakeUserEntity = mock.Mock()
@@ -130,12 +131,12 @@ class GroupSyncTest(absltest.TestCase):
     mock_key_to_del = mock.MagicMock()
     mock_key_u1 = mock.MagicMock()
 
-    all_mock.return_value = [mock_key_to_del, mock_key_u1]
+    query_mock.return_value.iter.return_value = [mock_key_to_del, mock_key_u1]
 
-    mock_key_to_del.name.return_value = to_del_user
-    mock_key_u1.name.return_value = 'u1@example.com'
+    mock_key_to_del.id.return_value = to_del_user
+    mock_key_u1.id.return_value = 'u1@example.com'
 
-    from_path_mock.return_value = 'todeluserkey'
+    key_mock.return_value = 'todeluserkey'
 
     to_add = []
 
@@ -154,12 +155,12 @@ class GroupSyncTest(absltest.TestCase):
 
     self.g.get()
 
-    from_path_mock.assert_called_once_with(
-        base.User.__name__, to_del_user)
+    key_mock.assert_called_once_with(base.User, to_del_user)
 
     self.g._BatchDatastoreOp.assert_has_calls([
-        mock.call(group_sync.db.delete, ['todeluserkey']),
-        mock.call(group_sync.db.put, to_add)])
+        mock.call(group_sync.ndb.delete_multi, ['todeluserkey']),
+        mock.call(group_sync.ndb.put_multi, to_add)])
+    bump_generation_mock.assert_called_once_with()
 
 
 if __name__ == '__main__':
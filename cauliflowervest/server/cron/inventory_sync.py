@@ -17,6 +17,7 @@ import logging
 import uuid
 import webapp2
 
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import deferred
 
 from cauliflowervest.server import service_factory
@@ -38,10 +39,10 @@ def _deferred_name(model):
 
 def _sync_metadata(model, cursor=None, total_updated=0):
   """Sync metadata from Inventory Service."""
-  query = model.all().filter('active =', True)
-  if cursor:
-    query.with_cursor(cursor)
-  entities = query.fetch(limit=_BATCH_SIZE)
+  query = model.query(model.active == True)  # pylint: disable=g-explicit-bool-comparison
+  start_cursor = Cursor(urlsafe=cursor) if cursor else None
+  entities, next_cursor, _ = query.fetch_page(
+      _BATCH_SIZE, start_cursor=start_cursor)
   if not entities:
     logging.info('Total updated %s %d', model.ESCROW_TYPE_NAME, total_updated)
     return
@@ -66,7 +67,7 @@ def _sync_metadata(model, cursor=None, total_updated=0):
 
   if entities:
     deferred.defer(
-        _sync_metadata, model, cursor=query.cursor(), _countdown=_DELAY,
+        _sync_metadata, model, cursor=next_cursor.urlsafe(), _countdown=_DELAY,
         _name=_deferred_name(model), total_updated=total_updated,
         _queue=_QUEUE_NAME)
 
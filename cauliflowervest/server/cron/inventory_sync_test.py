@@ -16,6 +16,7 @@ from absl.testing import absltest
 import mock
 import webtest
 
+from cauliflowervest.server import crypto
 from cauliflowervest.server import service_factory
 from cauliflowervest.server import services
 from cauliflowervest.server.cron import inventory_sync
@@ -46,7 +47,7 @@ class InventorySyncTest(test_util.BaseTest):
 
     test_util.RunAllDeferredTasks(self.testbed)
 
-    entities = firmware.AppleFirmwarePassword.all().fetch(10)
+    entities = firmware.AppleFirmwarePassword.query().fetch(10)
     self.assertEqual(1, len(entities))
 
     self.assertEqual(new_hostname, entities[0].hostname)
@@ -68,7 +69,7 @@ class InventorySyncTest(test_util.BaseTest):
     test_util.RunAllDeferredTasks(self.testbed)
     test_util.RunAllDeferredTasks(self.testbed)
 
-    entities = firmware.LinuxFirmwarePassword.all().fetch(10)
+    entities = firmware.LinuxFirmwarePassword.query().fetch(10)
     self.assertEqual(2, len(entities))
 
     self.assertEqual(new_hostname, entities[0].hostname)
@@ -86,7 +87,7 @@ class InventorySyncTest(test_util.BaseTest):
 
     test_util.RunAllDeferredTasks(self.testbed)
 
-    entities = firmware.AppleFirmwarePassword.all().fetch(10)
+    entities = firmware.AppleFirmwarePassword.query().fetch(10)
     self.assertEqual(1, len(entities))
 
     self.assertEqual([new_owner + '@example.com'], entities[0].owners)
@@ -105,12 +106,30 @@ class InventorySyncTest(test_util.BaseTest):
 
     test_util.RunAllDeferredTasks(self.testbed)
 
-    entities = volumes.BitLockerVolume.all().fetch(10)
+    entities = volumes.BitLockerVolume.query().fetch(10)
     self.assertEqual(1, len(entities))
 
     self.assertEqual([new_owner + '@example.com'], entities[0].owners)
     self.assertTrue(entities[0].force_rekeying)
 
+  @mock.patch.object(
+      service_factory, 'GetInventoryService', spec=services.InventoryService)
+  def testSyncDoesNotDecryptOrEncrypt(self, factory_mock):
+    factory_mock.return_value.GetMetadataUpdates.return_value = {
+        'hostname': 'somethingelse',
+        'owners': ['plague'],
+    }
+
+    test_util.MakeAppleFirmware(save=True, owner='acidburn')
+    crypto.Decrypt.reset_mock()
+    crypto.Encrypt.reset_mock()
+    self.testapp.get('/cron/inventory_sync')
+
+    test_util.RunAllDeferredTasks(self.testbed)
+
+    self.assertEqual(0, crypto.Decrypt.call_count)
+    self.assertEqual(0, crypto.Encrypt.call_count)
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -16,6 +16,8 @@
 
 import webapp2
 
+from cauliflowervest.server.cron import access_log_flush
+from cauliflowervest.server.cron import access_log_rollup
 from cauliflowervest.server.cron import group_sync
 from cauliflowervest.server.cron import inventory_sync
 
@@ -23,4 +25,6 @@ from cauliflowervest.server.cron import inventory_sync
 app = webapp2.WSGIApplication([
     (r'/cron/inventory_sync', inventory_sync.InventorySync),
     (r'/cron/group_sync$', group_sync.GroupSync),
+    (r'/cron/access_log_flush$', access_log_flush.AccessLogFlush),
+    (r'/cron/access_log_rollup$', access_log_rollup.AccessLogRollup),
 ])
@@ -16,6 +16,7 @@
 
 import json
 import logging
+import threading
 
 
 
@@ -48,8 +49,16 @@ ENCRYPTION_KEY_TYPES = {
     # REPLACE THIS WITH YOUR OWN SERVICE KEY RETRIEVAL METHOD.
     settings.KEY_TYPE_DATASTORE_FILEVAULT: lambda: settings.DEMO_KEYS,
     settings.KEY_TYPE_DATASTORE_XSRF: lambda: settings.DEMO_XSRF_SECRET,
+    settings.KEY_TYPE_DATASTORE_FINGERPRINT: (
+        lambda: settings.DEMO_FINGERPRINT_SECRET),
     }
 
+# Ready to use keyczar.Crypter objects, keyed by key_type. Each value is a
+# (keys, crypter) tuple where keys is the normalized key set the crypter was
+# built from; a different key set (e.g. after rotation) rebuilds the crypter.
+_crypters = {}
+_crypters_lock = threading.Lock()
+
 
 class Error(Exception):
   """Class for domain-specific exceptions."""
@@ -85,6 +94,8 @@ class CauliflowerVestReader(readers.Reader):
       raise ValueError('No keys returned for key_type: %s' % key_type)
 
     for key in keys:
+      # Copy, so that the caller's key dicts are never modified.
+      key = dict(key)
       version_number = key['versionNumber']
       key['aesKeySize'] = key.get('aesKeySize', keyinfo.AES.default_size)
       key['hmacKeySize'] = key.get(
@@ -167,6 +178,41 @@ def AreEncryptionKeysAvailable(key_type=settings.KEY_TYPE_DEFAULT_FILEVAULT):
   return True
 
 
+def _GetCrypter(key_type):
+  """Returns a keyczar.Crypter for key_type, reusing a cached one if possible.
+
+  Args:
+    key_type: str, predefined type of encryption key to use.
+  Returns:
+    keyczar.Crypter instance.
+  Raises:
+    ValueError: When key cannot be found for the requested type.
+    Error: There was an error obtaining the keys.
+  """
+  reader = CauliflowerVestReader()
+  reader.LoadKeys(key_type)
+
+  cached = _crypters.get(key_type)
+  if cached and cached[0] == reader.keys:
+    return cached[1]
+
+  with _crypters_lock:
+    cached = _crypters.get(key_type)
+    if cached and cached[0] == reader.keys:
+      return cached[1]
+    if cached:
+      logging.info('Key set changed for key_type %s; rebuilding.', key_type)
+    crypter = keyczar.Crypter(reader=reader)
+    _crypters[key_type] = (reader.keys, crypter)
+  return crypter
+
+
+def ResetCrypterCache():
+  """Drops all cached keyczar.Crypter objects."""
+  with _crypters_lock:
+    _crypters.clear()
+
+
 def Decrypt(encrypted_data, key_name=None, key_type=None):  # pylint: disable=unused-argument
   """Decrypts and returns encrypted_data.
 
@@ -182,10 +228,7 @@ def Decrypt(encrypted_data, key_name=None, key_type=None):  # pylint: disable=un
   if not encrypted_data:
     return encrypted_data
 
-  reader = CauliflowerVestReader()
-  reader.LoadKeys(key_type)
-  crypter = keyczar.Crypter(reader=reader)
-  return crypter.Decrypt(encrypted_data)
+  return _GetCrypter(key_type).Decrypt(encrypted_data)
 
 
 def Encrypt(data, key_name=None, key_type=None):  # pylint: disable=unused-argument
@@ -203,7 +246,4 @@ def Encrypt(data, key_name=None, key_type=None):  # pylint: disable=unused-argum
   if not data:
     return data
 
-  reader = CauliflowerVestReader()
-  reader.LoadKeys(key_type)
-  crypter = keyczar.Crypter(reader=reader)
-  return crypter.Encrypt(data)
+  return _GetCrypter(key_type).Encrypt(data)
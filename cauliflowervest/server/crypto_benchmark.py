@@ -0,0 +1,52 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmark of crypto.Decrypt latency with and without Crypter cache."""
+
+import timeit
+
+
+
+from absl.testing import absltest
+
+from cauliflowervest.server import crypto
+
+
+_ITERATIONS = 250
+
+
+class DecryptBenchmark(absltest.TestCase):
+
+  def setUp(self):
+    super(DecryptBenchmark, self).setUp()
+    crypto.ResetCrypterCache()
+    self.encrypted = crypto.Encrypt('1234-5678-9ABC-DEF0')
+
+  def _Decrypt(self):
+    crypto.Decrypt(self.encrypted)
+
+  def _DecryptUncached(self):
+    crypto.ResetCrypterCache()
+    crypto.Decrypt(self.encrypted)
+
+  def testDecryptLatency(self):
+    uncached = timeit.timeit(self._DecryptUncached, number=_ITERATIONS)
+    cached = timeit.timeit(self._Decrypt, number=_ITERATIONS)
+
+    print 'crypto.Decrypt per call: %.1f us uncached, %.1f us cached' % (
+        uncached / _ITERATIONS * 1e6, cached / _ITERATIONS * 1e6)
+
+
+if __name__ == '__main__':
+  absltest.main()
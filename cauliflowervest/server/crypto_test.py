@@ -14,6 +14,7 @@
 
 """crypto module tests."""
 
+import base64
 import json
 
 
@@ -141,6 +142,10 @@ class CauliflowerVestReaderTest(absltest.TestCase):
 class CryptoModuleTest(absltest.TestCase):
   """Test the crypto module."""
 
+  def setUp(self):
+    super(CryptoModuleTest, self).setUp()
+    crypto.ResetCrypterCache()
+
   @mock.patch.object(crypto, 'CauliflowerVestReader')
   @mock.patch.object(crypto.keyczar, 'Crypter')
   def testDecrypt(self, crypter, cauliflowervest_reader):
@@ -202,5 +207,64 @@ class CryptoModuleTest(absltest.TestCase):
     mock_reader.LoadKeys.assert_called_once_with(t)
 
 
+class CrypterCacheTest(absltest.TestCase):
+  """Test caching of keyczar.Crypter objects."""
+
+  def setUp(self):
+    super(CrypterCacheTest, self).setUp()
+    crypto.ResetCrypterCache()
+    self.key_type = 'cache-test-type'
+    self.keys = [self._MakeKey(1, 'a')]
+    crypto.ENCRYPTION_KEY_TYPES[self.key_type] = lambda: self.keys
+
+  def tearDown(self):
+    del crypto.ENCRYPTION_KEY_TYPES[self.key_type]
+    crypto.ResetCrypterCache()
+    super(CrypterCacheTest, self).tearDown()
+
+  def _MakeKey(self, version_number, fill, status='PRIMARY'):
+    return {
+        'versionNumber': version_number,
+        'aesKeyString': base64.urlsafe_b64encode(fill * 16),
+        'aesKeySize': 128,
+        'hmacKeyString': base64.urlsafe_b64encode(fill * 32),
+        'hmacKeySize': 256,
+        'status': status,
+    }
+
+  def testCrypterIsReused(self):
+    with mock.patch.object(
+        crypto.keyczar, 'Crypter', wraps=crypto.keyczar.Crypter) as crypter:
+      encrypted = crypto.Encrypt('secret', key_type=self.key_type)
+      for _ in range(3):
+        self.assertEqual(
+            'secret', crypto.Decrypt(encrypted, key_type=self.key_type))
+
+    self.assertEqual(1, crypter.call_count)
+
+  def testLoadKeysDoesNotModifyKeys(self):
+    del self.keys[0]['aesKeySize']
+    crypto.Encrypt('secret', key_type=self.key_type)
+
+    self.assertNotIn('aesKeySize', self.keys[0])
+
+  def testKeyRotationRebuildsCrypter(self):
+    encrypted = crypto.Encrypt('secret', key_type=self.key_type)
+
+    self.keys = [
+        self._MakeKey(1, 'a', status='ACTIVE'), self._MakeKey(2, 'b')]
+    with mock.patch.object(
+        crypto.keyczar, 'Crypter', wraps=crypto.keyczar.Crypter) as crypter:
+      self.assertEqual(
+          'secret', crypto.Decrypt(encrypted, key_type=self.key_type))
+
+    self.assertEqual(1, crypter.call_count)
+
+    self.keys = [self._MakeKey(2, 'b')]
+    self.assertRaises(
+        crypto.keyczar.errors.KeyNotFoundError,
+        crypto.Decrypt, encrypted, key_type=self.key_type)
+
+
 if __name__ == '__main__':
   absltest.main()
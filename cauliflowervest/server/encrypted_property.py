@@ -12,45 +12,187 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Transperent encryption of properties in db."""
+"""Transperent encryption of properties in ndb."""
 import base64
+import collections
+import contextlib
+import hashlib
 import json
+import threading
+import time
 
 from Crypto import Random
 from Crypto.Cipher import AES
 from Crypto.Util import Counter
 
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
 from cauliflowervest.server import crypto
 from cauliflowervest.server import settings
 from common import cloud_kms
 
 
+class _DekCache(object):
+  """Bounded LRU cache of unwrapped data encryption keys (DEK).
+
+  Entries expire settings.ENVELOPE_DEK_CACHE_TTL seconds after they were added
+  and at most settings.ENVELOPE_DEK_CACHE_SIZE entries are kept. Keys are held
+  in mutable buffers which are zeroed when an entry is evicted or expires.
+  """
+
+  def __init__(self):
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  @staticmethod
+  def _Zero(buf):
+    buf[:] = '\x00' * len(buf)
+
+  @staticmethod
+  def CacheKey(encrypted_key, key_name):
+    return hashlib.sha256('%s:%s' % (key_name, encrypted_key)).hexdigest()
+
+  def Get(self, cache_key):
+    """Returns the DEK for cache_key, or None if it is not cached."""
+    with self._lock:
+      entry = self._entries.pop(cache_key, None)
+      if entry is not None:
+        expires, buf = entry
+        if expires > time.time():
+          self._entries[cache_key] = entry
+          self.hits += 1
+          return str(buf)
+        self._Zero(buf)
+      self.misses += 1
+      return None
+
+  def Put(self, cache_key, dek):
+    """Adds a DEK to the cache, evicting the least recently used entries."""
+    max_size = settings.ENVELOPE_DEK_CACHE_SIZE
+    ttl = settings.ENVELOPE_DEK_CACHE_TTL
+    if max_size <= 0 or ttl <= 0:
+      return
+
+    with self._lock:
+      old = self._entries.pop(cache_key, None)
+      if old is not None:
+        self._Zero(old[1])
+      self._entries[cache_key] = (time.time() + ttl, bytearray(dek))
+      while len(self._entries) > max_size:
+        _, (_, buf) = self._entries.popitem(last=False)
+        self._Zero(buf)
+
+  def Clear(self):
+    """Drops and zeroes all entries, and resets counters."""
+    with self._lock:
+      for _, buf in self._entries.itervalues():
+        self._Zero(buf)
+      self._entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def __len__(self):
+    return len(self._entries)
+
+
+# State of the EncryptionBatch active in the current thread.
+_batch = threading.local()
+
+
+@contextlib.contextmanager
+def EncryptionBatch(size=None):
+  """Context in which envelope encryption shares DEKs between secrets.
+
+  With the envelope_cloud_kms backend every secret is normally encrypted with
+  a fresh DEK which is wrapped by Cloud KMS. Inside this context one DEK per
+  key name is wrapped once and used for up to size secrets, which saves one
+  Cloud KMS round trip per secret. Other backends are not affected.
+
+  Args:
+    size: int, maximum number of secrets encrypted with one DEK; defaults to
+        settings.ENVELOPE_BATCH_SIZE.
+  Yields:
+    None.
+  """
+  if getattr(_batch, 'keys', None) is not None:
+    # Nested batch, keep using the outer one.
+    yield
+    return
+
+  _batch.size = size or settings.ENVELOPE_BATCH_SIZE
+  _batch.keys = {}
+  try:
+    yield
+  finally:
+    for buf, _, _ in _batch.keys.itervalues():
+      _DekCache._Zero(buf)  # pylint: disable=protected-access
+    _batch.keys = None
+
+
 class _EnvelopeCloudKms(object):
   """Envelope encryption with Cloud KMS."""
   _KEYRING_NAME = 'keyring2'
+  # Marks blobs whose DEK is shared with other blobs of an EncryptionBatch.
+  # These use a random nonce as counter prefix, so that no two blobs encrypted
+  # with the same DEK share a key stream.
+  _SHARED_KEY_PREFIX = 'S'
+
+  # Unwrapped DEKs, shared by all instances.
+  dek_cache = _DekCache()
+
+  @classmethod
+  def _Counter(cls, iv, shared_key):
+    if shared_key:
+      return Counter.new(
+          AES.block_size * 4, prefix=iv[:AES.block_size / 2])
+    return Counter.new(AES.block_size * 8)
 
   @classmethod
-  def _EncryptMsg(cls, key, plaintext):
-    ctr = Counter.new(AES.block_size * 8)
+  def _EncryptMsg(cls, key, plaintext, shared_key=False):
     # needed for compatibility with old format.
     iv = Random.new().read(AES.block_size)
+    ctr = cls._Counter(iv, shared_key)
     cipher = AES.new(key, AES.MODE_CTR, counter=ctr)
     return base64.urlsafe_b64encode(iv + cipher.encrypt(plaintext))
 
   @classmethod
-  def _DecryptMsg(cls, key, data):
+  def _DecryptMsg(cls, key, data, shared_key=False):
     data = base64.urlsafe_b64decode(str(data))
 
-    ctr = Counter.new(AES.block_size * 8)
+    ctr = cls._Counter(data[:AES.block_size], shared_key)
     ciphertext = data[AES.block_size:]
     cipher = AES.new(key, AES.MODE_CTR, counter=ctr)
     return cipher.decrypt(ciphertext)
 
+  @classmethod
+  def _EncryptWithSharedKey(cls, plaintext, key_name):
+    """Encrypts data with the DEK of the active EncryptionBatch."""
+    entry = _batch.keys.get(key_name)
+    if entry is None or entry[2] >= _batch.size:
+      if entry is not None:
+        _DekCache._Zero(entry[0])  # pylint: disable=protected-access
+      data_encryption_key = Random.new().read(32)  # 32 bytes, 256 bits key
+      encrypted_key = cloud_kms.Encrypt(
+          data_encryption_key, key_name, cls._KEYRING_NAME)
+      assert len(encrypted_key) < 10000
+      # [DEK, wrapped DEK, number of secrets encrypted with it]
+      entry = [bytearray(data_encryption_key), encrypted_key, 0]
+      _batch.keys[key_name] = entry
+
+    entry[2] += 1
+    encrypted_key = entry[1]
+    ciphertext = cls._EncryptMsg(str(entry[0]), plaintext, shared_key=True)
+    return '%s%04d%s%s' % (
+        cls._SHARED_KEY_PREFIX, len(encrypted_key), encrypted_key, ciphertext)
+
   @classmethod
   def Encrypt(cls, plaintext, key_name):
     """Encrypts data and returns."""
+    if getattr(_batch, 'keys', None) is not None:
+      return cls._EncryptWithSharedKey(plaintext, key_name)
+
     data_encryption_key = Random.new().read(32)  # 32 bytes, 256 bits key
     encrypted_key = cloud_kms.Encrypt(
         data_encryption_key, key_name, cls._KEYRING_NAME)
@@ -63,13 +205,21 @@ class _EnvelopeCloudKms(object):
 
   @classmethod
   def Decrypt(cls, blob, key_name):
+    shared_key = blob.startswith(cls._SHARED_KEY_PREFIX)
+    if shared_key:
+      blob = blob[len(cls._SHARED_KEY_PREFIX):]
     length = int(blob[:4])
     key_and_ctx = blob[4:]
     encrypted_key = key_and_ctx[:length]
     ciphertext = key_and_ctx[length:]
-    dek = cloud_kms.Decrypt(encrypted_key, key_name, cls._KEYRING_NAME)
 
-    return cls._DecryptMsg(dek, ciphertext)
+    cache_key = _DekCache.CacheKey(encrypted_key, key_name)
+    dek = cls.dek_cache.Get(cache_key)
+    if dek is None:
+      dek = cloud_kms.Decrypt(encrypted_key, key_name, cls._KEYRING_NAME)
+      cls.dek_cache.Put(cache_key, dek)
+
+    return cls._DecryptMsg(dek, ciphertext, shared_key=shared_key)
 
 
 _CRYPTO_BACKEND = {
@@ -78,8 +228,14 @@ _CRYPTO_BACKEND = {
 }
 
 
-class EncryptedBlobProperty(db.BlobProperty):
-  """BlobProperty class that encrypts/decrypts data seamlessly on get/set."""
+class EncryptedBlobProperty(ndb.BlobProperty):
+  """BlobProperty class that encrypts/decrypts data seamlessly on get/set.
+
+  ndb keeps values loaded from Datastore in their stored form until the
+  property is read for the first time, so decryption is deferred until then.
+  Entities which are loaded and put again without reading the property are
+  written back with the original encrypted value.
+  """
 
   _key_name = None
 
@@ -113,15 +269,15 @@ class EncryptedBlobProperty(db.BlobProperty):
         'value': encrypted,
     })
 
-  # pylint: disable=g-bad-name
-  def make_value_from_datastore(self, value):
-    """Decrypts the blob value coming from Datastore."""
-    return super(EncryptedBlobProperty, self).make_value_from_datastore(
-        db.Blob(str(self._Decrypt(value))))
+  def _validate(self, value):
+    # Like db.BlobProperty, accept unicode which can be converted.
+    if isinstance(value, unicode):
+      return str(value)
 
-  # pylint: disable=g-bad-name
-  def get_value_for_datastore(self, model_instance):
+  def _to_base_type(self, value):
     """Encrypts the blob value on it's way to Datastore."""
-    raw_blob = super(
-        EncryptedBlobProperty, self).get_value_for_datastore(model_instance)
-    return db.Blob(str(self._Encrypt(raw_blob)))
+    return self._Encrypt(str(value))
+
+  def _from_base_type(self, value):
+    """Decrypts the blob value coming from Datastore on first access."""
+    return str(self._Decrypt(value))
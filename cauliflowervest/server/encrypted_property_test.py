@@ -19,11 +19,38 @@ import base64
 from absl.testing import absltest
 import mock
 
+from google.appengine.ext import ndb
+
+from cauliflowervest.server import crypto
 from cauliflowervest.server import encrypted_property
+from cauliflowervest.server import settings
+from cauliflowervest.server.handlers import test_util
+from cauliflowervest.server.models import volumes
+
+
+class _FakeCloudKms(object):
+  """Local fake of common.cloud_kms which counts calls."""
+
+  def __init__(self):
+    self.encrypt_calls = 0
+    self.decrypt_calls = 0
+
+  def Encrypt(self, data, unused_key_name, unused_key_ring):
+    self.encrypt_calls += 1
+    # Result is larger then original key.
+    return base64.b64encode(data)
+
+  def Decrypt(self, data, unused_key_name, unused_key_ring):
+    self.decrypt_calls += 1
+    return base64.b64decode(data)
 
 
 class EncryptedPropertyModelTest(absltest.TestCase):
 
+  def setUp(self):
+    super(EncryptedPropertyModelTest, self).setUp()
+    encrypted_property._EnvelopeCloudKms.dek_cache.Clear()
+
   @mock.patch.object(encrypted_property.cloud_kms, 'Encrypt')
   @mock.patch.object(encrypted_property.cloud_kms, 'Decrypt')
   def testEnvelopeEncryption(self, decrypt_mock, encrypt_mock):
@@ -39,5 +66,167 @@ class EncryptedPropertyModelTest(absltest.TestCase):
     self.assertEqual(data, envelope.Decrypt(envelope.Encrypt(data, '1'), '1'))
 
 
+class DekCacheTest(absltest.TestCase):
+
+  def setUp(self):
+    super(DekCacheTest, self).setUp()
+    self.envelope = encrypted_property._EnvelopeCloudKms
+    self.cache = self.envelope.dek_cache
+    self.cache.Clear()
+
+    self.kms = _FakeCloudKms()
+    patcher = mock.patch.object(encrypted_property, 'cloud_kms', self.kms)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def tearDown(self):
+    self.cache.Clear()
+    super(DekCacheTest, self).tearDown()
+
+  def testRepeatedDecryptHitsCache(self):
+    blob = self.envelope.Encrypt('secret', '1')
+
+    for _ in range(3):
+      self.assertEqual('secret', self.envelope.Decrypt(blob, '1'))
+
+    self.assertEqual(1, self.kms.decrypt_calls)
+    self.assertEqual(1, self.cache.misses)
+    self.assertEqual(2, self.cache.hits)
+
+  def testKeyNameIsPartOfCacheKey(self):
+    blob = self.envelope.Encrypt('secret', '1')
+    self.envelope.Decrypt(blob, '1')
+    self.envelope.Decrypt(blob, '2')
+
+    self.assertEqual(2, self.kms.decrypt_calls)
+
+  @mock.patch.dict(settings.__dict__, {'ENVELOPE_DEK_CACHE_SIZE': 2})
+  def testLeastRecentlyUsedIsEvictedAndZeroed(self):
+    blobs = [self.envelope.Encrypt('secret%d' % i, '1') for i in range(3)]
+    self.envelope.Decrypt(blobs[0], '1')
+    self.envelope.Decrypt(blobs[1], '1')
+    evicted = self.cache._entries.values()[0][1]
+    self.envelope.Decrypt(blobs[2], '1')
+
+    self.assertEqual(2, len(self.cache))
+    self.assertEqual(bytearray(len(evicted)), evicted)
+    self.assertEqual('secret0', self.envelope.Decrypt(blobs[0], '1'))
+    self.assertEqual(4, self.kms.decrypt_calls)
+
+  @mock.patch.dict(settings.__dict__, {'ENVELOPE_DEK_CACHE_TTL': 10})
+  @mock.patch.object(encrypted_property.time, 'time')
+  def testExpiredEntryIsNotUsed(self, time_mock):
+    time_mock.return_value = 1000
+    blob = self.envelope.Encrypt('secret', '1')
+    self.envelope.Decrypt(blob, '1')
+
+    time_mock.return_value = 1011
+    self.assertEqual('secret', self.envelope.Decrypt(blob, '1'))
+
+    self.assertEqual(2, self.kms.decrypt_calls)
+    self.assertEqual(0, self.cache.hits)
+
+  @mock.patch.dict(settings.__dict__, {'ENVELOPE_DEK_CACHE_SIZE': 0})
+  def testCacheDisabled(self):
+    blob = self.envelope.Encrypt('secret', '1')
+    self.envelope.Decrypt(blob, '1')
+    self.envelope.Decrypt(blob, '1')
+
+    self.assertEqual(2, self.kms.decrypt_calls)
+    self.assertEqual(0, len(self.cache))
+
+
+class EncryptionBatchTest(absltest.TestCase):
+
+  def setUp(self):
+    super(EncryptionBatchTest, self).setUp()
+    self.envelope = encrypted_property._EnvelopeCloudKms
+    self.envelope.dek_cache.Clear()
+
+    self.kms = _FakeCloudKms()
+    patcher = mock.patch.object(encrypted_property, 'cloud_kms', self.kms)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def tearDown(self):
+    self.envelope.dek_cache.Clear()
+    super(EncryptionBatchTest, self).tearDown()
+
+  def testOneWrapPerBatch(self):
+    with encrypted_property.EncryptionBatch():
+      blobs = [self.envelope.Encrypt('secret%d' % i, '1') for i in range(5)]
+
+    self.assertEqual(1, self.kms.encrypt_calls)
+    for i, blob in enumerate(blobs):
+      self.assertEqual('secret%d' % i, self.envelope.Decrypt(blob, '1'))
+
+  def testSamePlaintextDifferentCiphertext(self):
+    with encrypted_property.EncryptionBatch():
+      blob1 = self.envelope.Encrypt('secret', '1')
+      blob2 = self.envelope.Encrypt('secret', '1')
+
+    self.assertNotEqual(blob1, blob2)
+
+  def testBatchSize(self):
+    with encrypted_property.EncryptionBatch(size=2):
+      blobs = [self.envelope.Encrypt('secret%d' % i, '1') for i in range(5)]
+
+    self.assertEqual(3, self.kms.encrypt_calls)
+    for i, blob in enumerate(blobs):
+      self.assertEqual('secret%d' % i, self.envelope.Decrypt(blob, '1'))
+
+  def testKeyPerKeyName(self):
+    with encrypted_property.EncryptionBatch():
+      blob1 = self.envelope.Encrypt('secret1', '1')
+      blob2 = self.envelope.Encrypt('secret2', '2')
+
+    self.assertEqual(2, self.kms.encrypt_calls)
+    self.assertEqual('secret1', self.envelope.Decrypt(blob1, '1'))
+    self.assertEqual('secret2', self.envelope.Decrypt(blob2, '2'))
+
+  def testOutsideBatch(self):
+    with encrypted_property.EncryptionBatch():
+      self.envelope.Encrypt('secret', '1')
+    blob1 = self.envelope.Encrypt('secret1', '1')
+    blob2 = self.envelope.Encrypt('secret2', '1')
+
+    self.assertEqual(3, self.kms.encrypt_calls)
+    self.assertEqual('secret1', self.envelope.Decrypt(blob1, '1'))
+    self.assertEqual('secret2', self.envelope.Decrypt(blob2, '1'))
+
+
+class LazyDecryptionTest(test_util.BaseTest):
+
+  def setUp(self):
+    super(LazyDecryptionTest, self).setUp()
+    test_util.MakeFileVaultVolume(passphrase='secret')
+    # Load entities from Datastore, not from the context cache.
+    ndb.get_context().clear_cache()
+    crypto.Decrypt.reset_mock()
+    crypto.Encrypt.reset_mock()
+
+  def testLoadDoesNotDecrypt(self):
+    volume = volumes.FileVaultVolume.query().get()
+    volume.ToDict(skip_secret=True)
+
+    self.assertEqual(0, crypto.Decrypt.call_count)
+
+  def testDecryptOnceOnRead(self):
+    volume = volumes.FileVaultVolume.query().get()
+
+    self.assertEqual('secret', volume.passphrase)
+    self.assertEqual('secret', volume.passphrase)
+    self.assertEqual(1, crypto.Decrypt.call_count)
+
+  def testUpdateDoesNotDecryptOrEncrypt(self):
+    volume = volumes.FileVaultVolume.query().get()
+    volume.UpdateMutableProperty('force_rekeying', True)
+
+    self.assertEqual(0, crypto.Decrypt.call_count)
+    self.assertEqual(0, crypto.Encrypt.call_count)
+    self.assertEqual(
+        'secret', volumes.FileVaultVolume.query().get().passphrase)
+
+
 if __name__ == '__main__':
   absltest.main()
@@ -0,0 +1,186 @@
+// Copyright 2017 Google Inc. All Rights Reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS-IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+/**
+ * Server response to /logs/stats.
+ * @typedef {{
+ *    log_type: string,
+ *    total: number,
+ *    days: !Array<{date: string, total: number}>,
+ *    by_user: !Object<string, number>,
+ *    by_action: !Object<string, number>,
+ *    by_outcome: !Object<string, number>,
+ *    by_target: !Object<string, number>,
+ * }}
+ */
+let AccessLogStatsServerResponse_;
+
+
+/**
+ * Counts shown per breakdown, the most frequent first.
+ */
+const MAX_BREAKDOWN_ROWS_ = 10;
+
+
+/**
+ * Days covered when the page is opened.
+ */
+const DEFAULT_STATS_DAYS_ = 90;
+
+
+const BREAKDOWN_TITLES_ = {
+  by_user: 'User',
+  by_action: 'Action',
+  by_outcome: 'Outcome',
+  by_target: 'Target',
+};
+
+
+/**
+ * @param {!Date} date
+ * @return {string} date formatted as YYYY-MM-DD, in UTC.
+ */
+function formatStatsDate_(date) {
+  return date.toISOString().substr(0, 10);
+}
+
+
+/**
+ * Daily access counts of a log type, read from the rollups of logs older
+ * than the retention period.
+ * @polymer
+ */
+class CvAccessLogStats extends Polymer.Element {
+  constructor() {
+    super();
+
+    /** @type {string} */
+    this.logType;
+
+    let now = new Date();
+    /** @private {string} */
+    this.endDate_ = formatStatsDate_(now);
+
+    /** @private {string} */
+    this.startDate_ = formatStatsDate_(
+        new Date(now.getTime() - DEFAULT_STATS_DAYS_ * 24 * 3600 * 1000));
+
+    /** @private {boolean} */
+    this.loading_ = true;
+
+    /** @private {number} */
+    this.total_ = 0;
+
+    /** @private {!Array<{date: string, total: number}>} */
+    this.days_ = [];
+
+    /** @private {!Array<{title: string, rows: !Array}>} */
+    this.breakdowns_ = [];
+  }
+
+  /**
+   * @return {string} element identifier.
+   */
+  static get is() {
+    return 'cv-access-log-stats';
+  }
+
+  /**
+   * The properties of the Polymer element.
+   * @return {!PolymerElementProperties}
+   */
+  static get properties() {
+    return {
+      logType: String,
+      startDate_: String,
+      endDate_: String,
+      loading_: Boolean,
+      total_: Number,
+      days_: Array,
+      breakdowns_: Array,
+    };
+  }
+
+  /** @override */
+  static get observers() {
+    return [
+      'requestStats_(logType, startDate_, endDate_)',
+    ];
+  }
+
+  /**
+   * @param {string} logType
+   * @private
+   */
+  requestStats_(logType) {
+    if (logType) {
+      this.$.request.generateRequest();
+    }
+  }
+
+  /**
+   * @param {string} logType
+   * @param {string} startDate
+   * @param {string} endDate
+   * @return {!Object} query parameters of /logs/stats.
+   * @private
+   */
+  params_(logType, startDate, endDate) {
+    return {
+      log_type: logType,
+      start_date: startDate,
+      end_date: endDate,
+    };
+  }
+
+  /**
+   * @param {!Event} event
+   * @private
+   */
+  onNetworkError_(event) {
+    this.dispatchEvent(new CustomEvent(
+        'cv-network-error', {
+          detail: {data: event.detail.request.status},
+          bubbles: true,
+          composed: true,
+       }));
+  }
+
+  /**
+   * @param {!Event} event
+   * @private
+   */
+  onResponse_(event) {
+    const data =
+        /** @type {AccessLogStatsServerResponse_} */(event.detail.response);
+
+    let breakdowns = [];
+    for (let key in BREAKDOWN_TITLES_) {
+      let counts = data[key];
+      let rows = Object.keys(counts).map((name) => {
+        return {name: name, count: counts[name]};
+      });
+      rows.sort((a, b) => b.count - a.count);
+      breakdowns.push({
+        title: BREAKDOWN_TITLES_[key],
+        rows: rows.slice(0, MAX_BREAKDOWN_ROWS_),
+      });
+    }
+    this.total_ = data.total;
+    this.days_ = data.days;
+    this.breakdowns_ = breakdowns;
+  }
+}
+
+customElements.define(CvAccessLogStats.is, CvAccessLogStats);
@@ -48,11 +48,34 @@ let DomRepeatEvent_;
  *    change_owner_link: String,
  *    active: !Boolean,
  *    id: !String,
+ *    tag: !String,
+ *    history_count: number,
  * }}
  */
 let Volume_;
 
 
+/**
+ * Version in the server response to /history.
+ * @typedef {{
+ *    id: !String,
+ *    active: !Boolean,
+ *    created: String,
+ *    created_by: String,
+ *    tag: !String,
+ *    secret_changed: ?Boolean,
+ * }}
+ */
+let Version_;
+
+
+/**
+ * Distance in pixels from the bottom of the page at which the next page of
+ * results is requested.
+ */
+const SCROLL_THRESHOLD_ = 500;
+
+
 const HUMAN_READABLE_VOLUME_FIELD_NAME_ = {
   volume_uuid: 'Volume UUID',
   hostname: 'Hostname',
@@ -83,6 +106,13 @@ const IMPORTANT_FIELDS_ = [
  * @polymer
  */
 class CvSearchResult extends Polymer.Element {
+  constructor() {
+    super();
+
+    /** @private {function()} */
+    this.onScroll_ = this.maybeLoadMore_.bind(this);
+  }
+
   /**
    * @return {string} element identifier.
    */
@@ -114,9 +144,9 @@ class CvSearchResult extends Polymer.Element {
         value: false,
       },
 
-      tooManyResults_: {
-        type: Boolean,
-        value: false,
+      next_: {
+        type: String,
+        value: '',
       },
 
       resultsAccessWarning_: {
@@ -124,9 +154,12 @@ class CvSearchResult extends Polymer.Element {
         value: false,
       },
 
-      showInactive_: {
-        type: Boolean,
-        value: false,
+      /**
+       * Index in volumes_ of the volume whose history is being fetched.
+       */
+      historyIndex_: {
+        type: Number,
+        value: -1,
       },
 
       volumes_: {
@@ -145,6 +178,18 @@ class CvSearchResult extends Polymer.Element {
     };
   }
 
+  /** @override */
+  connectedCallback() {
+    super.connectedCallback();
+    window.addEventListener('scroll', this.onScroll_);
+  }
+
+  /** @override */
+  disconnectedCallback() {
+    super.disconnectedCallback();
+    window.removeEventListener('scroll', this.onScroll_);
+  }
+
   /** @override */
   static get observers() {
     return [
@@ -162,7 +207,10 @@ class CvSearchResult extends Polymer.Element {
       data: [],
       id: vol.id,
       uuid: vol.target_id,
-      inactive: !vol.active,
+      tag: vol.tag,
+      historyCount: vol.history_count,
+      history: [],
+      expanded: false,
       timestamp: (new Date(vol.created)).getTime(),
     };
     for (let k = 0; k < FIELD_ORDER_.length; k++) {
@@ -200,18 +248,51 @@ class CvSearchResult extends Polymer.Element {
     let data = response['passphrases'];
     let volumes = [];
 
-    this.resultsAccessWarning_ = response['results_access_warning'];
-    this.tooManyResults_ = response['too_many_results'];
+    // Only the first page tells whether results were omitted.
+    if (!this.next_) {
+      this.resultsAccessWarning_ = response['results_access_warning'];
+    }
     for (let volume of data) {
       volumes.push(this.prepareVolumeForTemplate_(volume));
     }
 
-    this.fields_ = [];
-    if (volumes.length) {
+    if (!this.fields_.length && volumes.length) {
       this.fields_ = volumes[0].data;
     }
 
-    this.volumes_ = volumes;
+    this.volumes_ = this.volumes_.concat(volumes);
+    if (response['next']) {
+      this.next_ = encodeURIComponent(response['next']);
+    } else {
+      this.next_ = '';
+    }
+    // The page may still be too short to scroll.
+    this.maybeLoadMore_();
+  }
+
+  /**
+   * @param {string} next
+   * @param {boolean} loading
+   * @return {boolean}
+   * @private
+   */
+  showLoadMore_(next, loading) {
+    return Boolean(next) && !loading;
+  }
+
+  /** @private */
+  loadMore_() {
+    if (this.next_ && !this.loading_) {
+      this.$.request.generateRequest();
+    }
+  }
+
+  /** @private */
+  maybeLoadMore_() {
+    let bottom = window.innerHeight + window.pageYOffset;
+    if (bottom >= document.body.offsetHeight - SCROLL_THRESHOLD_) {
+      this.loadMore_();
+    }
   }
 
   /**
@@ -246,19 +327,85 @@ class CvSearchResult extends Polymer.Element {
   }
 
   /**
-   * @param {!Boolean} inactive
-   * @param {!Boolean} showInactive
+   * @param {number} historyCount
+   * @return {boolean}
+   * @private
+   */
+  hasHistory_(historyCount) {
+    return historyCount > 1;
+  }
+
+  /**
+   * @param {boolean} expanded
    * @return {string}
    * @private
    */
-  cssClassForVolume_(inactive, showInactive) {
-    if (inactive) {
-      if (showInactive) {
-        return 'grey';
-      }
-      return 'hidden';
+  historyIcon_(expanded) {
+    return expanded ? 'icons:expand-less' : 'icons:history';
+  }
+
+  /**
+   * Shows or hides the older versions of a volume, fetching them on first
+   * expansion.
+   * @param {!DomRepeatEvent_} e
+   * @private
+   */
+  toggleHistory_(e) {
+    let index = this.volumes_.indexOf(e.model.volume);
+    let volume = this.volumes_[index];
+    this.set(['volumes_', index, 'expanded'], !volume.expanded);
+    if (volume.history.length || this.historyIndex_ != -1) {
+      return;
+    }
+    this.historyIndex_ = index;
+    this.requestHistory_('');
+  }
+
+  /**
+   * @param {string} next
+   * @private
+   */
+  requestHistory_(next) {
+    let volume = this.volumes_[this.historyIndex_];
+    this.$.historyRequest.url = '/history/' + this.searchType + '/' +
+        encodeURIComponent(volume.uuid) + '?tag=' +
+        encodeURIComponent(volume.tag) + '&next=' + encodeURIComponent(next);
+    this.$.historyRequest.generateRequest();
+  }
+
+  /**
+   * @param {!Event} event
+   * @private
+   */
+  onHistoryResponse_(event) {
+    let response = /** @type {!Object} */(event.detail.response);
+    let index = this.historyIndex_;
+    if (index == -1) {
+      // The results were reset since the request.
+      return;
     }
-    return '';
+    let volume = this.volumes_[index];
+    let versions = /** @type {!Array<!Version_>} */(response['versions']);
+    let history = volume.history.slice();
+    for (let version of versions) {
+      history.push({
+        id: version.id,
+        uuid: volume.uuid,
+        active: version.active,
+        created: (new Date(version.created)).toLocaleString(),
+        createdBy: version.created_by,
+        secretKept: version.secret_changed === false,
+      });
+    }
+    if (response['next']) {
+      this.set(['volumes_', index, 'history'], history);
+      this.requestHistory_(response['next']);
+      return;
+    }
+    // The active version is the row itself.
+    this.set(
+        ['volumes_', index, 'history'], history.filter((v) => !v.active));
+    this.historyIndex_ = -1;
   }
 
   /**
@@ -280,6 +427,10 @@ class CvSearchResult extends Polymer.Element {
   /** @private */
   requestResults_() {
     if (this.searchType && this.field && this.value) {
+      this.next_ = '';
+      this.historyIndex_ = -1;
+      this.volumes_ = [];
+      this.fields_ = [];
       this.$.request.generateRequest();
     }
   }
@@ -294,6 +445,17 @@ class CvSearchResult extends Polymer.Element {
         '/' + volume.id;
     window.location = url;
   }
+
+  /**
+   * @param {!DomRepeatEvent_} e
+   * @private
+   */
+  onRetrieveVersionClick_(e) {
+    let version = e.model.version;
+    let url = '/ui/#/retrieve/' + this.searchType + '/' + version.uuid +
+        '/' + version.id;
+    window.location = url;
+  }
 }
 
 customElements.define(CvSearchResult.is, CvSearchResult);
@@ -19,7 +19,7 @@ import mock
 import webtest
 
 from google.appengine.api import users
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
 from cauliflowervest import settings as base_settings
 from cauliflowervest.server import crypto
@@ -58,7 +58,7 @@ class AppleFirmwareHandlerTest(test_util.BaseTest):
             serial, hostname),
         params=password, status=httplib.OK)
 
-    passwords = firmware.AppleFirmwarePassword.all().fetch(None)
+    passwords = firmware.AppleFirmwarePassword.query().fetch(None)
 
     self.assertEqual(1, len(passwords))
     self.assertEqual(password, passwords[0].password)
@@ -93,7 +93,7 @@ class AppleFirmwarePasswordChangeOwnerTest(test_util.BaseTest):
     settings.KEY_TYPE_DEFAULT_XSRF = settings.KEY_TYPE_DATASTORE_XSRF
 
     self.user = base.User(
-        key_name='stub7@example.com', user=users.User('stub7@example.com'))
+        id='stub7@example.com', user=users.User('stub7@example.com'))
     self.user.apple_firmware_perms = [permissions.CHANGE_OWNER]
     self.user.put()
 
@@ -111,7 +111,7 @@ class AppleFirmwarePasswordChangeOwnerTest(test_util.BaseTest):
         hostname='somehost.local',
         platform_uuid=self.platform_uuid,
         created_by=users.User('stub7@example.com'))
-    return fvv.put()
+    return fvv.put().urlsafe()
 
   @property
   def change_owner_url(self):
@@ -133,7 +133,7 @@ class AppleFirmwarePasswordChangeOwnerTest(test_util.BaseTest):
 
   @mock.patch.dict(settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
   def testChangeOwnerForNonexistantUuid(self):
-    self.volume_id = db.Key.from_path('Testing', 'NonExistKeyTesting')
+    self.volume_id = ndb.Key('Testing', 'NonExistKeyTesting').urlsafe()
     self.testapp.post(self.change_owner_url, params={'new_owner': 'mew'},
                       status=httplib.NOT_FOUND)
 
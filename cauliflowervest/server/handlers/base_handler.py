@@ -34,7 +34,7 @@ def VerifyPermissions(required_permission, user, permission_type):
 
   Args:
     required_permission: permission string from permissions.*.
-    user: base.User entity; default current user.
+    user: base.User entity, or None for the current user.
     permission_type: string, one of permission.TYPE_* variables.
   Raises:
     errors.AccessDeniedError: there was a permissions issue.
@@ -42,6 +42,10 @@ def VerifyPermissions(required_permission, user, permission_type):
   if not permission_type:
     raise errors.AccessDeniedError('permission_type not specified')
 
+  if user is None:
+    # Uses the cached permissions rather than loading the User entity.
+    user = base.GetRequestContext()
+
   try:
     if not user.HasPerm(required_permission, permission_type=permission_type):
       raise errors.AccessDeniedError(
@@ -63,7 +67,7 @@ def VerifyAllPermissionTypes(required_permission, user=None):
     otherwise.
   """
   if user is None:
-    user = base.GetCurrentUser()
+    return base.GetRequestContext().PermissionTypesWith(required_permission)
 
   perms = {}
   for permission_type in permissions.TYPES:
@@ -82,6 +86,21 @@ class BaseHandler(webapp2.RequestHandler):
 
   AUDIT_LOG_MODEL = base.AccessLog
 
+  @property
+  def context(self):
+    """base.RequestContext of the request, shared by all helpers."""
+    return base.GetRequestContext()
+
+  def dispatch(self):
+    """Dispatches the request, then waits for pending AccessLog writes.
+
+    A failed write fails the request, so the response is never sent.
+    """
+    try:
+      super(BaseHandler, self).dispatch()
+    finally:
+      self.context.WaitForPendingWrites()
+
   def VerifyXsrfToken(self, action, email=None):
     """Verifies a valid XSRF token was passed for the current request.
 
@@ -110,8 +129,9 @@ class BaseHandler(webapp2.RequestHandler):
       debug_mode: True if the application is running in debug mode
     """
     if issubclass(exception.__class__, errors.Error):
-      self.AUDIT_LOG_MODEL.Log(
-          successful=False, message=exception.message, request=self.request)
+      self.AUDIT_LOG_MODEL.LogAsync(
+          successful=False, message=exception.message, request=self.request,
+          batchable=True)
 
       exc_type, exc_value, exc_tb = sys.exc_info()
       tb = traceback.format_exception(exc_type, exc_value, exc_tb)
@@ -17,12 +17,11 @@
 import httplib
 import logging
 
-from google.appengine.ext import db
+from google.appengine.api import datastore_errors
 
 from cauliflowervest import settings as base_settings
 from cauliflowervest.server import permissions
 from cauliflowervest.server.handlers import base_handler
-from cauliflowervest.server.models import base
 
 
 class ChangeOwnerHandler(base_handler.BaseHandler):
@@ -35,12 +34,11 @@ class ChangeOwnerHandler(base_handler.BaseHandler):
   def post(self, volume_key):
     """Handles POST requests."""
     try:
-      db_key = db.Key(volume_key)
-    except db.BadKeyError as e:
+      entity = self.SECRET_MODEL.GetByUrlsafeKey(volume_key)
+    except datastore_errors.BadKeyError as e:
       logging.warning('Bad volume_key "%s" provided: %s', volume_key, e)
       return self.error(httplib.NOT_FOUND)
 
-    entity = self.SECRET_MODEL.get(db_key)
     if not entity:
       return self.error(httplib.NOT_FOUND)
     if entity and not entity.active:
@@ -48,6 +46,6 @@ class ChangeOwnerHandler(base_handler.BaseHandler):
 
     self.VerifyXsrfToken(base_settings.CHANGE_OWNER_ACTION)
     base_handler.VerifyPermissions(
-        permissions.CHANGE_OWNER, base.GetCurrentUser(), self.PERMISSION_TYPE)
+        permissions.CHANGE_OWNER, None, self.PERMISSION_TYPE)
 
     entity.ChangeOwners([self.request.get('new_owner')])
@@ -21,7 +21,6 @@ from google.appengine.api import users
 from cauliflowervest.server import permissions
 from cauliflowervest.server import util
 from cauliflowervest.server.handlers import base_handler
-from cauliflowervest.server.models import base
 from cauliflowervest.server.models import volumes as models
 
 PROVISIONING_FILTER_SECONDS = 60 * 60 * 24
@@ -38,10 +37,10 @@ def ProvisioningVolumesForUser(user, time_s):
     list of entities created by user in the last n seconds.
   """
 
-  query = models.ProvisioningVolume.all()
-
   time = datetime.datetime.now() - datetime.timedelta(seconds=time_s)
-  query.filter('created_by' ' =', user).filter('created' ' >', time)
+  query = models.ProvisioningVolume.query(
+      models.ProvisioningVolume.created_by == user,
+      models.ProvisioningVolume.created > time)
   volumes = query.fetch(999)
   volumes.sort(key=lambda x: x.created, reverse=True)
   return volumes
@@ -54,9 +53,7 @@ class Created(base_handler.BaseHandler):
     """Handles GET requests."""
 
     base_handler.VerifyPermissions(
-        permissions.RETRIEVE_CREATED_BY,
-        base.GetCurrentUser(),
-        permissions.TYPE_PROVISIONING)
+        permissions.RETRIEVE_CREATED_BY, None, permissions.TYPE_PROVISIONING)
 
     volumes = ProvisioningVolumesForUser(users.get_current_user(),
                                          PROVISIONING_FILTER_SECONDS)
@@ -47,7 +47,7 @@ class CreatedModuleTest(test_util.BaseTest):
     secret1 = str(uuid.uuid4())
 
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         provisioning_perms=[],
         ).put()
 
@@ -86,7 +86,7 @@ class CreatedModuleTest(test_util.BaseTest):
       settings.DEFAULT_PERMISSIONS, {permissions.TYPE_PROVISIONING: ()})
   def testAccessDenied(self):
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         provisioning_perms=[],
         ).put()
 
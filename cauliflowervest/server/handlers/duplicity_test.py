@@ -31,7 +31,7 @@ class DuplicityRequestHandlerTest(test_util.BaseTest):
         'mock_owner', 'mock_volume_uuid', 'mock_secret')
     self.assertIsInstance(result, backups.DuplicityKeyPair)
     # check that _CreateNewSecretEntity did not put new entity into datastore
-    self.assertEqual(0, len(backups.DuplicityKeyPair.all().fetch(10)))
+    self.assertEqual(0, len(backups.DuplicityKeyPair.query().fetch(10)))
 
 
 if __name__ == '__main__':
@@ -22,7 +22,7 @@ from absl.testing import absltest
 import mock
 
 from google.appengine.api import users
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
 from cauliflowervest.server import main as gae_main
 from cauliflowervest.server import permissions
@@ -64,7 +64,7 @@ class FileVaultChangeOwnerAccessHandlerTest(test_util.BaseTest):
     self.volume_uuid = '4E6A59FF-3D85-4B1C-A5D5-70F8B8A9B4A0'
 
     self.user = base.User(
-        key_name='stub7@example.com', user=users.User('stub7@example.com'))
+        id='stub7@example.com', user=users.User('stub7@example.com'))
     self.user.filevault_perms = [permissions.CHANGE_OWNER]
     self.user.put()
 
@@ -78,7 +78,7 @@ class FileVaultChangeOwnerAccessHandlerTest(test_util.BaseTest):
         passphrase=passphrase,
         volume_uuid=self.volume_uuid,
         created_by=users.User('stub7@example.com'))
-    return fvv.put()
+    return fvv.put().urlsafe()
 
   @property
   def change_owner_url(self):
@@ -106,7 +106,7 @@ class FileVaultChangeOwnerAccessHandlerTest(test_util.BaseTest):
 
   @mock.patch.dict(settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
   def testChangeOwnerForNonexistantUuid(self):
-    self.volume_id = db.Key.from_path('Testing', 'NonExistKeyTesting')
+    self.volume_id = ndb.Key('Testing', 'NonExistKeyTesting').urlsafe()
     resp = gae_main.app.get_response(
         self.change_owner_url,
         {'REQUEST_METHOD': 'POST'},
@@ -21,7 +21,7 @@ import mock
 import webtest
 
 from google.appengine.api import users
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
 from cauliflowervest import settings as base_settings
 from cauliflowervest.server import crypto
@@ -62,7 +62,7 @@ class LinuxFirmwareHandlerTest(test_util.BaseTest):
         '&manufacturer=%s' % (serial, hostname, machine_uuid, manufacturer),
         params=password, status=httplib.OK)
 
-    passwords = firmware.LinuxFirmwarePassword.all().fetch(None)
+    passwords = firmware.LinuxFirmwarePassword.query().fetch(None)
 
     self.assertEqual(1, len(passwords))
     self.assertEqual(password, passwords[0].password)
@@ -85,7 +85,7 @@ class LinuxFirmwareHandlerTest(test_util.BaseTest):
           params=password, status=httplib.BAD_REQUEST)
       resp.mustcontain('secret is malformed')
 
-      passwords = firmware.LinuxFirmwarePassword.all().fetch(None)
+      passwords = firmware.LinuxFirmwarePassword.query().fetch(None)
       self.assertEqual(0, len(passwords))
 
   @mock.patch.dict(settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
@@ -119,7 +119,7 @@ class LinuxFirmwarePasswordChangeOwnerTest(test_util.BaseTest):
     settings.KEY_TYPE_DEFAULT_XSRF = settings.KEY_TYPE_DATASTORE_XSRF
 
     self.user = base.User(
-        key_name='stub7@example.com', user=users.User('stub7@example.com'))
+        id='stub7@example.com', user=users.User('stub7@example.com'))
     self.user.linux_firmware_perms = [permissions.CHANGE_OWNER]
     self.user.put()
 
@@ -137,7 +137,7 @@ class LinuxFirmwarePasswordChangeOwnerTest(test_util.BaseTest):
         hostname='somehost.local',
         machine_uuid=self.machine_uuid,
         created_by=users.User('stub7@example.com'))
-    return fvv.put()
+    return fvv.put().urlsafe()
 
   @property
   def change_owner_url(self):
@@ -165,7 +165,7 @@ class LinuxFirmwarePasswordChangeOwnerTest(test_util.BaseTest):
 
   @mock.patch.dict(settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
   def testChangeOwnerForNonexistantUuid(self):
-    self.volume_id = db.Key.from_path('Testing', 'NonExistKeyTesting')
+    self.volume_id = ndb.Key('Testing', 'NonExistKeyTesting').urlsafe()
     resp = gae_main.app.get_response(
         self.change_owner_url,
         {'REQUEST_METHOD': 'POST'},
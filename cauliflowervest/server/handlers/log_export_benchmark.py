@@ -0,0 +1,78 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of exporting a large number of access logs."""
+
+import datetime
+import resource
+import time
+
+
+
+from absl.testing import absltest
+import mock
+import webtest
+
+from google.appengine.ext import ndb
+
+from cauliflowervest.server import main as gae_main
+from cauliflowervest.server.handlers import base_handler
+from cauliflowervest.server.handlers import logs
+from cauliflowervest.server.handlers import test_util
+from cauliflowervest.server.models import volumes
+
+
+_ROWS = 1000000
+_PUT_BATCH_SIZE = 1000
+
+
+class ExportBenchmark(test_util.BaseTest):
+
+  def setUp(self):
+    super(ExportBenchmark, self).setUp()
+    self.testapp = webtest.TestApp(gae_main.app)
+    start = datetime.datetime(2017, 1, 1)
+    for i in xrange(0, _ROWS, _PUT_BATCH_SIZE):
+      ndb.put_multi([
+          volumes.LuksAccessLog(
+              mtime=start + datetime.timedelta(seconds=j),
+              message='GET', target_id='target%d' % j)
+          for j in xrange(i, i + _PUT_BATCH_SIZE)])
+      ndb.get_context().clear_cache()
+
+  @mock.patch.object(
+      base_handler, 'VerifyAllPermissionTypes', return_value={'luks': True})
+  def testExport(self, _):
+    for export_format in ('ndjson', 'csv'):
+      rows = 0
+      requests = 0
+      start_next = ''
+      started = time.time()
+      while True:
+        resp = self.testapp.get('/logs/export?format=%s&start_next=%s' % (
+            export_format, start_next))
+        rows += resp.body.count('\n')
+        requests += 1
+        start_next = resp.headers.get(logs.EXPORT_NEXT_HEADER)
+        if not start_next:
+          break
+      elapsed = time.time() - started
+
+      print '%s: %d rows in %d requests, %.0f rows/s, max RSS %d KiB' % (
+          export_format, rows, requests, rows / elapsed,
+          resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+if __name__ == '__main__':
+  absltest.main()
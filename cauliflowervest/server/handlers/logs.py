@@ -14,15 +14,159 @@
 
 """Module to view AccessLog entities."""
 
-from google.appengine.ext import db
+import base64
+import calendar
+import csv
+import datetime
+import heapq
+import itertools
+import json
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import users
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
 
 from cauliflowervest.server import permissions
 from cauliflowervest.server import util
 from cauliflowervest.server.handlers import base_handler
 from cauliflowervest.server.models import base
+from cauliflowervest.server.models import errors
 from cauliflowervest.server.models import util as models_util
 
 PER_PAGE = 25
+TIMELINE_PER_PAGE = 50
+# Logs per datastore batch, and batches per response of the export.
+EXPORT_BATCH_SIZE = 1000
+EXPORT_BATCHES_PER_REQUEST = 10
+
+EXPORT_FIELDS = (
+    'log_type', 'mtime', 'user', 'target_id', 'successful', 'message',
+    'query', 'ip_address')
+EXPORT_NEXT_HEADER = 'X-Export-Next'
+
+_LEGACY_START_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+_DATE_FORMAT = '%Y-%m-%d'
+
+
+def _ParseLegacyStart(start):
+  """Returns the mtime of a paginate_mtime start_next token, or None.
+
+  Tokens of older versions are '<mtime>_<counter>' strings, the
+  paginate_mtime of the last log of the page; continuing from them by mtime
+  keeps open pages working across the upgrade.
+  """
+  mtime = start.rsplit('_', 1)[0]
+  for fmt in (_LEGACY_START_FORMAT, _LEGACY_START_FORMAT[:-3]):
+    try:
+      return datetime.datetime.strptime(mtime, fmt)
+    except ValueError:
+      pass
+  return None
+
+
+def _LogToDict(log):
+  log_dict = log.to_dict(exclude=['paginate_mtime'])
+  log_dict['query'] = log_dict.pop('query_string')
+  log_dict['user'] = str(log_dict['user'])
+  log_dict['mtime'] = str(log_dict['mtime'])
+  return log_dict
+
+
+def _ParseTime(value):
+  """Parses a YYYY-MM-DDTHH:MM:SS UTC time, or returns None if empty."""
+  if not value:
+    return None
+  try:
+    return datetime.datetime.strptime(value, _TIME_FORMAT)
+  except ValueError:
+    raise errors.Error('time must be formatted as %s' % _TIME_FORMAT)
+
+
+def _ParseDate(value):
+  """Parses a YYYY-MM-DD date, or returns None if empty."""
+  if not value:
+    return None
+  try:
+    return datetime.datetime.strptime(value, _DATE_FORMAT).date()
+  except ValueError:
+    raise errors.Error('date must be formatted as %s' % _DATE_FORMAT)
+
+
+def _MasterLogTypes():
+  """Returns sorted log types the user has MASTER permission for."""
+  log_types = sorted(
+      t for t, allowed in base_handler.VerifyAllPermissionTypes(
+          permissions.MASTER).iteritems() if allowed)
+  if not log_types:
+    raise errors.AccessDeniedError(
+        'User lacks %s permission' % permissions.MASTER)
+  return log_types
+
+
+def _EncodeTimelineToken(cursors):
+  """Encodes dict of log type to urlsafe cursor, or '' at the first log."""
+  return base64.urlsafe_b64encode(json.dumps(cursors, sort_keys=True))
+
+
+def _DecodeTimelineToken(token):
+  try:
+    cursors = json.loads(base64.urlsafe_b64decode(str(token)))
+    return dict((t, Cursor(urlsafe=c) if c else None)
+                for t, c in cursors.iteritems())
+  except (TypeError, ValueError, AttributeError,
+          datastore_errors.BadValueError):
+    raise errors.Error('start_next is malformed')
+
+
+def _SortKey(log):
+  """Returns an int which sorts logs from the newest to the oldest."""
+  return -(calendar.timegm(log.mtime.utctimetuple()) * 1000000
+           + log.mtime.microsecond)
+
+
+def _ExportRow(log_type, log):
+  return {
+      'log_type': log_type,
+      'mtime': log.mtime.isoformat(),
+      'user': log.user.email() if log.user else None,
+      'target_id': log.target_id,
+      'successful': log.successful,
+      'message': log.message,
+      'query': log.query_string,
+      'ip_address': log.ip_address,
+  }
+
+
+def _EncodeExportToken(log_type, cursor):
+  return base64.urlsafe_b64encode(json.dumps(
+      [log_type, cursor.urlsafe() if cursor else '']))
+
+
+def _DecodeExportToken(token):
+  """Returns (log_type, Cursor or None) of an export start_next token."""
+  try:
+    log_type, cursor = json.loads(base64.urlsafe_b64decode(str(token)))
+    return log_type, Cursor(urlsafe=cursor) if cursor else None
+  except (TypeError, ValueError, datastore_errors.BadValueError):
+    raise errors.Error('start_next is malformed')
+
+
+@ndb.tasklet
+def _FetchWithCursorsAsync(query, limit, start_cursor):
+  """Fetches up to limit logs, with the cursor after each of them.
+
+  Returns:
+    Future of list of (log, Cursor) tuples.
+  """
+  it = query.iter(limit=limit, start_cursor=start_cursor,
+                  produce_cursors=True, batch_size=limit)
+  results = []
+  while (yield it.has_next_async()):
+    log = it.next()
+    results.append((log, it.cursor_after()))
+  raise ndb.Return(results)
 
 
 class Logs(base_handler.BaseHandler):
@@ -31,32 +175,43 @@ class Logs(base_handler.BaseHandler):
   def get(self):
     """Handles GET requests."""
     log_type = self.request.get('log_type')
-    base_handler.VerifyPermissions(
-        permissions.MASTER, base.GetCurrentUser(), log_type)
+    base_handler.VerifyPermissions(permissions.MASTER, None, log_type)
 
     start = self.request.get('start_next', None)
     log_model = models_util.TypeNameToLogModel(log_type)
-    logs_query = log_model.all()
+    logs_query = log_model.query()
 
     if self.request.get('only_errors', 'false') == 'true':
-      logs_query.filter('successful =', False)
+      logs_query = logs_query.filter(log_model.successful == False)  # pylint: disable=g-explicit-bool-comparison
 
-    logs_query.order('-paginate_mtime')
+    start_cursor = None
+    legacy_mtime = None
     if start:
-      logs_query.filter('paginate_mtime <', start)
+      legacy_mtime = _ParseLegacyStart(start)
+      if legacy_mtime:
+        # Logs may share the mtime of the last log of the previous page.
+        logs_query = logs_query.filter(log_model.mtime <= legacy_mtime)
+      else:
+        try:
+          start_cursor = Cursor(urlsafe=start)
+        except datastore_errors.BadValueError:
+          raise errors.Error('start_next is malformed')
 
-    logs = logs_query.fetch(PER_PAGE + 1)
-    more = len(logs) == PER_PAGE + 1
+    logs_query = logs_query.order(-log_model.mtime)
+    logs, next_cursor, more = logs_query.fetch_page(
+        PER_PAGE, start_cursor=start_cursor)
+    if legacy_mtime:
+      # Drops the logs of that mtime which were already on previous pages,
+      # which were ordered by paginate_mtime.
+      logs = [log for log in logs
+              if log.mtime != legacy_mtime or not log.paginate_mtime
+              or log.paginate_mtime < start]
     start_next = None
-    if more:
-      start_next = logs[-1].paginate_mtime
+    if more and next_cursor:
+      start_next = next_cursor.urlsafe()
 
-    logs = [db.to_dict(log) for log in logs[:PER_PAGE]]
-    for log in logs:
-      log['user'] = str(log['user'])
-      log['mtime'] = str(log['mtime'])
     params = {
-        'logs': logs,
+        'logs': [_LogToDict(log) for log in logs],
         'log_type': log_type,
         'more': more,
         'start': start,
@@ -64,3 +219,212 @@ class Logs(base_handler.BaseHandler):
     }
 
     self.response.out.write(util.ToSafeJson(params))
+
+
+class Timeline(base_handler.BaseHandler):
+  """Handler for /logs/timeline URL.
+
+  Returns the logs of all types the user has MASTER permission for, newest
+  first. Each log type is queried concurrently and the results are merged,
+  start_next holds a cursor per log type.
+  """
+
+  def _Query(self, log_model, start_time, end_time):
+    query = log_model.query()
+    email = self.request.get('user')
+    if email:
+      query = query.filter(log_model.user == users.User(email))
+    target_id = self.request.get('target_id')
+    if target_id:
+      query = query.filter(log_model.target_id == target_id)
+    if self.request.get('only_errors', 'false') == 'true':
+      query = query.filter(log_model.successful == False)  # pylint: disable=g-explicit-bool-comparison
+    if start_time:
+      query = query.filter(log_model.mtime >= start_time)
+    if end_time:
+      query = query.filter(log_model.mtime < end_time)
+    return query.order(-log_model.mtime)
+
+  def get(self):
+    """Handles GET requests."""
+    log_types = _MasterLogTypes()
+
+    start_time = _ParseTime(self.request.get('start_time'))
+    end_time = _ParseTime(self.request.get('end_time'))
+    start = self.request.get('start_next')
+    if start:
+      cursors = _DecodeTimelineToken(start)
+    else:
+      cursors = dict.fromkeys(log_types)
+    # Log types missing from the token have no logs left.
+    log_types = sorted(t for t in log_types if t in cursors)
+
+    # One more log than fits on the page tells if a type has logs left.
+    limit = TIMELINE_PER_PAGE + 1
+    futures = [
+        _FetchWithCursorsAsync(
+            self._Query(models_util.TypeNameToLogModel(t), start_time,
+                        end_time),
+            limit, cursors[t])
+        for t in log_types]
+    results = [f.get_result() for f in futures]
+
+    # Each stream is sorted already, so heapq.merge() does a k-way merge.
+    streams = [
+        [(_SortKey(log), i, j) for j, (log, _) in enumerate(fetched)]
+        for i, fetched in enumerate(results)]
+    page = list(itertools.islice(heapq.merge(*streams), TIMELINE_PER_PAGE))
+
+    consumed = [0] * len(log_types)
+    for _, i, j in page:
+      consumed[i] = j + 1
+
+    next_cursors = {}
+    for i, log_type in enumerate(log_types):
+      fetched = results[i]
+      if consumed[i] == len(fetched) and len(fetched) < limit:
+        continue  # No logs left.
+      if consumed[i]:
+        next_cursors[log_type] = fetched[consumed[i] - 1][1].urlsafe()
+      else:
+        cursor = cursors[log_type]
+        next_cursors[log_type] = cursor.urlsafe() if cursor else ''
+
+    logs = []
+    for _, i, j in page:
+      log_dict = _LogToDict(results[i][j][0])
+      log_dict['log_type'] = log_types[i]
+      logs.append(log_dict)
+    params = {
+        'logs': logs,
+        'more': bool(next_cursors),
+        'start': start,
+        'start_next': (
+            _EncodeTimelineToken(next_cursors) if next_cursors else None),
+    }
+
+    self.response.out.write(util.ToSafeJson(params))
+
+
+class Export(base_handler.BaseHandler):
+  """Handler for /logs/export URL.
+
+  Exports the logs of all types the user has MASTER permission for, one
+  type after the other and oldest first, as NDJSON or CSV. Each response
+  holds at most EXPORT_BATCHES_PER_REQUEST batches; if logs are left, the
+  EXPORT_NEXT_HEADER header holds the start_next token of the next response.
+  """
+
+  def _WriteNdjson(self, rows):
+    for row in rows:
+      self.response.out.write(json.dumps(row, sort_keys=True))
+      self.response.out.write('\n')
+
+  def _WriteCsv(self, rows, header):
+    writer = csv.writer(self.response.out)
+    if header:
+      writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+      writer.writerow([
+          unicode(row[f]).encode('utf-8') if row[f] is not None else ''
+          for f in EXPORT_FIELDS])
+
+  def get(self):
+    """Handles GET requests."""
+    log_types = _MasterLogTypes()
+
+    export_format = self.request.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+      raise errors.Error('format must be ndjson or csv')
+    start_time = _ParseTime(self.request.get('start_time'))
+    end_time = _ParseTime(self.request.get('end_time'))
+
+    start = self.request.get('start_next')
+    log_type, cursor = log_types[0], None
+    if start:
+      log_type, cursor = _DecodeExportToken(start)
+      if log_type not in log_types:
+        raise errors.AccessDeniedError(
+            'User lacks %s permission' % permissions.MASTER)
+
+    if export_format == 'csv':
+      self.response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+    else:
+      self.response.headers['Content-Type'] = 'application/x-ndjson'
+    self.response.headers['Content-Disposition'] = (
+        'attachment; filename="access_logs.%s"' % export_format)
+
+    header = not start
+    next_token = None
+    for _ in xrange(EXPORT_BATCHES_PER_REQUEST):
+      log_model = models_util.TypeNameToLogModel(log_type)
+      query = log_model.query()
+      if start_time:
+        query = query.filter(log_model.mtime >= start_time)
+      if end_time:
+        query = query.filter(log_model.mtime < end_time)
+      query = query.order(log_model.mtime)
+      logs, next_cursor, more = query.fetch_page(
+          EXPORT_BATCH_SIZE, start_cursor=cursor)
+
+      rows = [_ExportRow(log_type, log) for log in logs]
+      if export_format == 'csv':
+        self._WriteCsv(rows, header)
+      else:
+        self._WriteNdjson(rows)
+      header = False
+
+      i = log_types.index(log_type) + 1
+      if more and next_cursor:
+        cursor = next_cursor
+      elif i < len(log_types):
+        log_type, cursor = log_types[i], None
+      else:
+        next_token = None
+        break
+      next_token = _EncodeExportToken(log_type, cursor)
+
+    if next_token:
+      self.response.headers[EXPORT_NEXT_HEADER] = next_token
+
+
+
+class Stats(base_handler.BaseHandler):
+  """Handler for /logs/stats URL.
+
+  Sums the daily summaries of logs which were rolled up and deleted after
+  ACCESS_LOG_RETENTION_DAYS, so long time ranges are covered without
+  reading any logs.
+  """
+
+  def get(self):
+    """Handles GET requests."""
+    log_type = self.request.get('log_type')
+    if log_type not in permissions.TYPES:
+      raise errors.Error('unknown log_type: %s' % log_type)
+    base_handler.VerifyPermissions(permissions.MASTER, None, log_type)
+    start_date = _ParseDate(self.request.get('start_date'))
+    end_date = _ParseDate(self.request.get('end_date'))
+
+    model = base.AccessLogDailySummary
+    query = model.query(model.log_type == log_type)
+    if start_date:
+      query = query.filter(model.date >= start_date)
+    if end_date:
+      query = query.filter(model.date < end_date)
+
+    stats = {
+        'log_type': log_type, 'total': 0, 'days': [],
+        'by_user': {}, 'by_action': {}, 'by_outcome': {}, 'by_target': {},
+    }
+    for summary in query.order(model.date):
+      if not summary.complete:
+        continue
+      stats['total'] += summary.total
+      stats['days'].append(
+          {'date': summary.date.isoformat(), 'total': summary.total})
+      for prop in ('by_user', 'by_action', 'by_outcome', 'by_target'):
+        for name, count in (getattr(summary, prop) or {}).iteritems():
+          stats[prop][name] = stats[prop].get(name, 0) + count
+
+    self.response.out.write(util.ToSafeJson(stats))
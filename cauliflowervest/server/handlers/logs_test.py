@@ -12,16 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import csv
+import datetime
+import httplib
+import json
+
 
 
 from absl.testing import absltest
 import mock
 import webtest
 
+from google.appengine.api import users
+
 from cauliflowervest.server import main as gae_main
 from cauliflowervest.server import util
 from cauliflowervest.server.handlers import base_handler
+from cauliflowervest.server.handlers import logs
 from cauliflowervest.server.handlers import test_util
+from cauliflowervest.server.models import base
 from cauliflowervest.server.models import volumes
 
 
@@ -42,12 +51,15 @@ class LogsModuleTest(test_util.BaseTest):
     self.volume.put()
     volumes.LuksAccessLog.Log(entity=self.volume, message='PUT')
     volumes.LuksAccessLog.Log(
-        entity=self.volume, message='PUT', successful=False)
+        entity=self.volume, message='PUT', successful=False,
+        query_string='/luks/vol_uuid?')
 
     resp = util.FromSafeJson(self.testapp.get('/logs?log_type=luks').body)
 
     self.assertEqual('luks', resp['log_type'])
     self.assertEqual(2, len(resp['logs']))
+    self.assertEqual(
+        {None, '/luks/vol_uuid?'}, {log['query'] for log in resp['logs']})
 
   @mock.patch.object(base_handler, 'VerifyPermissions')
   def testShowOnlyErrors(self, _):
@@ -62,6 +74,223 @@ class LogsModuleTest(test_util.BaseTest):
     self.assertEqual('luks', resp['log_type'])
     self.assertEqual(1, len(resp['logs']))
 
+  @mock.patch.dict(logs.__dict__, {'PER_PAGE': 2})
+  @mock.patch.object(base_handler, 'VerifyPermissions')
+  def testPagination(self, _):
+    self.volume.put()
+    for i in range(5):
+      volumes.LuksAccessLog(
+          message=str(i), mtime=datetime.datetime(2017, 1, 1, 0, 0, i)).put()
+
+    messages = []
+    start_next = ''
+    while True:
+      resp = util.FromSafeJson(self.testapp.get(
+          '/logs?log_type=luks&start_next=%s' % start_next).body)
+      messages += [log['message'] for log in resp['logs']]
+      if not resp['more']:
+        break
+      start_next = resp['start_next']
+
+    self.assertEqual(['4', '3', '2', '1', '0'], messages)
+
+  @mock.patch.object(base_handler, 'VerifyPermissions')
+  def testLegacyStartNext(self, _):
+    for i in range(3):
+      volumes.LuksAccessLog(
+          message=str(i), mtime=datetime.datetime(2017, 1, 1, 0, 0, i)).put()
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/logs?log_type=luks&start_next=2017-01-01%2000:00:02_17').body)
+
+    self.assertEqual(['1', '0'], [log['message'] for log in resp['logs']])
+    self.assertFalse(resp['more'])
+
+  @mock.patch.object(base_handler, 'VerifyPermissions')
+  def testLegacyStartNextSharedMtime(self, _):
+    mtime = datetime.datetime(2017, 1, 1, 0, 0, 2)
+    for i in range(3):
+      volumes.LuksAccessLog(
+          message=str(i), mtime=mtime,
+          paginate_mtime='%s_%d' % (mtime, i)).put()
+    volumes.LuksAccessLog(
+        message='old', mtime=datetime.datetime(2017, 1, 1, 0, 0, 1)).put()
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/logs?log_type=luks&start_next=2017-01-01%2000:00:02_1').body)
+
+    self.assertEqual(['0', 'old'], [log['message'] for log in resp['logs']])
+
+  @mock.patch.object(base_handler, 'VerifyPermissions')
+  def testMalformedStartNext(self, _):
+    self.testapp.get(
+        '/logs?log_type=luks&start_next=foo', status=httplib.BAD_REQUEST)
+
+
+@mock.patch.object(
+    base_handler, 'VerifyAllPermissionTypes',
+    return_value={'luks': True, 'filevault': True, 'bitlocker': False})
+class TimelineTest(test_util.BaseTest):
+
+  def setUp(self):
+    super(TimelineTest, self).setUp()
+    self.testapp = webtest.TestApp(gae_main.app)
+
+  def _Log(self, log_model, second, **kwargs):
+    log_model(mtime=datetime.datetime(2017, 1, 1, 0, 0, second),
+              message=str(second), **kwargs).put()
+
+  def _GetAll(self, query=''):
+    messages = []
+    start_next = ''
+    while True:
+      resp = util.FromSafeJson(self.testapp.get(
+          '/logs/timeline?start_next=%s&%s' % (start_next, query)).body)
+      messages += [(l['log_type'], l['message']) for l in resp['logs']]
+      if not resp['more']:
+        return messages
+      start_next = resp['start_next']
+
+  @mock.patch.dict(logs.__dict__, {'TIMELINE_PER_PAGE': 2})
+  def testMerge(self, _):
+    for second in (1, 4, 5):
+      self._Log(volumes.LuksAccessLog, second)
+    for second in (0, 2, 3):
+      self._Log(volumes.FileVaultAccessLog, second)
+    self._Log(volumes.BitLockerAccessLog, 6)
+
+    self.assertEqual(
+        [('luks', '5'), ('luks', '4'), ('filevault', '3'),
+         ('filevault', '2'), ('luks', '1'), ('filevault', '0')],
+        self._GetAll())
+
+  def testFilters(self, _):
+    other = users.User('other@example.com')
+    self._Log(volumes.LuksAccessLog, 1, target_id='t1', user=other)
+    self._Log(volumes.LuksAccessLog, 2, target_id='t2')
+    self._Log(volumes.FileVaultAccessLog, 3, target_id='t1', user=other,
+              successful=False)
+    self._Log(volumes.FileVaultAccessLog, 4, user=other)
+
+    self.assertEqual(
+        [('filevault', '3'), ('luks', '1')], self._GetAll('target_id=t1'))
+    self.assertEqual(
+        [('filevault', '3')], self._GetAll('only_errors=true'))
+    self.assertEqual(
+        [('filevault', '4'), ('filevault', '3'), ('luks', '1')],
+        self._GetAll('user=other@example.com'))
+    self.assertEqual(
+        [('filevault', '3'), ('luks', '2')],
+        self._GetAll('start_time=2017-01-01T00:00:02'
+                     '&end_time=2017-01-01T00:00:04'))
+    self.assertEqual(
+        [('filevault', '3')],
+        self._GetAll('user=other@example.com&target_id=t1'
+                     '&start_time=2017-01-01T00:00:02'))
+
+  def testMalformedTime(self, _):
+    self.testapp.get(
+        '/logs/timeline?start_time=yesterday', status=httplib.BAD_REQUEST)
+
+  def testMalformedStartNext(self, _):
+    self.testapp.get(
+        '/logs/timeline?start_next=foo', status=httplib.BAD_REQUEST)
+
+  def testAccessDenied(self, verify_all_permission_types):
+    verify_all_permission_types.return_value = {'luks': False}
+    self.testapp.get('/logs/timeline', status=httplib.FORBIDDEN)
+
+
+@mock.patch.object(
+    base_handler, 'VerifyAllPermissionTypes',
+    return_value={'luks': True, 'filevault': True, 'bitlocker': False})
+@mock.patch.dict(logs.__dict__, {
+    'EXPORT_BATCH_SIZE': 2, 'EXPORT_BATCHES_PER_REQUEST': 1})
+class ExportTest(test_util.BaseTest):
+
+  def setUp(self):
+    super(ExportTest, self).setUp()
+    self.testapp = webtest.TestApp(gae_main.app)
+    for second in (1, 2, 3):
+      volumes.LuksAccessLog(
+          mtime=datetime.datetime(2017, 1, 1, 0, 0, second),
+          message='luks %d' % second, target_id='t%d' % second).put()
+    volumes.FileVaultAccessLog(
+        mtime=datetime.datetime(2017, 1, 1), message='filevault').put()
+    volumes.BitLockerAccessLog(
+        mtime=datetime.datetime(2017, 1, 1), message='bitlocker').put()
+
+  def _Export(self, query):
+    bodies = []
+    start_next = ''
+    while True:
+      resp = self.testapp.get(
+          '/logs/export?start_next=%s&%s' % (start_next, query))
+      bodies.append(resp.body)
+      start_next = resp.headers.get(logs.EXPORT_NEXT_HEADER)
+      if not start_next:
+        return bodies
+
+  def testNdjson(self, _):
+    bodies = self._Export('format=ndjson')
+
+    self.assertEqual(3, len(bodies))
+    rows = [json.loads(l) for l in ''.join(bodies).splitlines()]
+    self.assertEqual(
+        ['filevault', 'luks 1', 'luks 2', 'luks 3'],
+        [r['message'] for r in rows])
+    self.assertEqual('luks', rows[1]['log_type'])
+    self.assertEqual('t1', rows[1]['target_id'])
+    self.assertEqual('stub7@example.com', rows[1]['user'])
+    self.assertEqual('2017-01-01T00:00:01', rows[1]['mtime'])
+
+  def testCsvTimeRange(self, _):
+    bodies = self._Export(
+        'format=csv&start_time=2017-01-01T00:00:02'
+        '&end_time=2017-01-01T00:00:04')
+
+    rows = list(csv.reader(''.join(bodies).splitlines()))
+    self.assertEqual(list(logs.EXPORT_FIELDS), rows[0])
+    self.assertEqual(['luks 2', 'luks 3'], [r[5] for r in rows[1:]])
+
+  def testUnknownFormat(self, _):
+    self.testapp.get('/logs/export?format=xml', status=httplib.BAD_REQUEST)
+
+
+@mock.patch.object(base_handler, 'VerifyPermissions')
+class StatsTest(test_util.BaseTest):
+
+  def setUp(self):
+    super(StatsTest, self).setUp()
+    self.testapp = webtest.TestApp(gae_main.app)
+    for day, complete in ((1, True), (2, True), (3, True), (4, False)):
+      date = datetime.date(2017, 1, day)
+      base.AccessLogDailySummary(
+          key=base.AccessLogDailySummary.KeyFor('luks', date),
+          log_type='luks', date=date, total=day, complete=complete,
+          by_user={'stub7@example.com': day}, by_action={'GET': day}).put()
+
+  def testStats(self, verify_permissions):
+    resp = util.FromSafeJson(self.testapp.get(
+        '/logs/stats?log_type=luks&start_date=2017-01-02'
+        '&end_date=2017-01-05').body)
+
+    verify_permissions.assert_called_once_with('master', None, 'luks')
+    self.assertEqual(5, resp['total'])
+    self.assertEqual(
+        [{'date': '2017-01-02', 'total': 2},
+         {'date': '2017-01-03', 'total': 3}], resp['days'])
+    self.assertEqual({'stub7@example.com': 5}, resp['by_user'])
+    self.assertEqual({'GET': 5}, resp['by_action'])
+
+  def testUnknownLogType(self, _):
+    self.testapp.get('/logs/stats?log_type=foo', status=httplib.BAD_REQUEST)
+
+  def testMalformedDate(self, _):
+    self.testapp.get(
+        '/logs/stats?log_type=luks&start_date=01/02/2017',
+        status=httplib.BAD_REQUEST)
+
 
 if __name__ == '__main__':
   absltest.main()
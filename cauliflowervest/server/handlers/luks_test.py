@@ -106,7 +106,7 @@ class NewLuksRequestHandlerTest(test_util.BaseTest):
     self.assertEqual(httplib.BAD_REQUEST, resp.status_int)
     self.assertEqual(
         'Unknown PUT',
-        volumes.LuksAccessLog.all().fetch(10)[0].message
+        volumes.LuksAccessLog.query().fetch(10)[0].message
         )
 
   def testPutWithBrokenFormEncodedPassphrase(self, *_):
@@ -18,8 +18,9 @@ import httplib
 import logging
 
 from google.appengine.api import users
-from google.appengine.ext import db
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import deferred
+from google.appengine.ext import ndb
 
 from cauliflowervest import settings as base_settings
 from cauliflowervest.server.handlers import base_handler
@@ -31,22 +32,24 @@ _BATCH_SIZE = 20
 _QUEUE_NAME = 'serial'
 
 
-@db.transactional()
-def _reinsert_entity(model, entity_key):
-  entity = model.get(entity_key)
+@ndb.transactional()
+def _reinsert_entity(entity_key):
+  entity = entity_key.get()
   entity.tag = getattr(entity, 'tag', 'default')
-  super(base.BasePassphrase, entity).put()
+  if not entity.secret_fingerprint:
+    entity.secret_fingerprint = entity.ComputeSecretFingerprint()
+  entity._PutWithSummary()  # pylint: disable=protected-access
 
 
 def _update_schema(model, cursor=None, num_updated=0):
   """Add tag field."""
-  query = model.all()
-  if cursor:
-    query.with_cursor(cursor)
+  start_cursor = Cursor(urlsafe=cursor) if cursor else None
+  keys, next_cursor, _ = model.query().fetch_page(
+      _BATCH_SIZE, start_cursor=start_cursor, keys_only=True)
 
   updated = 0
-  for p in query.fetch(limit=_BATCH_SIZE):
-    _reinsert_entity(model, p.key())
+  for key in keys:
+    _reinsert_entity(key)
     updated += 1
 
   if updated > 0:
@@ -55,7 +58,7 @@ def _update_schema(model, cursor=None, num_updated=0):
         'Put %d %s entities to Datastore for a total of %d',
         updated, model.ESCROW_TYPE_NAME, num_updated)
     deferred.defer(
-        _update_schema, model, cursor=query.cursor(),
+        _update_schema, model, cursor=next_cursor.urlsafe(),
         num_updated=num_updated, _queue=_QUEUE_NAME, _countdown=20)
   else:
     logging.info(
@@ -63,6 +66,84 @@ def _update_schema(model, cursor=None, num_updated=0):
         num_updated)
 
 
+@ndb.transactional()
+def _count_versions(model, target_id, tag, latest_key, versions):
+  """Sets the versions of a head, unless escrows changed it since counted."""
+  head = base.PassphraseHead.Get(model, target_id, tag)
+  if head is None:
+    head = base.PassphraseHead.Make(model, target_id, tag, latest_key)
+  elif head.versions is not None or head.latest != latest_key:
+    return
+  head.versions = versions
+  head.put()
+
+
+def _backfill_head_index(model, cursor=None, num_checked=0):
+  """Create missing base.PassphraseHead entities, and count versions."""
+  query = model.query(model.active == True)  # pylint: disable=g-explicit-bool-comparison
+  start_cursor = Cursor(urlsafe=cursor) if cursor else None
+  entities, next_cursor, _ = query.fetch_page(
+      _BATCH_SIZE, start_cursor=start_cursor)
+
+  target_property = getattr(model, model.TARGET_PROPERTY_NAME)
+  checked = 0
+  for p in entities:
+    checked += 1
+    keys = model.query(
+        model.tag == p.tag, target_property == p.target_id).order(
+            -model.created).fetch(keys_only=True)
+    if not keys:
+      # The query is eventually consistent, and may miss recent versions.
+      logging.warning(
+          'No %s versions found for %s, tag %s; skipping.',
+          model.ESCROW_TYPE_NAME, p.target_id, p.tag)
+      continue
+    _count_versions(model, p.target_id, p.tag, keys[0], len(keys))
+
+  if checked > 0:
+    num_checked += checked
+    logging.info(
+        'Checked %d %s entities for a total of %d',
+        checked, model.ESCROW_TYPE_NAME, num_checked)
+    deferred.defer(
+        _backfill_head_index, model, cursor=next_cursor.urlsafe(),
+        num_checked=num_checked, _queue=_QUEUE_NAME, _countdown=20)
+  else:
+    logging.info(
+        'BackfillHeadIndex complete for %s with %d checked!',
+        model.ESCROW_TYPE_NAME, num_checked)
+
+
+@ndb.transactional()
+def _reindex_entity(entity_key):
+  entity = entity_key.get()
+  # Puts recompute search_tokens.
+  super(base.BasePassphrase, entity).put()
+
+
+def _backfill_search_tokens(model, cursor=None, num_updated=0):
+  """Index entities put before search_tokens for substring search."""
+  start_cursor = Cursor(urlsafe=cursor) if cursor else None
+  keys, next_cursor, _ = model.query().fetch_page(
+      _BATCH_SIZE, start_cursor=start_cursor, keys_only=True)
+
+  for key in keys:
+    _reindex_entity(key)
+
+  if keys:
+    num_updated += len(keys)
+    logging.info(
+        'Indexed %d %s entities for a total of %d',
+        len(keys), model.ESCROW_TYPE_NAME, num_updated)
+    deferred.defer(
+        _backfill_search_tokens, model, cursor=next_cursor.urlsafe(),
+        num_updated=num_updated, _queue=_QUEUE_NAME, _countdown=20)
+  else:
+    logging.info(
+        'BackfillSearchTokens complete for %s with %d updates!',
+        model.ESCROW_TYPE_NAME, num_updated)
+
+
 class UpdateVolumesSchema(base_handler.BaseHandler):
   """Puts all Volumes entities so any new properties are created."""
 
@@ -79,3 +160,39 @@ class UpdateVolumesSchema(base_handler.BaseHandler):
           _update_schema, model, _queue=_QUEUE_NAME, _countdown=5)
 
     self.response.out.write('Schema migration successfully initiated.')
+
+
+class BackfillHeadIndex(base_handler.BaseHandler):
+  """Creates and counts PassphraseHead of passphrases escrowed before them."""
+
+  def get(self):
+    """Handles GET requests."""
+    self.VerifyXsrfToken(base_settings.MAINTENANCE_ACTION)
+
+    if not users.is_current_user_admin():
+      self.error(httplib.FORBIDDEN)
+      return
+
+    for model in util.AllModels():
+      deferred.defer(
+          _backfill_head_index, model, _queue=_QUEUE_NAME, _countdown=5)
+
+    self.response.out.write('Head index backfill successfully initiated.')
+
+
+class BackfillSearchTokens(base_handler.BaseHandler):
+  """Computes search_tokens of passphrases escrowed before them."""
+
+  def get(self):
+    """Handles GET requests."""
+    self.VerifyXsrfToken(base_settings.MAINTENANCE_ACTION)
+
+    if not users.is_current_user_admin():
+      self.error(httplib.FORBIDDEN)
+      return
+
+    for model in util.AllModels():
+      deferred.defer(
+          _backfill_search_tokens, model, _queue=_QUEUE_NAME, _countdown=5)
+
+    self.response.out.write('Search tokens backfill successfully initiated.')
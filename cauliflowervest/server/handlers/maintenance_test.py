@@ -31,6 +31,7 @@ from cauliflowervest.server import main as gae_main
 from cauliflowervest.server import settings
 from cauliflowervest.server.handlers import maintenance
 from cauliflowervest.server.handlers import test_util
+from cauliflowervest.server.models import base
 from cauliflowervest.server.models import volumes as models
 
 
@@ -64,7 +65,59 @@ class MaintenanceModuleTest(test_util.BaseTest):
     for task in tasks:
       deferred.run(task.payload)
 
-    self.assertEqual('v1', models.ProvisioningVolume.all().fetch(1)[0].tag)
+    self.assertEqual('v1', models.ProvisioningVolume.query().fetch(1)[0].tag)
+
+  @mock.patch.dict(
+      settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
+  @mock.patch.object(
+      maintenance.users, 'is_current_user_admin', return_value=True)
+  def testBackfillHeadIndex(self, _):
+    volume = test_util.MakeFileVaultVolume()
+    base.PassphraseHead.query().get(keys_only=True).delete()
+
+    self.testapp.get('/api/internal/maintenance/backfill_head_index')
+    test_util.RunAllDeferredTasks(self.testbed)
+    test_util.RunAllDeferredTasks(self.testbed)
+
+    self.assertEqual(
+        volume.key, base.PassphraseHead.GetLatestKey(
+            models.FileVaultVolume, volume.volume_uuid, 'default'))
+    self.assertEqual(1, base.PassphraseHead.Get(
+        models.FileVaultVolume, volume.volume_uuid, 'default').versions)
+
+  def testBackfillHeadIndexSkipsTargetsWithoutVersions(self):
+    volume = test_util.MakeFileVaultVolume()
+    base.PassphraseHead.query().get(keys_only=True).delete()
+    model = models.FileVaultVolume
+    active = model.query(model.active == True)  # pylint: disable=g-explicit-bool-comparison
+    # Like a versions query which does not see the entity yet.
+    versions = model.query(model.tag == 'not-indexed')
+
+    with mock.patch.object(model, 'query', side_effect=[active, versions]):
+      maintenance._backfill_head_index(model)
+
+    self.assertIsNone(base.PassphraseHead.Get(
+        model, volume.volume_uuid, 'default'))
+
+  @mock.patch.dict(
+      settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
+  @mock.patch.object(
+      maintenance.users, 'is_current_user_admin', return_value=True)
+  def testBackfillSearchTokens(self, _):
+    volume = test_util.MakeFileVaultVolume()
+    # Drops the tokens from the index, like entities put before them.
+    with mock.patch.object(
+        models.FileVaultVolume, '_ComputeSearchTokens', return_value=[]):
+      volume.UpdateMutableProperty('force_rekeying', True)
+    query = models.FileVaultVolume.query(
+        models.FileVaultVolume.search_tokens == 'serial:foo')
+    self.assertIsNone(query.get(keys_only=True))
+
+    self.testapp.get('/api/internal/maintenance/backfill_search_tokens')
+    test_util.RunAllDeferredTasks(self.testbed)
+    test_util.RunAllDeferredTasks(self.testbed)
+
+    self.assertEqual(volume.key, query.get(keys_only=True))
 
   @mock.patch.dict(
       settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
@@ -23,7 +23,6 @@ import StringIO
 
 from google.appengine.api import app_identity
 from google.appengine.api import datastore_errors
-from google.appengine.ext import db
 
 from cauliflowervest import settings as base_settings
 from cauliflowervest.server import permissions
@@ -123,7 +122,8 @@ class PassphraseHandler(base_handler.BaseHandler):
 
     secret = self.GetSecretFromBody()
     if not target_id or not secret:
-      self.AUDIT_LOG_MODEL.Log(message='Unknown PUT', request=self.request)
+      self.AUDIT_LOG_MODEL.LogAsync(
+          message='Unknown PUT', request=self.request, batchable=True)
       self.error(httplib.BAD_REQUEST)
       return
     if not self.IsValidSecret(secret):
@@ -180,7 +180,7 @@ class PassphraseHandler(base_handler.BaseHandler):
       raise errors.AccessError('target_id is required')
 
     entity = self._CreateNewSecretEntity(owner, target_id, secret)
-    for prop_name in entity.properties():
+    for prop_name in entity.PropertyNames():
       value = metadata.get(prop_name)
       if value:
         setattr(entity, prop_name, self.SanitizeEntityValue(prop_name, value))
@@ -196,7 +196,7 @@ class PassphraseHandler(base_handler.BaseHandler):
     except errors.DuplicateEntity:
       logging.info('Same data already in datastore.')
     else:
-      self.AUDIT_LOG_MODEL.Log(
+      self.AUDIT_LOG_MODEL.LogAsync(
           entity=entity, message='PUT', request=self.request)
 
     self.response.out.write('Secret successfully escrowed!')
@@ -210,22 +210,23 @@ class PassphraseHandler(base_handler.BaseHandler):
       errors.AccessDeniedError: user lacks any retrieval permissions.
       errors.AccessError: user lacks a specific retrieval permission.
     """
-    user = base.GetCurrentUser()
+    email = self.context.email
 
     try:
-      self.VerifyPermissions(permissions.RETRIEVE, user=user)
+      self.VerifyPermissions(permissions.RETRIEVE)
     except errors.AccessDeniedError:
       try:
-        self.VerifyPermissions(permissions.RETRIEVE_CREATED_BY, user=user)
-        if str(entity.created_by) not in str(user.user.email()):
+        self.VerifyPermissions(permissions.RETRIEVE_CREATED_BY)
+        if str(entity.created_by) not in email:
           raise
       except errors.AccessDeniedError:
-        self.VerifyPermissions(permissions.RETRIEVE_OWN, user=user)
-        if user.email not in entity.owners:
+        self.VerifyPermissions(permissions.RETRIEVE_OWN)
+        if email not in entity.owners:
           raise
 
-    if user.email not in entity.owners:
-      SendRetrievalEmail(self.PERMISSION_TYPE, entity, user)
+    if email not in entity.owners:
+      # Only the notification needs the User entity.
+      SendRetrievalEmail(self.PERMISSION_TYPE, entity, self.context.user)
 
   def RetrieveSecret(self, target_id):
     """Handles a GET request to retrieve a secret.
@@ -240,7 +241,7 @@ class PassphraseHandler(base_handler.BaseHandler):
 
     if self.request.get('id'):
       try:
-        entity = self.SECRET_MODEL.get(db.Key(self.request.get('id')))
+        entity = self.SECRET_MODEL.GetByUrlsafeKey(self.request.get('id'))
       except datastore_errors.BadKeyError:
         raise errors.AccessError('target_id is malformed')
     else:
@@ -253,7 +254,8 @@ class PassphraseHandler(base_handler.BaseHandler):
 
     self.CheckRetrieveAuthorizationAndNotifyOwner(entity=entity)
 
-    self.AUDIT_LOG_MODEL.Log(message='GET', entity=entity, request=self.request)
+    audit_log = self.AUDIT_LOG_MODEL.LogAsync(
+        message='GET', entity=entity, request=self.request)
 
     escrow_secret = str(entity.secret).strip()
 
@@ -281,6 +283,8 @@ class PassphraseHandler(base_handler.BaseHandler):
     if entity.active:
       entity.UpdateMutableProperty('force_rekeying', True)
 
+    # Never return a secret before its retrieval is logged.
+    audit_log.get_result()
     self.response.out.write(util.ToSafeJson(params))
 
   def _PassphraseTypeName(self, entity):
@@ -300,15 +304,15 @@ class PassphraseHandler(base_handler.BaseHandler):
       permission_type: optional, string, one of permission.TYPE_* variables. if
           omitted, self.PERMISSION_TYPE is used.
     Returns:
-      base.User object of the current user.
+      user, or the base.RequestContext of the current user; both have an
+      email attribute.
     Raises:
       errors.AccessDeniedError: there was a permissions issue.
     """
     permission_type = permission_type or self.PERMISSION_TYPE
 
-    if user is None:
-      user = base.GetCurrentUser()
-
+    # The current user is checked against the cached permissions, without
+    # loading the User entity.
     base_handler.VerifyPermissions(required_permission, user, permission_type)
 
-    return user
+    return user or self.context
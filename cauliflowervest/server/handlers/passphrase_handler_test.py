@@ -25,6 +25,7 @@ import webtest
 
 from google.appengine.api import users
 from google.appengine.ext import deferred
+from google.appengine.ext import ndb
 from google.appengine.ext import testbed
 
 from cauliflowervest import settings as base_settings
@@ -55,7 +56,7 @@ class GetTest(test_util.BaseTest):
   def testVolumeUuidValid(self):
     vol_uuid = str(uuid.uuid4()).upper()
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         filevault_perms=[permissions.RETRIEVE_OWN],
     ).put()
     models.FileVaultVolume(
@@ -71,7 +72,7 @@ class GetTest(test_util.BaseTest):
         '/filevault/%s?json=1' % vol_uuid, status=httplib.OK)
     self.assertIn('"passphrase": "stub_pass1"', resp.body)
 
-    volumes = models.FileVaultVolume.all().fetch(None)
+    volumes = models.FileVaultVolume.query().fetch(None)
     self.assertEqual(1, len(volumes))
     self.assertTrue(volumes[0].force_rekeying)
 
@@ -87,7 +88,7 @@ class PutTest(test_util.BaseTest):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4()).upper()
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         filevault_perms=[permissions.ESCROW],
     ).put()
 
@@ -103,8 +104,8 @@ class PutTest(test_util.BaseTest):
 
     self.assertIn('successfully escrowed', resp.body)
 
-    entity = models.FileVaultVolume.all().filter(
-        'owners =', 'stub9@example.com').get()
+    entity = models.FileVaultVolume.query(
+        models.FileVaultVolume.owners == 'stub9@example.com').get()
     self.assertIsNotNone(entity)
 
   @mock.patch.dict(settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
@@ -112,7 +113,7 @@ class PutTest(test_util.BaseTest):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4()).upper()
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         filevault_perms=[permissions.ESCROW],
     ).put()
 
@@ -127,8 +128,8 @@ class PutTest(test_util.BaseTest):
 
     self.assertIn('successfully escrowed', resp.body)
 
-    entity = models.FileVaultVolume.all().filter(
-        'hdd_serial =', '3uDR0LYQmN').get()
+    entity = models.FileVaultVolume.query(
+        models.FileVaultVolume.hdd_serial == '3uDR0LYQmN').get()
     self.assertIsNotNone(entity)
 
   @mock.patch.dict(settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
@@ -147,7 +148,7 @@ class PutTest(test_util.BaseTest):
         '/luks/%s?%s' % (volume_uuid, urllib.urlencode(params)), params=secret)
 
     self.assertEqual(httplib.OK, resp.status_int)
-    self.assertEqual(tag, models.LuksVolume.all().fetch(1)[0].tag)
+    self.assertEqual(tag, models.LuksVolume.query().fetch(1)[0].tag)
 
 
   @mock.patch.dict(settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
@@ -172,7 +173,7 @@ class PutTest(test_util.BaseTest):
     self.testapp.put('/luks/%s?%s' % (volume_uuid, urllib.urlencode(params)),
                      params=secret)
 
-    vols = models.LuksVolume.all().fetch(999)
+    vols = models.LuksVolume.query().fetch(999)
     self.assertEqual(1, len(vols))
     self.assertEqual('example2', vols[0].hostname)
     self.assertEqual(['zaspire@example.com', 'zerocool@example.com'],
@@ -191,7 +192,7 @@ class RetrieveSecretTest(test_util.BaseTest):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4())
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         luks_perms=[permissions.RETRIEVE_OWN],
     ).put()
     models.LuksVolume(
@@ -213,7 +214,7 @@ class RetrieveSecretTest(test_util.BaseTest):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4()) * 10
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         luks_perms=[permissions.RETRIEVE_OWN],
     ).put()
     models.LuksVolume(
@@ -242,7 +243,7 @@ class RetrieveSecretTest(test_util.BaseTest):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4())
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         filevault_perms=[permissions.RETRIEVE_CREATED_BY],
     ).put()
     models.FileVaultVolume(
@@ -265,7 +266,7 @@ class RetrieveSecretTest(test_util.BaseTest):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4())
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         filevault_perms=[permissions.RETRIEVE],
     ).put()
     volume_id = models.FileVaultVolume(
@@ -288,7 +289,7 @@ class RetrieveSecretTest(test_util.BaseTest):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4())
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         filevault_perms=[permissions.RETRIEVE_OWN],
     ).put()
     models.FileVaultVolume(
@@ -310,7 +311,7 @@ class RetrieveSecretTest(test_util.BaseTest):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4())
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         filevault_perms=[permissions.RETRIEVE_OWN],
     ).put()
     models.FileVaultVolume(
@@ -332,7 +333,7 @@ class RetrieveSecretTest(test_util.BaseTest):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4())
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         luks_perms=[permissions.RETRIEVE_OWN],
     ).put()
     models.LuksVolume(
@@ -353,7 +354,7 @@ class RetrieveSecretTest(test_util.BaseTest):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4())
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         luks_perms=[permissions.RETRIEVE_OWN],
     ).put()
     models.LuksVolume(
@@ -369,12 +370,37 @@ class RetrieveSecretTest(test_util.BaseTest):
                               status=httplib.OK)
     self.assertIn('"passphrase": "%s"' % secret, resp.body)
 
+  @mock.patch.dict(settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
+  def testRetrievalFailsIfNotLogged(self):
+    vol_uuid = str(uuid.uuid4()).upper()
+    secret = str(uuid.uuid4())
+    base.User(
+        id='stub7@example.com', user=users.get_current_user(),
+        luks_perms=[permissions.RETRIEVE_OWN],
+    ).put()
+    models.LuksVolume(
+        owners=['stub7'],
+        hdd_serial='stub',
+        hostname='stub',
+        passphrase=secret,
+        platform_uuid='stub',
+        volume_uuid=vol_uuid).put()
+
+    failed_put = ndb.Future()
+    failed_put.set_exception(ValueError('put failed'))
+    with mock.patch.object(util, 'SendEmail') as _:
+      with mock.patch.object(
+          base.AccessLog, 'put_async', return_value=failed_put):
+        resp = self.testapp.get('/luks/%s?json=1' % vol_uuid,
+                                status=httplib.INTERNAL_SERVER_ERROR)
+    self.assertNotIn(secret, resp.body)
+
   @mock.patch.dict(settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
   def testSilentRetrieve(self):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4())
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         luks_perms=[permissions.SILENT_RETRIEVE, permissions.RETRIEVE],
     ).put()
     models.LuksVolume(
@@ -394,7 +420,7 @@ class RetrieveSecretTest(test_util.BaseTest):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4())
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         provisioning_perms=[permissions.RETRIEVE_OWN],
     ).put()
     models.ProvisioningVolume(
@@ -433,7 +459,7 @@ class SendRetrievalEmailTest(test_util.BaseTest, parameterized.TestCase):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4())
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         email='stub7@example.com',
         provisioning_perms=[
             permissions.RETRIEVE, permissions.SILENT_RETRIEVE_WITH_AUDIT_EMAIL,
@@ -467,7 +493,7 @@ class SendRetrievalEmailTest(test_util.BaseTest, parameterized.TestCase):
     vol_uuid = str(uuid.uuid4()).upper()
     secret = str(uuid.uuid4())
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         email='stub7@example.com',
         provisioning_perms=[permissions.RETRIEVE],
         ).put()
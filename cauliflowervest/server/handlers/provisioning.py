@@ -19,7 +19,6 @@ import re
 from cauliflowervest.server import permissions
 from cauliflowervest.server import util
 from cauliflowervest.server.handlers import passphrase_handler
-from cauliflowervest.server.models import base
 from cauliflowervest.server.models import volumes as models
 
 
@@ -39,7 +38,6 @@ class Provisioning(passphrase_handler.PassphraseHandler):
     return 'Temporary password'
 
   def _CreateNewSecretEntity(self, owner, volume_uuid, secret):
-    user = base.GetCurrentUser()
     platform = self.request.get('platform')
     # Set default platform to Mac
     if not platform:
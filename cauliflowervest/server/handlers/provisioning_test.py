@@ -42,7 +42,7 @@ class ProvisioningHandlerTest(test_util.BaseTest):
     volume.platform_uuid = 'DOES_NOT_MATTER'
     volume.put()
 
-    volumes = models.ProvisioningVolume.all().fetch(2)
+    volumes = models.ProvisioningVolume.query().fetch(2)
     self.assertEqual(1, len(volumes))
     self.assertEqual(
         models.ProvisioningVolume.NormalizeHostname(hostname),
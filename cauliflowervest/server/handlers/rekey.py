@@ -20,7 +20,6 @@ from google.appengine.api import memcache
 
 from cauliflowervest.server import util
 from cauliflowervest.server.handlers import base_handler
-from cauliflowervest.server.models import base
 from cauliflowervest.server.models import util as models_util
 
 
@@ -29,7 +28,7 @@ class IsRekeyNeeded(base_handler.BaseHandler):
 
   def get(self, type_name, target_id):
     """Handles GET requests."""
-    user = base.GetCurrentUser()
+    email = self.context.email
     tag = self.request.get('tag', 'default')
 
     entity = models_util.TypeNameToModel(
@@ -42,9 +41,9 @@ class IsRekeyNeeded(base_handler.BaseHandler):
       self.response.write(util.ToSafeJson(False))
       return
 
-    if user.email not in entity.owners:
+    if email not in entity.owners:
       logging.warning(
-          'owner mismatch %s %s', entity.owners, user.email)
+          'owner mismatch %s %s', entity.owners, email)
       # Passphrase retrieval is necessary for rekeying so we abort.
       self.response.write(util.ToSafeJson(False))
       return
@@ -18,7 +18,6 @@ from cauliflowervest.server import permissions
 from cauliflowervest.server import service_factory
 from cauliflowervest.server import util
 from cauliflowervest.server.handlers import base_handler
-from cauliflowervest.server.models import base
 from cauliflowervest.server.models import firmware
 
 
@@ -27,14 +26,14 @@ class RetiredAssets(base_handler.BaseHandler):
 
   def get(self, serials):
     base_handler.VerifyPermissions(
-        permissions.RETRIEVE, base.GetCurrentUser(),
-        permissions.TYPE_APPLE_FIRMWARE)
+        permissions.RETRIEVE, None, permissions.TYPE_APPLE_FIRMWARE)
 
     inventory_service = service_factory.GetInventoryService()
     res = {
         'active': [],
         'retired': [],
     }
+    audit_logs = []
     for serial in serials.split(','):
       if not inventory_service.IsRetiredMac(serial):
         res['active'].append(serial)
@@ -42,11 +41,14 @@ class RetiredAssets(base_handler.BaseHandler):
 
       entity = firmware.AppleFirmwarePassword.GetLatestForTarget(serial)
       if entity:
-        firmware.AppleFirmwarePasswordAccessLog.Log(
-            message='GET', entity=entity, request=self.request)
+        audit_logs.append(firmware.AppleFirmwarePasswordAccessLog.LogAsync(
+            message='GET', entity=entity, request=self.request))
 
         res['retired'].append({'serial': serial, 'password': entity.password})
       else:
         res['retired'].append({'serial': serial, 'password': 'N/A'})
 
+    # Never return a password before its retrieval is logged.
+    for audit_log in audit_logs:
+      audit_log.get_result()
     self.response.write(util.ToSafeJson(res))
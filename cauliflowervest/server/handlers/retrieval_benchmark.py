@@ -0,0 +1,82 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Throughput benchmark of secret retrieval with and without async logging."""
+
+import httplib
+import timeit
+import uuid
+
+
+
+from absl.testing import absltest
+import mock
+import webtest
+
+from google.appengine.api import users
+
+from cauliflowervest.server import main as gae_main
+from cauliflowervest.server import permissions
+from cauliflowervest.server import settings
+from cauliflowervest.server import util
+from cauliflowervest.server.handlers import test_util
+from cauliflowervest.server.models import base
+from cauliflowervest.server.models import volumes
+
+
+_REQUESTS = 200
+
+_LogAsync = base.AccessLog.LogAsync.__func__
+
+
+def _SyncLogAsync(cls, *args, **kwargs):
+  """LogAsync as before the pipeline: the put is finished on return."""
+  future = _LogAsync(cls, *args, **kwargs)
+  future.get_result()
+  return future
+
+
+class RetrievalBenchmark(test_util.BaseTest):
+
+  def setUp(self):
+    super(RetrievalBenchmark, self).setUp()
+    self.testapp = webtest.TestApp(gae_main.app)
+    base.User(
+        id='stub7@example.com', user=users.get_current_user(),
+        luks_perms=[permissions.RETRIEVE_OWN],
+    ).put()
+    self.volume_uuid = str(uuid.uuid4()).upper()
+    volumes.LuksVolume(
+        owners=['stub7'], hdd_serial='stub', hostname='stub',
+        passphrase=str(uuid.uuid4()), platform_uuid='stub',
+        volume_uuid=self.volume_uuid).put()
+
+  def _Retrieve(self):
+    self.testapp.get(
+        '/luks/%s?json=1' % self.volume_uuid, status=httplib.OK)
+
+  @mock.patch.dict(settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
+  @mock.patch.object(util, 'SendEmail')
+  def testRetrievalThroughput(self, _):
+    with mock.patch.object(
+        base.AccessLog, 'LogAsync', classmethod(_SyncLogAsync)):
+      sync = timeit.timeit(self._Retrieve, number=_REQUESTS)
+    pipelined = timeit.timeit(self._Retrieve, number=_REQUESTS)
+
+    print 'Retrievals per second: %.1f synchronous, %.1f pipelined' % (
+        _REQUESTS / sync, _REQUESTS / pipelined)
+
+
+if __name__ == '__main__':
+  absltest.main()
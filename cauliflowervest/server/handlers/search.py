@@ -14,12 +14,18 @@
 
 """Module to handle searching for escrowed passphrases."""
 
+import collections
 import httplib
+import json
 import os
 import urllib
+from google.appengine.api import datastore_errors
 from google.appengine.api import users
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
 
 from cauliflowervest.server import permissions
+from cauliflowervest.server import search_cache
 from cauliflowervest.server import settings
 from cauliflowervest.server import util
 from cauliflowervest.server.handlers import base_handler
@@ -29,51 +35,529 @@ from cauliflowervest.server.models import errors
 from cauliflowervest.server.models import util as models_util
 
 
+# Results per page.
 MAX_PASSPHRASES_PER_QUERY = 250
+# Entities a page may read when some conditions are checked in Python.
+MAX_SCANNED_PER_QUERY = 10 * MAX_PASSPHRASES_PER_QUERY
 
+# search_type which searches every type with the field.
+SEARCH_TYPE_ALL = 'all'
 
-def _PassphrasesForQuery(model, search_field, value, prefix_search=False):
-  """Search a model for matching the string query.
+# fieldN/valueN pairs per search.
+MAX_SEARCH_PREDICATES = 4
+
+# Identifiers per bulk search request, and identifiers searched concurrently.
+BULK_SEARCH_MAX_VALUES = 5000
+BULK_SEARCH_BATCH_SIZE = 50
+
+# search_tokens filters of a substring search.
+MAX_SUBSTRING_TOKENS = 8
+
+# Versions of a target counted in history_count by latest_only searches.
+MAX_HISTORY_COUNT = 100
+
+# Versions per page of the History handler.
+MAX_VERSIONS_PER_PAGE = 100
+
+
+def _SubstringTokens(model, search_field, value):
+  """Returns search_tokens which every entity with substring value has."""
+  tokens = model.SearchTokens(search_field, value)
+  # Each filter adds an index to the merge join; matches are checked in
+  # Python anyway.
+  step = -(-len(tokens) // MAX_SUBSTRING_TOKENS)
+  return tokens[::step]
+
+
+class Predicate(collections.namedtuple(
+    'Predicate', ['field', 'value', 'mode'])):
+  """A condition on one search field.
+
+  Attributes:
+    field: str, search field name.
+    value: str, search term.
+    mode: str, one of EQUALS, PREFIX and SUBSTRING.
+  """
+
+  EQUALS = 'equals'
+  PREFIX = 'prefix'
+  SUBSTRING = 'substring'
+
+
+def _ResultValues(result, field):
+  """Returns the values of field in a search result dict, as a list."""
+  value = result[field]
+  if isinstance(value, list):
+    return value
+  if field == 'asset_tags':
+    # Firmware ToDict() joins asset tags.
+    return value.split(', ')
+  return [value]
+
+
+def _IndexName(properties):
+  return '(%s, -created)' % ', '.join(properties)
+
+
+def _PlanSearch(model, predicates, tag=None, owner=None, active_only=False):
+  """Turns search conditions into a datastore query.
+
+  Equality predicates are pushed into the query with every other condition,
+  which is ordered newest first; the datastore serves it by merging the
+  (property, -created) indexes in index.yaml. Substring predicates are
+  equality filters on the search_tokens n-grams of the substring, and so are
+  pushed down the same way; n-grams may occur apart, so results are checked
+  again.
+
+  Prefix predicates are inequality filters, which must be ordered by their
+  field first and need a composite index over all filtered properties. Only
+  (tag, field, -created) and (tag, active, field, -created) indexes are
+  declared, so a prefix predicate is pushed down only when no equality or
+  substring predicate is, and then it is the longest one. Owner and other
+  prefix conditions are checked in Python.
 
   Args:
     model: base.BasePassphrase model.
-    search_field: str, search field name.
-    value: str, search term.
-    prefix_search: boolean, True to perform a prefix search, False otherwise.
+    predicates: non-empty list of Predicate, all of which must match.
+    tag: str, tag to match, or None for any tag.
+    owner: str, email which must be one of the owners, or None.
+    active_only: boolean, True to skip inactive entities.
+  Returns:
+    tuple of ndb.Query, list of functions of a search result dict which
+    return False if the result must be skipped, and dict describing the plan
+    with the indexes serving the query, and the fields filtered in the query
+    and checked in Python.
+  """
+  equalities = []
+  prefixes = []
+  substrings = []
+  for predicate in predicates:
+    field, value = predicate.field, predicate.value
+    if field == 'created_by':
+      # created_by is a UserProperty, which is only searched by equality.
+      if '@' not in value:
+        value = '%s@%s' % (value, os.environ.get('AUTH_DOMAIN'))
+      equalities.append((field, users.User(value)))
+    elif predicate.mode == Predicate.SUBSTRING:
+      substrings.append((field, value))
+    else:
+      if field == 'hostname':
+        value = model.NormalizeHostname(value)
+      if predicate.mode == Predicate.PREFIX:
+        prefixes.append(('owners' if field == 'owner' else field, value))
+      elif field == 'owner':
+        if '@' not in value:
+          value = '%s@%s' % (value, settings.DEFAULT_EMAIL_DOMAIN)
+        equalities.append(('owners', value))
+      else:
+        equalities.append((field, value))
+
+  range_predicate = None
+  if prefixes and not equalities and not substrings:
+    range_predicate = max(prefixes, key=lambda p: len(p[1]))
+    prefixes.remove(range_predicate)
+
+  filters = []
+  checks = []
+  filtered = []
+  checked = []
+  if tag is not None:
+    filters.append(model.tag == tag)
+    filtered.append('tag')
+  if active_only:
+    filters.append(model.active == True)  # pylint: disable=g-explicit-bool-comparison
+    filtered.append('active')
+  range_filtered = list(filtered)
+
+  for field, value in equalities:
+    filters.append(ndb.GenericProperty(field) == value)
+    filtered.append(field)
+
+  for field, value in substrings:
+    needle = value.lower()
+    for token in _SubstringTokens(model, field, value):
+      filters.append(model.search_tokens == token)
+      filtered.append('search_tokens')
+    checks.append(
+        lambda result, field=field, needle=needle: needle in (
+            result[field].lower()))
+    checked.append(field)
+
+  for field, value in prefixes:
+    checks.append(
+        lambda result, field=field, value=value: any(
+            v.startswith(value) for v in _ResultValues(result, field)))
+    checked.append(field)
+
+  if owner:
+    if range_predicate:
+      checks.append(lambda result: owner in result['owners'])
+      checked.append('owners')
+    else:
+      filters.append(model.owners == owner)
+      filtered.append('owners')
+
+  if range_predicate:
+    field, value = range_predicate
+    prop = ndb.GenericProperty(field)
+    filters += [prop >= value, prop < value + u'\ufffd']
+    query = model.query(*filters).order(prop, -model.created)
+    filtered.append(field)
+    indexes = [_IndexName(range_filtered + [field])]
+  else:
+    query = model.query(*filters).order(-model.created)
+    # Each distinct property is served by its own index.
+    indexes = [_IndexName([p]) for p in sorted(set(filtered))]
+    if not indexes:
+      indexes = ['(-created)']
+
+  plan = {
+      'kind': model._get_kind(),  # pylint: disable=protected-access
+      'indexes': indexes,
+      'filtered': sorted(set(filtered)),
+      'checked': checked,
+  }
+  return query, checks, plan
+
+
+def _MakePredicate(search_field, value, prefix_search, substring_search):
+  """Returns the Predicate of search_field given its search flags."""
+  if substring_search:
+    mode = Predicate.SUBSTRING
+  elif prefix_search:
+    mode = Predicate.PREFIX
+  else:
+    mode = Predicate.EQUALS
+  return Predicate(search_field, value, mode)
+
+
+@ndb.tasklet
+def _FetchPageAsync(model, query, checks, start_cursor=None):
+  """Fetches a page of search results of query which pass all checks.
+
+  The query is keys-only, and results come from base.PassphraseSummary, so
+  no secret is read.
+
+  Args:
+    model: base.BasePassphrase model.
+    query: ndb.Query.
+    checks: list of functions of a search result dict which return False if
+        the result must be skipped.
+    start_cursor: datastore_query.Cursor of the page, or None for the first.
+  Returns:
+    ndb.Future of a tuple of list of dicts like
+    base.BasePassphrase.ToDict(skip_secret=True), Cursor of the next page and
+    boolean, True if there may be more results.
+  """
+  results = []
+  scanned = 0
+  cursor = None
+  it = query.iter(
+      keys_only=True, start_cursor=start_cursor, limit=MAX_SCANNED_PER_QUERY,
+      batch_size=MAX_PASSPHRASES_PER_QUERY, produce_cursors=True)
+  while len(results) < MAX_PASSPHRASES_PER_QUERY:
+    # Reads only as many keys as the page misses, so that the cursor of the
+    # next page is the one after the last key read.
+    keys = []
+    while (len(results) + len(keys) < MAX_PASSPHRASES_PER_QUERY
+           and (yield it.has_next_async())):
+      keys.append(it.next())
+    if not keys:
+      break
+    scanned += len(keys)
+    cursor = it.cursor_after()
+    page = yield base.PassphraseSummary.GetResultsAsync(model, keys)
+    results += [r for r in page if all(check(r) for check in checks)]
+  if not scanned:
+    raise ndb.Return(([], None, False))
+  # A page that read MAX_SCANNED_PER_QUERY keys may be short or empty, the
+  # next one continues the scan.
+  more = scanned >= MAX_SCANNED_PER_QUERY or (yield it.has_next_async())
+  raise ndb.Return((results, cursor, more))
+
+
+@ndb.tasklet
+def _HistoryCountAsync(model, target_id, tag):
+  """Returns ndb.Future of the number of versions of target_id and tag.
+
+  Only used for targets whose base.PassphraseHead does not count versions.
+  """
+  target_property = getattr(model, model.TARGET_PROPERTY_NAME)
+  count = yield model.query(
+      model.tag == tag, target_property == target_id).count_async(
+          MAX_HISTORY_COUNT)
+  raise ndb.Return(count)
+
+
+@ndb.tasklet
+def _PassphrasesPageAsync(model, predicates, tag=None, owner=None,
+                          active_only=False, start_cursor=None,
+                          latest_only=False):
+  """Search a model for matching the predicates, one page at a time.
+
+  Args:
+    model: base.BasePassphrase model.
+    predicates: non-empty list of Predicate, all of which must match.
+    tag: str, tag to match, or None for any tag.
+    owner: str, email which must be one of the owners, or None.
+    active_only: boolean, True to skip inactive entities.
+    start_cursor: datastore_query.Cursor of the page, or None for the first.
+    latest_only: boolean, True to return only the active version of each
+        target and tag, with the number of its versions as history_count,
+        up to MAX_HISTORY_COUNT.
+  Returns:
+    ndb.Future of a tuple of list of dicts like
+    base.BasePassphrase.ToDict(skip_secret=True), Cursor of the next page and
+    boolean, True if there may be more results.
+  """
+  # Only the latest version of a target and tag is active.
+  query, checks, _ = _PlanSearch(
+      model, predicates, tag=tag, owner=owner,
+      active_only=active_only or latest_only)
+  page = yield _FetchPageAsync(
+      model, query, checks, start_cursor=start_cursor)
+  if latest_only:
+    passphrases = page[0]
+    counts = yield base.PassphraseHead.GetVersionCountsAsync(
+        model, [(p['target_id'], p['tag']) for p in passphrases])
+    uncounted = [i for i, count in enumerate(counts) if count is None]
+    if uncounted:
+      queried = yield [
+          _HistoryCountAsync(
+              model, passphrases[i]['target_id'], passphrases[i]['tag'])
+          for i in uncounted]
+      for i, count in zip(uncounted, queried):
+        counts[i] = count
+    for passphrase, count in zip(passphrases, counts):
+      passphrase['history_count'] = min(count, MAX_HISTORY_COUNT)
+  raise ndb.Return(page)
+
+
+def _PassphrasesForQuery(model, search_field, value, prefix_search=False,
+                         tag=None, owner=None, active_only=False,
+                         substring_search=False, latest_only=False):
+  """Returns the first page of _PassphrasesPageAsync, without the cursor."""
+  predicate = _MakePredicate(
+      search_field, value, prefix_search, substring_search)
+  return _PassphrasesPageAsync(
+      model, [predicate], tag=tag, owner=owner, active_only=active_only,
+      latest_only=latest_only).get_result()[0]
+
+
+@ndb.tasklet
+def _CachedPageAsync(model, predicates, tag, active_only, start_cursor,
+                     latest_only):
+  """Like _PassphrasesPageAsync for all owners, through search_cache."""
+  generation = yield search_cache.GetGenerationAsync(model)
+  if generation is None:
+    page = yield _PassphrasesPageAsync(
+        model, predicates, tag=tag, active_only=active_only,
+        start_cursor=start_cursor, latest_only=latest_only)
+    raise ndb.Return(page)
+
+  conditions = [
+      [list(p) for p in predicates], tag, active_only, latest_only,
+      start_cursor.urlsafe() if start_cursor else None,
+      MAX_PASSPHRASES_PER_QUERY, MAX_SCANNED_PER_QUERY, MAX_SUBSTRING_TOKENS,
+      MAX_HISTORY_COUNT,
+  ]
+  cached = yield search_cache.GetAsync(model, generation, conditions)
+  if cached is not None:
+    passphrases, next_urlsafe, more = cached
+    next_cursor = Cursor(urlsafe=next_urlsafe) if next_urlsafe else None
+    raise ndb.Return((passphrases, next_cursor, more))
+
+  passphrases, next_cursor, more = yield _PassphrasesPageAsync(
+      model, predicates, tag=tag, active_only=active_only,
+      start_cursor=start_cursor, latest_only=latest_only)
+  yield search_cache.PutAsync(model, generation, conditions, (
+      passphrases, next_cursor.urlsafe() if next_cursor else None, more))
+  raise ndb.Return((passphrases, next_cursor, more))
+
+
+def _SearchOwners(models, email):
+  """Returns the models the user may search, and whose entities they see.
+
+  Args:
+    models: list of base.BasePassphrase models.
+    email: str, email of the user.
+  Returns:
+    dict of model to email which must be one of the owners of results, or
+    None if the user has SEARCH permission for the model.
+  Raises:
+    errors.AccessDeniedError: the user may search none of the models.
+  """
+  # Get the user's search and retrieve permissions for all permission types.
+  search_perms = base_handler.VerifyAllPermissionTypes(permissions.SEARCH)
+  retrieve_perms = base_handler.VerifyAllPermissionTypes(
+      permissions.RETRIEVE_OWN)
+  retrieve_created = base_handler.VerifyAllPermissionTypes(
+      permissions.RETRIEVE_CREATED_BY)
+
+  owners = {}
+  for model in models:
+    search_type = model.ESCROW_TYPE_NAME
+    if search_perms.get(search_type):
+      owners[model] = None
+    elif (retrieve_perms.get(search_type)
+          or retrieve_created.get(search_type)):
+      # Users without SEARCH only see entities they own.
+      owners[model] = email
+  if not owners:
+    raise errors.AccessDeniedError(
+        'User lacks %s permission' % ','.join(
+            m.ESCROW_TYPE_NAME for m in models))
+  return owners
+
+
+def _AddChangeOwnerLinks(model, passphrases):
+  if not model.ALLOW_OWNER_CHANGE:
+    return
+  for passphrase in passphrases:
+    if not passphrase['active']:
+      continue
+    link = '/api/internal/change-owner/%s/%s/' % (
+        model.ESCROW_TYPE_NAME, passphrase['id'])
+    passphrase['change_owner_link'] = link
+
+
+@ndb.tasklet
+def _BulkSearchAsync(model, predicate, tag, owner, active_only):
+  """Searches one value for the BulkSearch handler, with a single query.
+
+  Bulk searches bypass search_cache, whose pages are unlikely to be shared.
+  As in _SearchAsync, users who only see their own passphrases get them
+  from the unfiltered page when it holds every result, and from a query
+  filtered by owner otherwise.
+
   Returns:
-    list of entities of type base.BasePassphrase.
+    ndb.Future of a dict like the ones of _SearchAsync.
   """
-  query = model.all()
-
-  if search_field == 'created_by':
-    if '@' not in value:
-      value = '%s@%s' % (value, os.environ.get('AUTH_DOMAIN'))
-    value = users.User(value)
-  elif search_field == 'hostname':
-    value = model.NormalizeHostname(value)
-
-  if prefix_search and search_field != 'created_by':
-    if search_field == 'owner':
-      search_field = 'owners'
-    query.filter('%s >=' % search_field, value).filter(
-        '%s <' % search_field, value + u'\ufffd')
-  elif search_field == 'owner' and not prefix_search:
-    if '@' not in value:
-      value = '%s@%s' % (value, settings.DEFAULT_EMAIL_DOMAIN)
-    query.filter('owners =', value)
+  passphrases, next_cursor, more = yield _PassphrasesPageAsync(
+      model, [predicate], tag=tag, active_only=active_only)
+  skipped = False
+  # Owner of the query which served the page.
+  query_owner = None
+  if owner:
+    # Tells whether the owner filter hid entities of the first page.
+    skipped = any(owner not in v['owners'] for v in passphrases)
+    if not more:
+      passphrases = [v for v in passphrases if owner in v['owners']]
+    else:
+      query_owner = owner
+      passphrases, next_cursor, more = yield _PassphrasesPageAsync(
+          model, [predicate], tag=tag, owner=owner, active_only=active_only)
+
+  _AddChangeOwnerLinks(model, passphrases)
+  raise ndb.Return({
+      'passphrases': passphrases,
+      'next': next_cursor.urlsafe() if more and next_cursor else None,
+      'too_many_results': more,
+      'results_access_warning': skipped,
+      'query_plan': _PlanSearch(
+          model, [predicate], tag=tag, owner=query_owner,
+          active_only=active_only)[2],
+  })
+
+
+@ndb.tasklet
+def _SearchAsync(model, predicates, tag, owner, active_only, start_cursor,
+                 latest_only=False):
+  """Searches one model for the Search handler.
+
+  Pages for all owners are shared by users through search_cache. Users
+  who only see their own passphrases get theirs from the cached first page
+  when it holds every result, and from an uncached query otherwise.
+
+  Returns:
+    ndb.Future of a dict with the passphrases, next token, too_many_results,
+    results_access_warning and query_plan of the response.
+  """
+  shared = None
+  if not owner or not start_cursor:
+    shared = yield _CachedPageAsync(
+        model, predicates, tag, active_only, start_cursor, latest_only)
+
+  skipped = False
+  # Owner of the query which served the page.
+  query_owner = None
+  if not owner:
+    passphrases, next_cursor, more = shared
   else:
-    query.filter(search_field + ' =', value)
+    if shared is not None:
+      # Tells whether the owner filter hid entities of the first page.
+      skipped = any(owner not in v['owners'] for v in shared[0])
+    if shared is not None and not shared[2]:
+      passphrases = [v for v in shared[0] if owner in v['owners']]
+      next_cursor, more = None, False
+    else:
+      query_owner = owner
+      passphrases, next_cursor, more = yield _PassphrasesPageAsync(
+          model, predicates, tag=tag, owner=owner, active_only=active_only,
+          start_cursor=start_cursor, latest_only=latest_only)
+
+  _AddChangeOwnerLinks(model, passphrases)
+  raise ndb.Return({
+      'passphrases': passphrases,
+      'next': next_cursor.urlsafe() if more and next_cursor else None,
+      # Kept for clients which do not page through results.
+      'too_many_results': more,
+      'results_access_warning': skipped,
+      'query_plan': _PlanSearch(
+          model, predicates, tag=tag, owner=query_owner,
+          active_only=active_only or latest_only)[2],
+  })
+
 
-  if (model.ESCROW_TYPE_NAME == permissions.TYPE_PROVISIONING
-      and search_field == 'created_by'):
-    query.order('-created')
-  passphrases = query.fetch(MAX_PASSPHRASES_PER_QUERY)
-  passphrases.sort(key=lambda x: x.created, reverse=True)
-  return passphrases
+def _IsSearchable(model, predicate):
+  """Returns True if model has the field of predicate, with its mode."""
+  if predicate.field not in dict(model.SEARCH_FIELDS):
+    return False
+  return (predicate.mode != Predicate.SUBSTRING
+          or predicate.field in model.SUBSTRING_SEARCH_FIELDS)
 
 
 class Search(passphrase_handler.PassphraseHandler):
-  """Handler for /search URL."""
+  """Handler for /search URL.
+
+  Results match all of the field1/value1 to fieldN/valueN pairs given.
+  """
+
+  def _GetPredicates(self):
+    """Returns the Predicate of each fieldN/valueN pair of the request.
+
+    The first pair is searched by prefix_search and substring_search, the
+    next ones by prefix_searchN and substring_searchN.
+
+    Raises:
+      passphrase_handler.InvalidArgumentError: a pair is incomplete, or
+          searched by both prefix and substring.
+    """
+    predicates = []
+    for n in xrange(1, MAX_SEARCH_PREDICATES + 1):
+      field = self.request.get('field%d' % n)
+      value = self.request.get('value%d' % n).strip()
+      if n > 1 and not (field or value):
+        continue
+      if not (field and value):
+        raise passphrase_handler.InvalidArgumentError(
+            'Missing field%d or value%d' % (n, n))
+
+      suffix = '' if n == 1 else str(n)
+      prefix_search = self.request.get('prefix_search' + suffix, '0') == '1'
+      substring_search = (
+          self.request.get('substring_search' + suffix, '0') == '1')
+      if prefix_search and substring_search:
+        raise passphrase_handler.InvalidArgumentError(
+            'prefix_search%s and substring_search%s are exclusive' % (
+                suffix, suffix))
+      if substring_search and len(value) < base.SEARCH_NGRAM_LENGTH:
+        raise passphrase_handler.InvalidArgumentError(
+            'Substring search needs at least %d characters' %
+            base.SEARCH_NGRAM_LENGTH)
+      predicates.append(
+          _MakePredicate(field, value, prefix_search, substring_search))
+    return predicates
 
   def get(self):
     """Handles GET requests."""
@@ -91,11 +575,91 @@ class Search(passphrase_handler.PassphraseHandler):
         self.redirect('/ui/', permanent=True)
       return
 
+    tag = self.request.get('tag', 'default')
+    search_type = self.request.get('search_type')
+    predicates = self._GetPredicates()
+
+    if search_type == SEARCH_TYPE_ALL:
+      models = [m for m in models_util.AllModels()
+                if all(_IsSearchable(m, p) for p in predicates)]
+      if not models:
+        raise passphrase_handler.InvalidArgumentError(
+            'No search_type has fields %s' % ','.join(
+                p.field for p in predicates))
+    else:
+      try:
+        models = [models_util.TypeNameToModel(search_type)]
+      except ValueError:
+        raise passphrase_handler.InvalidArgumentError(
+            'Invalid search_type %s' % search_type)
+      for predicate in predicates:
+        if (predicate.mode == Predicate.SUBSTRING
+            and predicate.field not in models[0].SUBSTRING_SEARCH_FIELDS):
+          raise passphrase_handler.InvalidArgumentError(
+              'No substring search of field %s' % predicate.field)
+
+    owners = _SearchOwners(models, self.context.email)
+    models = [m for m in models if m in owners]
+
+    active_only = self.request.get('active_only', '0') == '1'
+    latest_only = self.request.get('latest_only', '0') == '1'
+
+    start = self.request.get('next')
+    start_cursor = None
+    if start:
+      if search_type == SEARCH_TYPE_ALL:
+        raise passphrase_handler.InvalidArgumentError(
+            'next needs a single search_type')
+      try:
+        start_cursor = Cursor(urlsafe=start)
+      except datastore_errors.BadValueError:
+        raise passphrase_handler.InvalidArgumentError('next is malformed')
+
+    # All models are searched in parallel.
+    futures = []
+    try:
+      for model in models:
+        futures.append(_SearchAsync(
+            model, predicates, tag, owners[model], active_only, start_cursor,
+            latest_only=latest_only))
+      results = [f.get_result() for f in futures]
+    except ValueError:
+      self.error(httplib.NOT_FOUND)
+      return
+
+    if search_type != SEARCH_TYPE_ALL:
+      self.response.out.write(util.ToSafeJson(results[0]))
+      return
+
+    # Pages of each type continue with search_type=<type> and its next token.
+    self.response.out.write(util.ToSafeJson({
+        'results': dict(
+            (m.ESCROW_TYPE_NAME, r) for m, r in zip(models, results)),
+    }))
+
+
+class BulkSearch(passphrase_handler.PassphraseHandler):
+  """Handler for /search/bulk URL.
+
+  Searches one field of one type for many identifiers, given one per line in
+  the values parameter. Responds with one NDJSON line per identifier, with the
+  identifier as value and the rest like a /search response for it.
+  """
+
+  def post(self):
+    """Handles POST requests."""
     tag = self.request.get('tag', 'default')
     search_type = self.request.get('search_type')
     field1 = self.request.get('field1')
-    value1 = self.request.get('value1').strip()
-    prefix_search = self.request.get('prefix_search', '0') == '1'
+    active_only = self.request.get('active_only', '0') == '1'
+
+    values = []
+    seen = set()
+    for value in self.request.get('values').splitlines():
+      value = value.strip()
+      if value and value not in seen:
+        seen.add(value)
+        values.append(value)
 
     try:
       model = models_util.TypeNameToModel(search_type)
@@ -103,48 +667,113 @@ class Search(passphrase_handler.PassphraseHandler):
       raise passphrase_handler.InvalidArgumentError(
           'Invalid search_type %s' % search_type)
 
-    if not (field1 and value1):
-      raise base_handler.InvalidArgumentError('Missing field1 or value1')
+    if not (field1 and values):
+      raise passphrase_handler.InvalidArgumentError(
+          'Missing field1 or values')
+    if field1 not in dict(model.SEARCH_FIELDS):
+      raise passphrase_handler.InvalidArgumentError(
+          'Invalid field1 %s' % field1)
+    if len(values) > BULK_SEARCH_MAX_VALUES:
+      raise passphrase_handler.InvalidArgumentError(
+          'More than %d values' % BULK_SEARCH_MAX_VALUES)
+
+    owner = _SearchOwners([model], self.context.email)[model]
 
-    # Get the user's search and retrieve permissions for all permission types.
-    search_perms = base_handler.VerifyAllPermissionTypes(permissions.SEARCH)
-    retrieve_perms = base_handler.VerifyAllPermissionTypes(
-        permissions.RETRIEVE_OWN)
-    retrieve_created = base_handler.VerifyAllPermissionTypes(
-        permissions.RETRIEVE_CREATED_BY)
+    self.response.headers['Content-Type'] = 'application/x-ndjson'
+    for i in xrange(0, len(values), BULK_SEARCH_BATCH_SIZE):
+      batch = values[i:i + BULK_SEARCH_BATCH_SIZE]
+      futures = [
+          _BulkSearchAsync(
+              model, Predicate(field1, value, Predicate.EQUALS), tag, owner,
+              active_only)
+          for value in batch]
+      for value, future in zip(batch, futures):
+        try:
+          result = future.get_result()
+        except ValueError:
+          result = {'error': 'invalid value'}
+        result['value'] = value
+        self.response.out.write(json.dumps(result, sort_keys=True))
+        self.response.out.write('\n')
 
-    # user is performing a search, ensure they have permissions.
-    if (not search_perms.get(search_type)
-        and not retrieve_perms.get(search_type)
-        and not retrieve_created.get(search_type)):
-      raise errors.AccessDeniedError('User lacks %s permission' % search_type)
 
+def _SecretChanged(version, older, more):
+  """Returns whether version holds another secret than older, or None.
+
+  Args:
+    version: dict, result of GetResultsAsync(with_secret_fingerprint=True).
+    older: dict like version, of the version before it, or None.
+    more: boolean, True if there are versions before the page.
+  """
+  if older is None:
+    # The first version of the target changed the secret.
+    return None if more else True
+  if not (version['secret_fingerprint'] and older['secret_fingerprint']):
+    return None
+  return version['secret_fingerprint'] != older['secret_fingerprint']
+
+
+class History(passphrase_handler.PassphraseHandler):
+  """Handler for /history/<search_type>/<target_id> URL.
+
+  Pages through all versions of a target and tag, newest first. Versions are
+  listed without their secrets; secret_changed tells whether a version holds
+  another secret than the version before it, or is None if unknown. Secret
+  fingerprints are compared here and never returned, as a short secret could
+  be guessed from its fingerprint.
+  """
+
+  def get(self, search_type, target_id):
+    """Handles GET requests."""
+    tag = self.request.get('tag', 'default')
     try:
-      passphrases = _PassphrasesForQuery(model, field1, value1, prefix_search)
+      model = models_util.TypeNameToModel(search_type)
     except ValueError:
-      self.error(httplib.NOT_FOUND)
-      return
+      raise passphrase_handler.InvalidArgumentError(
+          'Invalid search_type %s' % search_type)
+
+    owner = _SearchOwners([model], self.context.email)[model]
+
+    start = self.request.get('next')
+    start_cursor = None
+    if start:
+      try:
+        start_cursor = Cursor(urlsafe=start)
+      except datastore_errors.BadValueError:
+        raise passphrase_handler.InvalidArgumentError('next is malformed')
+
+    target_property = getattr(model, model.TARGET_PROPERTY_NAME)
+    query = model.query(
+        model.tag == tag, target_property == target_id).order(-model.created)
+    # Long histories are read one page of keys at a time.
+    keys, next_cursor, more = query.fetch_page(
+        MAX_VERSIONS_PER_PAGE, start_cursor=start_cursor, keys_only=True)
+    older_keys = []
+    if more and next_cursor:
+      # The last version of the page is compared to the one after it.
+      older_keys = query.fetch(1, start_cursor=next_cursor, keys_only=True)
+    # Summaries carry secret_fingerprint, so no secret is loaded.
+    results = base.PassphraseSummary.GetResultsAsync(
+        model, keys + older_keys, with_secret_fingerprint=True).get_result()
 
+    page_ids = set(key.urlsafe() for key in keys)
+    versions = []
     skipped = False
-    if not search_perms.get(search_type):
-      results_len = len(passphrases)
-      email = base.GetCurrentUser().user.email()
-      passphrases = [x for x in passphrases if email in x.owners]
-      skipped = len(passphrases) != results_len
-    too_many_results = len(passphrases) >= MAX_PASSPHRASES_PER_QUERY
-
-    passphrases = [v.ToDict(skip_secret=True)
-                   for v in passphrases if v.tag == tag]
-    if model.ALLOW_OWNER_CHANGE:
-      for passphrase in passphrases:
-        if not passphrase['active']:
-          continue
-        link = '/api/internal/change-owner/%s/%s/' % (
-            search_type, passphrase['id'])
-        passphrase['change_owner_link'] = link
+    for result, older in zip(results, results[1:] + [None]):
+      if result['id'] not in page_ids:
+        continue
+      if owner and owner not in result['owners']:
+        skipped = True
+        continue
+      # Results of models with _DICT_EXCLUDED_PROPERTIES lack some fields.
+      version = {
+          field: result.get(field) for field in (
+              'id', 'active', 'created', 'created_by', 'tag')}
+      version['secret_changed'] = _SecretChanged(result, older, more)
+      versions.append(version)
 
     self.response.out.write(util.ToSafeJson({
-        'passphrases': passphrases,
-        'too_many_results': too_many_results,
+        'versions': versions,
+        'next': next_cursor.urlsafe() if more and next_cursor else None,
         'results_access_warning': skipped,
     }))
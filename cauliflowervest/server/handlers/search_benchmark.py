@@ -0,0 +1,198 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of searches over many inactive and other-tag passphrases."""
+
+import time
+import uuid
+
+
+
+from absl.testing import absltest
+import mock
+import webtest
+
+from google.appengine.ext import ndb
+
+from cauliflowervest.server import main as gae_main
+from cauliflowervest.server import permissions
+from cauliflowervest.server import search_cache
+from cauliflowervest.server import util
+from cauliflowervest.server.handlers import base_handler
+from cauliflowervest.server.handlers import search
+from cauliflowervest.server.handlers import test_util
+from cauliflowervest.server.models import base
+from cauliflowervest.server.models import util as models_util
+from cauliflowervest.server.models import volumes
+
+
+_ROWS = 100000
+_PUT_BATCH_SIZE = 1000
+_HOSTS = 50
+_RUNS = 5
+_LATENCY_RUNS = 50
+
+
+def _PbSize(entity):
+  return len(entity._to_pb().Encode())  # pylint: disable=protected-access
+
+
+def _LegacyToDict(entity):
+  """BasePassphrase.ToDict(skip_secret=True) before it was precompiled."""
+  passphrase = {p: unicode(getattr(entity, p)) for p in entity.PropertyNames()
+                if p not in entity._FINGERPRINT_PROPERTIES  # pylint: disable=protected-access
+                and p != entity.SECRET_PROPERTY_NAME}
+  passphrase['id'] = entity.key.urlsafe()
+  passphrase['active'] = entity.active
+  passphrase['target_id'] = entity.target_id
+  passphrase['owners'] = entity.owners
+  return passphrase
+
+
+def _P95(times):
+  return sorted(times)[int(len(times) * 0.95)]
+
+
+class SearchBenchmark(test_util.BaseTest):
+
+  def setUp(self):
+    super(SearchBenchmark, self).setUp()
+    self.testapp = webtest.TestApp(gae_main.app)
+    # Of every 10 rows, 6 are inactive versions and 2 have another tag.
+    for i in xrange(0, _ROWS, _PUT_BATCH_SIZE):
+      ndb.put_multi([
+          volumes.LuksVolume(
+              owners=['stub7'], hdd_serial='stub', passphrase='secret',
+              hostname='host%d' % (j % _HOSTS), platform_uuid='stub',
+              volume_uuid=str(uuid.uuid4()), active=j % 10 >= 6,
+              tag='other' if j % 10 >= 8 else 'default')
+          for j in xrange(i, i + _PUT_BATCH_SIZE)])
+      ndb.get_context().clear_cache()
+
+  def _Time(self, url):
+    elapsed = 0
+    for _ in xrange(_RUNS):
+      # Measures the queries rather than search_cache.
+      for model in models_util.AllModels():
+        search_cache.BumpGeneration(model)
+      started = time.time()
+      resp = util.FromSafeJson(self.testapp.get(url).body)
+      elapsed += time.time() - started
+    return elapsed / _RUNS, resp
+
+  @mock.patch.object(
+      base_handler, 'VerifyAllPermissionTypes', return_value={'luks': True})
+  def testSearch(self, _):
+    for name, query in (
+        ('equality', 'field1=hostname&value1=host1'),
+        ('equality, active only', 'field1=hostname&value1=host1'
+         '&active_only=1'),
+        ('prefix', 'field1=hostname&value1=host1&prefix_search=1'),
+        ('prefix, active only', 'field1=hostname&value1=host1'
+         '&prefix_search=1&active_only=1'),
+        ('prefix, latest only', 'field1=hostname&value1=host1'
+         '&prefix_search=1&latest_only=1'),
+    ):
+      elapsed, resp = self._Time(
+          '/search?search_type=luks&json=1&%s' % query)
+      print '%s: %.1f ms, %d results, too_many_results=%s' % (
+          name, elapsed * 1000, len(resp['passphrases']),
+          resp['too_many_results'])
+
+    # Fetching without any pushed down condition, as searches used to.
+    started = time.time()
+    for _ in xrange(_RUNS):
+      passphrases = [
+          p for p in search._PassphrasesForQuery(
+              volumes.LuksVolume, 'hostname', 'host1')
+          if p['tag'] == 'default' and p['active']]
+    print 'filtered in Python: %.1f ms, %d results' % (
+        (time.time() - started) / _RUNS * 1000, len(passphrases))
+
+  @mock.patch.object(
+      base_handler, 'VerifyAllPermissionTypes', return_value={'luks': True})
+  def testDeepPages(self, _):
+    for name, query in (
+        ('equality', 'field1=hostname&value1=host1'),
+        ('prefix, active only', 'field1=hostname&value1=host'
+         '&prefix_search=1&active_only=1'),
+    ):
+      times = []
+      start_next = ''
+      while True:
+        started = time.time()
+        resp = util.FromSafeJson(self.testapp.get(
+            '/search?search_type=luks&json=1&next=%s&%s' % (
+                start_next, query)).body)
+        times.append(time.time() - started)
+        start_next = resp['next']
+        if not start_next:
+          break
+      print '%s: %d pages, first %.1f ms, last %.1f ms, max %.1f ms' % (
+          name, len(times), times[0] * 1000, times[-1] * 1000,
+          max(times) * 1000)
+
+  @mock.patch.object(
+      base_handler, 'VerifyAllPermissionTypes',
+      return_value=dict((t, True) for t in permissions.TYPES))
+  def testSearchAll(self, _):
+    single = []
+    for search_type in permissions.TYPES:
+      elapsed, _ = self._Time(
+          '/search?search_type=%s&json=1&field1=hostname&value1=host1' %
+          search_type)
+      single.append(elapsed)
+    elapsed, _ = self._Time(
+        '/search?search_type=all&json=1&field1=hostname&value1=host1')
+    print 'all types: %.1f ms, slowest type %.1f ms, sum of types %.1f ms' % (
+        elapsed * 1000, max(single) * 1000, sum(single) * 1000)
+
+  def testBytesAndLatency(self):
+    query, _, _ = search._PlanSearch(
+        volumes.LuksVolume,
+        [search.Predicate('hostname', 'host1', search.Predicate.EQUALS)],
+        tag='default')
+
+    def Entities():
+      entities = query.fetch(search.MAX_PASSPHRASES_PER_QUERY)
+      return entities, [_LegacyToDict(e) for e in entities]
+
+    def Summaries():
+      keys = query.fetch(search.MAX_PASSPHRASES_PER_QUERY, keys_only=True)
+      return keys, base.PassphraseSummary.GetResultsAsync(
+          volumes.LuksVolume, keys).get_result()
+
+    entities, _ = Entities()
+    keys, _ = Summaries()
+    summaries = ndb.get_multi(
+        [base.PassphraseSummary.KeyFor(key) for key in keys])
+    entity_bytes = sum(_PbSize(e) for e in entities)
+    summary_bytes = (sum(len(k.reference().Encode()) for k in keys) +
+                     sum(_PbSize(s) for s in summaries))
+
+    for name, fn, read_bytes in (
+        ('entities', Entities, entity_bytes),
+        ('keys and summaries', Summaries, summary_bytes)):
+      times = []
+      for _ in xrange(_LATENCY_RUNS):
+        ndb.get_context().clear_cache()
+        started = time.time()
+        _, results = fn()
+        times.append(time.time() - started)
+      print '%s: %d bytes read per result, p95 %.1f ms' % (
+          name, read_bytes / len(results), _P95(times) * 1000)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -16,7 +16,7 @@
 
 import datetime
 import httplib
-import os
+import json
 import uuid
 
 
@@ -26,11 +26,14 @@ import mock
 import webtest
 
 from google.appengine.api import users
+from google.appengine.ext import ndb
 
+from cauliflowervest.server import crypto
 from cauliflowervest.server import main as gae_main
 from cauliflowervest.server import permissions
 from cauliflowervest.server import settings
 from cauliflowervest.server import util
+from cauliflowervest.server.handlers import base_handler
 from cauliflowervest.server.handlers import search
 from cauliflowervest.server.handlers import test_util
 from cauliflowervest.server.models import base
@@ -83,7 +86,7 @@ class SearchModuleTest(test_util.BaseTest):
 
   def testFilterResult(self):
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         bitlocker_perms=[permissions.RETRIEVE_OWN],
     ).put()
 
@@ -99,15 +102,432 @@ class SearchModuleTest(test_util.BaseTest):
         '/search?search_type=luks&field1=owner&value1=zaspire&json=1',
         status=httplib.OK)
 
+  def testSearchDoesNotDecrypt(self):
+    crypto.Decrypt.reset_mock()
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/search?search_type=bitlocker&field1=owner&value1=stub7&json=1').body)
+
+    self.assertEqual(1, len(resp['passphrases']))
+    self.assertEqual(0, crypto.Decrypt.call_count)
+
+  def testSearchAuthenticatesOnce(self):
+    base.User(
+        id='stub7@example.com', user=users.get_current_user(),
+        bitlocker_perms=[permissions.RETRIEVE_OWN],
+    ).put()
+
+    with mock.patch.object(
+        base, '_GetApiUser', wraps=base._GetApiUser) as get_api_user:
+      self.testapp.get(
+          '/search?search_type=bitlocker&field1=owner&value1=stub&json=1')
+
+    self.assertEqual(1, get_api_user.call_count)
+
+  def _PutLuksVolumes(self, count, **kwargs):
+    for _ in range(count):
+      props = dict(
+          owners=['stub7'], hdd_serial='stub', hostname='host1',
+          passphrase='secret', platform_uuid='stub',
+          volume_uuid=str(uuid.uuid4()))
+      props.update(kwargs)
+      models.LuksVolume(**props).put()
+
+  @mock.patch.dict(search.__dict__, {'MAX_PASSPHRASES_PER_QUERY': 2})
+  def testTagIsFilteredInQuery(self):
+    self._PutLuksVolumes(3, tag='other')
+    self._PutLuksVolumes(1)
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/search?search_type=luks&field1=hostname&value1=host1&json=1').body)
+
+    self.assertEqual(1, len(resp['passphrases']))
+    self.assertEqual('default', resp['passphrases'][0]['tag'])
+    self.assertFalse(resp['too_many_results'])
+
+  @mock.patch.dict(search.__dict__, {'MAX_PASSPHRASES_PER_QUERY': 2})
+  def testOwnerIsFilteredInQuery(self):
+    base.User(
+        id='stub7@example.com', user=users.get_current_user(),
+        luks_perms=[permissions.RETRIEVE_OWN],
+    ).put()
+    self._PutLuksVolumes(3, owners=['other'])
+    self._PutLuksVolumes(1)
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/search?search_type=luks&field1=hostname&value1=host1&json=1').body)
+
+    self.assertEqual(1, len(resp['passphrases']))
+    self.assertEqual(['stub7@example.com'], resp['passphrases'][0]['owners'])
+    self.assertTrue(resp['results_access_warning'])
+    self.assertFalse(resp['too_many_results'])
+
+  def testActiveOnly(self):
+    self._PutLuksVolumes(2, active=False)
+    self._PutLuksVolumes(1)
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/search?search_type=luks&field1=hostname&value1=host1&json=1'
+        '&active_only=1').body)
+
+    self.assertEqual(1, len(resp['passphrases']))
+    self.assertTrue(resp['passphrases'][0]['active'])
+
+  def testLatestOnly(self):
+    for i in range(3):
+      self._PutLuksVolumes(1, volume_uuid='rotated', passphrase=str(i))
+    self._PutLuksVolumes(1, volume_uuid='once')
+
+    with mock.patch.object(
+        search, '_FetchPageAsync', wraps=search._FetchPageAsync) as fetch:
+      with mock.patch.object(
+          search, '_HistoryCountAsync',
+          side_effect=AssertionError('versions queried')):
+        resp = util.FromSafeJson(self.testapp.get(
+            '/search?search_type=luks&field1=hostname&value1=host&json=1'
+            '&prefix_search=1&latest_only=1').body)
+
+    self.assertEqual(
+        {'rotated': 3, 'once': 1},
+        dict((v['volume_uuid'], v['history_count'])
+             for v in resp['passphrases']))
+    # Inactive versions are filtered by the query, not in Python.
+    query = fetch.call_args[0][1]
+    self.assertIn("'active'", repr(query.filters))
+
+  def testLatestOnlyCountsVersionsOfHeadsWithoutCount(self):
+    for i in range(2):
+      self._PutLuksVolumes(1, volume_uuid='rotated', passphrase=str(i))
+    head = base.PassphraseHead.query().get()
+    head.versions = None
+    head.put()
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/search?search_type=luks&field1=volume_uuid&value1=rotated&json=1'
+        '&latest_only=1').body)
+
+    self.assertEqual(2, resp['passphrases'][0]['history_count'])
+
+  @mock.patch.dict(search.__dict__, {'MAX_PASSPHRASES_PER_QUERY': 2})
+  def testPrefixSearchChecksOwnerAndActive(self):
+    self._PutLuksVolumes(3, active=False)
+    self._PutLuksVolumes(3, owners=['other'])
+    self._PutLuksVolumes(1)
+
+    volumes = search._PassphrasesForQuery(
+        models.LuksVolume, 'hostname', 'host', prefix_search=True,
+        tag='default', owner='stub7@example.com', active_only=True)
+
+    self.assertEqual(1, len(volumes))
+    self.assertTrue(volumes[0]['active'])
+    self.assertEqual(['stub7@example.com'], volumes[0]['owners'])
+
+  def _SearchAllPages(self, query):
+    volumes = []
+    pages = 0
+    start_next = ''
+    while True:
+      resp = util.FromSafeJson(self.testapp.get(
+          '/search?search_type=luks&json=1&next=%s&%s' % (
+              start_next, query)).body)
+      volumes += resp['passphrases']
+      pages += 1
+      if not resp['next']:
+        return volumes, pages
+      start_next = resp['next']
+
+  @mock.patch.dict(search.__dict__, {'MAX_PASSPHRASES_PER_QUERY': 2})
+  def testPagination(self):
+    for day in range(1, 6):
+      self._PutLuksVolumes(
+          1, hdd_serial=str(day), created=datetime.datetime(2017, 1, day))
+
+    volumes, pages = self._SearchAllPages('field1=hostname&value1=host1')
+
+    self.assertEqual(3, pages)
+    self.assertEqual(
+        ['5', '4', '3', '2', '1'], [v['hdd_serial'] for v in volumes])
+
+  @mock.patch.dict(search.__dict__, {
+      'MAX_PASSPHRASES_PER_QUERY': 2, 'MAX_SCANNED_PER_QUERY': 3})
+  def testPaginationWithChecks(self):
+    for day in range(1, 9):
+      self._PutLuksVolumes(
+          1, hdd_serial=str(day), active=day % 2 == 0,
+          created=datetime.datetime(2017, 1, day))
+
+    volumes, _ = self._SearchAllPages(
+        'field1=hostname&value1=host&prefix_search=1&active_only=1')
+
+    self.assertEqual(
+        ['8', '6', '4', '2'], [v['hdd_serial'] for v in volumes])
+
+  def testMalformedNext(self):
+    self.testapp.get(
+        '/search?search_type=luks&field1=hostname&value1=host1&json=1'
+        '&next=foo', status=httplib.BAD_REQUEST)
+
+  def testSearchReadsSummaries(self):
+    self._PutLuksVolumes(1)
+    key = models.LuksVolume.query().get(keys_only=True)
+    summary = base.PassphraseSummary.KeyFor(key).get()
+    summary.data['hdd_serial'] = 'from summary'
+    summary.put()
+
+    with mock.patch.object(
+        models.LuksVolume, '_from_pb',
+        side_effect=AssertionError('passphrase loaded')):
+      resp = util.FromSafeJson(self.testapp.get(
+          '/search?search_type=luks&field1=hostname&value1=host1'
+          '&json=1').body)
+
+    self.assertEqual('from summary', resp['passphrases'][0]['hdd_serial'])
+    self.assertEqual(key.urlsafe(), resp['passphrases'][0]['id'])
+    self.assertNotIn('passphrase', resp['passphrases'][0])
+
+  def testStaleSummaryIsRewritten(self):
+    self._PutLuksVolumes(1)
+    key = models.LuksVolume.query().get(keys_only=True)
+    base.PassphraseSummary(
+        key=base.PassphraseSummary.KeyFor(key), data={}, version='old').put()
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/search?search_type=luks&field1=hostname&value1=host1&json=1').body)
+
+    self.assertEqual('stub', resp['passphrases'][0]['hdd_serial'])
+    summary = base.PassphraseSummary.KeyFor(key).get()
+    self.assertEqual(
+        base.PassphraseSummary.VersionFor(models.LuksVolume), summary.version)
+    self.assertEqual('stub', summary.data['hdd_serial'])
+
+  def testStaleSummaryRewriteKeepsConcurrentOwnerChange(self):
+    self._PutLuksVolumes(1)
+    key = models.LuksVolume.query().get(keys_only=True)
+    base.PassphraseSummary.KeyFor(key).delete()
+    from_entity = base.PassphraseSummary.FromEntity
+    changed = []
+
+    def FromEntityDuringOwnerChange(entity):
+      # Changes the owners after the stale summary's passphrase was read.
+      if not changed:
+        changed.append(True)
+        ndb.transaction(
+            lambda: models.LuksVolume._UpdateMutableProperties(
+                key, {'owners': ['other']}),
+            propagation=ndb.TransactionOptions.INDEPENDENT)
+      return from_entity(entity)
+
+    with mock.patch.object(
+        base.PassphraseSummary, 'FromEntity',
+        side_effect=FromEntityDuringOwnerChange):
+      results = base.PassphraseSummary.GetResultsAsync(
+          models.LuksVolume, [key]).get_result()
+
+    self.assertEqual(['other@example.com'], results[0]['owners'])
+    summary = base.PassphraseSummary.KeyFor(key).get()
+    self.assertEqual(['other@example.com'], summary.data['owners'])
+
+  def testResultsAreCached(self):
+    self._PutLuksVolumes(2, owners=['other'])
+    self._PutLuksVolumes(1)
+    query = '/search?search_type=luks&field1=hostname&value1=host1&json=1'
+    resp = util.FromSafeJson(self.testapp.get(query).body)
+
+    with mock.patch.object(
+        search, '_FetchPageAsync', side_effect=AssertionError('queried')):
+      cached = util.FromSafeJson(self.testapp.get(query).body)
+
+    self.assertEqual(resp, cached)
+    # Owners are still filtered per user.
+    self.assertEqual(
+        [['stub7@example.com']], [v['owners'] for v in cached['passphrases']])
+    self.assertTrue(cached['results_access_warning'])
+
+  def testWritesInvalidateCachedResults(self):
+    self._PutLuksVolumes(1)
+    query = '/search?search_type=luks&field1=hostname&value1=host1&json=1'
+    self.testapp.get(query)
+
+    models.LuksVolume.query().get().UpdateMutableProperty('hostname', 'host2')
+
+    resp = util.FromSafeJson(self.testapp.get(query).body)
+    self.assertEqual([], resp['passphrases'])
+
+  def _PutFileVaultVolume(self, **kwargs):
+    props = dict(
+        owners=['stub7'], hdd_serial='stub', hostname='foohost',
+        passphrase='secret', platform_uuid='stub', serial='stub',
+        volume_uuid=str(uuid.uuid4()))
+    props.update(kwargs)
+    models.FileVaultVolume(**props).put()
+
+  def testSearchAll(self):
+    self._PutLuksVolumes(1, hostname='foohost')
+    self._PutFileVaultVolume()
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/search?search_type=all&field1=hostname&value1=foohost'
+        '&json=1').body)
+
+    counts = dict((t, len(r['passphrases']))
+                  for t, r in resp['results'].iteritems())
+    self.assertEqual(1, counts.pop('bitlocker'))
+    self.assertEqual(1, counts.pop('filevault'))
+    self.assertEqual(1, counts.pop('luks'))
+    self.assertEqual([0] * len(counts), counts.values())
+
+  def testSearchAllOnlyTypesWithField(self):
+    resp = util.FromSafeJson(self.testapp.get(
+        '/search?search_type=all&field1=hdd_serial&value1=stub'
+        '&json=1').body)
+
+    self.assertEqual(
+        ['filevault', 'luks', 'provisioning'], sorted(resp['results']))
+
+  def testSearchAllOnlyPermittedTypes(self):
+    base.User(
+        id='stub7@example.com', user=users.get_current_user(),
+        luks_perms=[permissions.SEARCH],
+    ).put()
+    self._PutLuksVolumes(1, hostname='foohost', owners=['other'])
+    self._PutFileVaultVolume()
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/search?search_type=all&field1=hostname&value1=foohost'
+        '&json=1').body)
+
+    self.assertEqual(['luks'], resp['results'].keys())
+    self.assertEqual(1, len(resp['results']['luks']['passphrases']))
+
+  def testSearchAllUnknownField(self):
+    self.testapp.get(
+        '/search?search_type=all&field1=foo&value1=bar&json=1',
+        status=httplib.BAD_REQUEST)
+
+  def testSearchAllWithNext(self):
+    self.testapp.get(
+        '/search?search_type=all&field1=hostname&value1=foohost&json=1'
+        '&next=foo', status=httplib.BAD_REQUEST)
+
+  def testSubstringSearch(self):
+    self._PutLuksVolumes(1, hostname='web-Prod-01')
+    self._PutLuksVolumes(1, hostname='prodweb')
+    # Has every n-gram of 'prod-0', but not the substring.
+    self._PutLuksVolumes(1, hostname='prod-prod-09', hdd_serial='apart')
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/search?search_type=luks&field1=hostname&value1=PROD-0'
+        '&substring_search=1&json=1').body)
+
+    self.assertEqual(
+        ['web-prod-01'], [v['hostname'] for v in resp['passphrases']])
+
+  def testSubstringSearchAssetTags(self):
+    firmware.AppleFirmwarePassword(
+        owners=['stub7'], serial='stub', password=str(uuid.uuid4()),
+        platform_uuid='stub', hostname='host1',
+        asset_tags=['tag1', 'AT-123456']).put()
+
+    volumes = search._PassphrasesForQuery(
+        firmware.AppleFirmwarePassword, 'asset_tags', '3456',
+        tag='default', substring_search=True)
+
+    self.assertEqual(1, len(volumes))
+
+  @mock.patch.dict(search.__dict__, {'MAX_SUBSTRING_TOKENS': 2})
+  def testSubstringSearchCapsTokens(self):
+    self._PutLuksVolumes(1, hdd_serial='SN-1234567890')
+    self._PutLuksVolumes(1, hdd_serial='SN-1234567899')
+
+    volumes = search._PassphrasesForQuery(
+        models.LuksVolume, 'hdd_serial', '4567890', tag='default',
+        substring_search=True)
+
+    self.assertEqual(['SN-1234567890'], [v['hdd_serial'] for v in volumes])
+
+  def testSubstringSearchAll(self):
+    self._PutLuksVolumes(1, hostname='foohost')
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/search?search_type=all&field1=hdd_serial&value1=tub'
+        '&substring_search=1&json=1').body)
+
+    self.assertEqual(1, len(resp['results']['luks']['passphrases']))
+
+  def testSubstringSearchInvalid(self):
+    for query in ('field1=hostname&value1=ho',
+                  'field1=volume_uuid&value1=host',
+                  'field1=hostname&value1=host&prefix_search=1'):
+      self.testapp.get(
+          '/search?search_type=luks&substring_search=1&json=1&' + query,
+          status=httplib.BAD_REQUEST)
+
+  def testMultiFieldSearch(self):
+    self._PutLuksVolumes(1, hdd_serial='match')
+    self._PutLuksVolumes(1, hdd_serial='other')
+    self._PutLuksVolumes(1, hostname='host2', hdd_serial='match')
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/search?search_type=luks&field1=hostname&value1=host1'
+        '&field2=hdd_serial&value2=match&json=1').body)
+
+    self.assertEqual(1, len(resp['passphrases']))
+    self.assertEqual('match', resp['passphrases'][0]['hdd_serial'])
+    self.assertEqual({
+        'kind': 'LuksVolume',
+        'indexes': ['(hdd_serial, -created)', '(hostname, -created)',
+                    '(tag, -created)'],
+        'filtered': ['hdd_serial', 'hostname', 'tag'],
+        'checked': [],
+    }, resp['query_plan'])
+
+  def testEqualityIsPreferredToPrefix(self):
+    self._PutLuksVolumes(1, owners=['stub7', 'zerocool'])
+    self._PutLuksVolumes(1, owners=['stub7', 'zerocool'], hostname='other')
+    self._PutLuksVolumes(1)
+
+    resp = util.FromSafeJson(self.testapp.get(
+        '/search?search_type=luks&field1=owner&value1=zerocool'
+        '&field2=hostname&value2=ho&prefix_search2=1&json=1').body)
+
+    self.assertEqual(
+        ['host1'], [v['hostname'] for v in resp['passphrases']])
+    self.assertEqual(['owners', 'tag'], resp['query_plan']['filtered'])
+    self.assertEqual(['hostname'], resp['query_plan']['checked'])
+
+  def testLongestPrefixIsPushedDown(self):
+    self._PutLuksVolumes(1, hdd_serial='stub1')
+    self._PutLuksVolumes(1, hdd_serial='other')
+
+    predicates = [
+        search.Predicate('hdd_serial', 'stu', search.Predicate.PREFIX),
+        search.Predicate('hostname', 'host', search.Predicate.PREFIX),
+    ]
+
+    _, _, plan = search._PlanSearch(
+        models.LuksVolume, predicates, tag='default', active_only=True)
+    volumes = search._PassphrasesPageAsync(
+        models.LuksVolume, predicates, tag='default',
+        active_only=True).get_result()[0]
+
+    self.assertEqual(['(tag, active, hostname, -created)'], plan['indexes'])
+    self.assertEqual(['hdd_serial'], plan['checked'])
+    self.assertEqual(['stub1'], [v['hdd_serial'] for v in volumes])
+
+  def testIncompletePredicate(self):
+    self.testapp.get(
+        '/search?search_type=luks&field1=hostname&value1=host1'
+        '&field2=hdd_serial&json=1', status=httplib.BAD_REQUEST)
+
   def testPassphrasesFoQueryCreatedBy(self):
     created_by = 'foouser'
-    email = '%s@%s' % (created_by, os.environ['AUTH_DOMAIN'])
 
     volumes = search._PassphrasesForQuery(
         models.BitLockerVolume, 'created_by', created_by)
 
     self.assertEqual(1, len(volumes))
-    self.assertEqual(email, volumes[0].created_by.email())
+    # Users of AUTH_DOMAIN are shown without the domain.
+    self.assertEqual(created_by, volumes[0]['created_by'])
 
   def testPassphrasesForQueryHostname(self):
     hostname = 'foohost'
@@ -117,7 +537,7 @@ class SearchModuleTest(test_util.BaseTest):
 
     self.assertEqual(1, len(volumes))
     self.assertEqual(models.BitLockerVolume.NormalizeHostname(hostname),
-                     volumes[0].hostname)
+                     volumes[0]['hostname'])
 
   def testPassphrasesForQueryPrefix(self):
     volumes = search._PassphrasesForQuery(
@@ -145,7 +565,7 @@ class SearchModuleTest(test_util.BaseTest):
     self.assertEqual(1, len(volumes))
     self.assertEqual(
         models.BitLockerVolume.NormalizeHostname('lololol'),
-        volumes[0].hostname)
+        volumes[0]['hostname'])
 
     # Searching by owner without domain (e.g., example.com) in query should
     # still return the volume if the owner in datastore does have domain. I.e.,
@@ -165,7 +585,7 @@ class SearchModuleTest(test_util.BaseTest):
     self.assertEqual(1, len(volumes))
     self.assertEqual(
         models.BitLockerVolume.NormalizeHostname('stub1337'),
-        volumes[0].hostname)
+        volumes[0]['hostname'])
 
   @mock.patch.dict(
       search.__dict__, {'MAX_PASSPHRASES_PER_QUERY': 20})
@@ -242,5 +662,172 @@ class SearchModuleTest(test_util.BaseTest):
 
 
 
+class BulkSearchTest(test_util.BaseTest):
+
+  def setUp(self):
+    super(BulkSearchTest, self).setUp()
+    self.testapp = webtest.TestApp(gae_main.app)
+    for hostname, owners in (('host1', ['stub7']), ('host1', ['stub7']),
+                             ('host2', ['other'])):
+      models.LuksVolume(
+          owners=owners, hdd_serial='stub', hostname=hostname,
+          passphrase='secret', platform_uuid='stub',
+          volume_uuid=str(uuid.uuid4())).put()
+
+  def _BulkSearch(self, values, **kwargs):
+    params = {'search_type': 'luks', 'field1': 'hostname',
+              'values': '\n'.join(values)}
+    params.update(kwargs)
+    resp = self.testapp.post('/search/bulk', params)
+    self.assertEqual('application/x-ndjson', resp.content_type)
+    return [json.loads(line) for line in resp.body.splitlines()]
+
+  def testBulkSearch(self):
+    lines = self._BulkSearch(['host1', 'host2', 'host3', 'host1', ''])
+
+    self.assertEqual(
+        ['host1', 'host2', 'host3'], [l['value'] for l in lines])
+    self.assertEqual([2, 0, 0], [len(l['passphrases']) for l in lines])
+    # host2 is owned by someone else.
+    self.assertEqual(
+        [False, True, False], [l['results_access_warning'] for l in lines])
+
+  @mock.patch.dict(search.__dict__, {'MAX_PASSPHRASES_PER_QUERY': 1})
+  def testTooManyResults(self):
+    base.User(
+        id='stub7@example.com', user=users.get_current_user(),
+        luks_perms=[permissions.SEARCH],
+    ).put()
+
+    lines = self._BulkSearch(['host1', 'host2'])
+
+    self.assertEqual([True, False], [l['too_many_results'] for l in lines])
+    self.assertTrue(lines[0]['next'])
+
+  @mock.patch.dict(search.__dict__, {'MAX_PASSPHRASES_PER_QUERY': 1})
+  def testTooManyResultsOfOwnPassphrases(self):
+    lines = self._BulkSearch(['host1'])
+
+    self.assertEqual(1, len(lines[0]['passphrases']))
+    self.assertTrue(lines[0]['too_many_results'])
+    self.assertFalse(lines[0]['results_access_warning'])
+
+    # The next token is the one of the query filtered by owner, which
+    # /search runs for this user.
+    resp = util.FromSafeJson(self.testapp.get('/search', {
+        'search_type': 'luks', 'field1': 'hostname', 'value1': 'host1',
+        'next': lines[0]['next'], 'json': '1'}).body)
+
+    self.assertEqual(1, len(resp['passphrases']))
+    self.assertFalse(resp['too_many_results'])
+
+  def testBulkSearchBypassesCache(self):
+    with mock.patch.object(
+        search.search_cache, 'GetGenerationAsync',
+        side_effect=AssertionError('cache used')):
+      lines = self._BulkSearch(['host1', 'host2'])
+
+    self.assertEqual([2, 0], [len(l['passphrases']) for l in lines])
+
+  def testInvalidField(self):
+    self.testapp.post('/search/bulk', {
+        'search_type': 'luks', 'field1': 'passphrase', 'values': 'a'},
+                      status=httplib.BAD_REQUEST)
+
+  @mock.patch.dict(search.__dict__, {'BULK_SEARCH_MAX_VALUES': 2})
+  def testTooManyValues(self):
+    self.testapp.post('/search/bulk', {
+        'search_type': 'luks', 'field1': 'hostname',
+        'values': 'a\nb\nc'}, status=httplib.BAD_REQUEST)
+
+  def testAccessDenied(self):
+    base.User(
+        id='stub7@example.com', user=users.get_current_user(),
+        luks_perms=[],
+    ).put()
+
+    self.testapp.post(
+        '/search/bulk',
+        {'search_type': 'luks', 'field1': 'hostname', 'values': 'host1'},
+        status=httplib.FORBIDDEN)
+
+
+
+class HistoryTest(test_util.BaseTest):
+
+  def setUp(self):
+    super(HistoryTest, self).setUp()
+    self.testapp = webtest.TestApp(gae_main.app)
+    for day, owner, passphrase in ((1, 'stub7', 'a'), (2, 'other', 'b'),
+                                   (3, 'stub7', 'c'), (4, 'stub7', 'a')):
+      models.LuksVolume(
+          owners=[owner], hdd_serial='stub', hostname='host1',
+          passphrase=passphrase, platform_uuid='stub', volume_uuid='rotated',
+          created=datetime.datetime(2017, 1, day)).put()
+    models.LuksVolume(
+        owners=['stub7'], hdd_serial='stub', hostname='host1',
+        passphrase='a', platform_uuid='stub', volume_uuid='unrelated').put()
+
+  def _History(self, url):
+    versions = []
+    start_next = ''
+    while True:
+      resp = util.FromSafeJson(self.testapp.get(
+          '%s?next=%s' % (url, start_next)).body)
+      versions += resp['versions']
+      if not resp['next']:
+        return versions, resp
+      start_next = resp['next']
+
+  @mock.patch.dict(search.__dict__, {'MAX_VERSIONS_PER_PAGE': 2})
+  @mock.patch.object(
+      base_handler, 'VerifyAllPermissionTypes', return_value={'luks': True})
+  def testHistory(self, _):
+    crypto.Decrypt.reset_mock()
+
+    with mock.patch.object(
+        models.LuksVolume, '_from_pb',
+        side_effect=AssertionError('passphrase loaded')):
+      versions, _ = self._History('/history/luks/rotated')
+
+    self.assertEqual(
+        ['2017-01-04 00:00:00', '2017-01-03 00:00:00', '2017-01-02 00:00:00',
+         '2017-01-01 00:00:00'], [v['created'] for v in versions])
+    self.assertEqual(
+        [True, False, False, False], [v['active'] for v in versions])
+    self.assertEqual(
+        [True, True, True, True], [v['secret_changed'] for v in versions])
+    for version in versions:
+      self.assertNotIn('passphrase', version)
+      self.assertNotIn('secret_fingerprint', version)
+    self.assertEqual(0, crypto.Decrypt.call_count)
+
+  @mock.patch.dict(search.__dict__, {'MAX_VERSIONS_PER_PAGE': 1})
+  @mock.patch.object(
+      base_handler, 'VerifyAllPermissionTypes', return_value={'luks': True})
+  def testSecretChangedAcrossPages(self, _):
+    models.LuksVolume(
+        owners=['stub7'], hdd_serial='new', hostname='host1',
+        passphrase='a', platform_uuid='stub', volume_uuid='rotated',
+        created=datetime.datetime(2017, 1, 5)).put()
+
+    versions, _ = self._History('/history/luks/rotated')
+
+    self.assertEqual(
+        [False, True, True, True, True],
+        [v['secret_changed'] for v in versions])
+
+  def testHistoryOfOwnVersions(self):
+    versions, resp = self._History('/history/luks/rotated')
+
+    self.assertEqual(3, len(versions))
+    self.assertTrue(resp['results_access_warning'])
+
+  def testInvalidArguments(self):
+    self.testapp.get('/history/foo/rotated', status=httplib.BAD_REQUEST)
+    self.testapp.get(
+        '/history/luks/rotated?next=foo', status=httplib.BAD_REQUEST)
+
+
 if __name__ == '__main__':
   absltest.main()
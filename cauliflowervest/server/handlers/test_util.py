@@ -26,6 +26,7 @@ from google.appengine.ext import testbed
 
 from common.testing import basetest
 from cauliflowervest.server import crypto
+from cauliflowervest.server import permission_cache
 from cauliflowervest.server.models import backups
 from cauliflowervest.server.models import firmware
 from cauliflowervest.server.models import volumes
@@ -43,6 +44,8 @@ class BaseTest(basetest.AppEngineTestCase):
 
     os.environ['AUTH_DOMAIN'] = 'example.com'
 
+    permission_cache.ClearInstanceCache()
+
     # Lazily stub out key-fetching RPC dependency.
     def Stub(data, **_):
       return data
@@ -35,7 +35,7 @@ class VolumeTypesModuleTest(test_util.BaseTest):
 
   def testOk(self):
     base.User(
-        key_name='stub7@example.com', user=users.get_current_user(),
+        id='stub7@example.com', user=users.get_current_user(),
         filevault_perms=[permissions.SEARCH], luks_perms=[permissions.SEARCH],
     ).put()
 
@@ -55,7 +55,7 @@ class WindowsFirmwareHandlerTest(test_util.BaseTest):
             serial, hostname),
         params=password, status=httplib.OK)
 
-    passwords = firmware.WindowsFirmwarePassword.all().fetch(None)
+    passwords = firmware.WindowsFirmwarePassword.query().fetch(None)
 
     self.assertEqual(1, len(passwords))
     self.assertEqual(password, passwords[0].password)
@@ -18,7 +18,6 @@ import httplib
 
 from cauliflowervest.server import util
 from cauliflowervest.server.handlers import base_handler
-from cauliflowervest.server.models import base
 from cauliflowervest.server.models import errors
 
 
@@ -32,7 +31,7 @@ class Token(base_handler.BaseHandler):
       return
 
     try:
-      email = base.GetCurrentUser().email
+      email = self.context.email
     except errors.AccessDeniedError:
       raise errors.AccessDeniedError
     self.response.headers['Content-Type'] = 'text/plain'
@@ -87,8 +87,13 @@ app = webapp2.WSGIApplication([
         base.VOLUME_ACCESS_HANDLER,
     ),
     (r'/logs$', logs.Logs),
+    (r'/logs/timeline$', logs.Timeline),
+    (r'/logs/export$', logs.Export),
+    (r'/logs/stats$', logs.Stats),
     (r'/luks/([\w\d_\.-]*)/?$', luks.Luks, base.VOLUME_ACCESS_HANDLER),
     (r'/search$', search.Search),
+    (r'/search/bulk$', search.BulkSearch),
+    (r'/history/([\w\d_]+)/([^/]+)/?$', search.History),
     (r'/created$', created.Created),
     (
         r'/provisioning/([\w\d\-]*)/?$',
@@ -121,6 +126,14 @@ app = webapp2.WSGIApplication([
         r'/api/internal/maintenance/update_volumes_schema$',
         maintenance.UpdateVolumesSchema,
     ),
+    (
+        r'/api/internal/maintenance/backfill_head_index$',
+        maintenance.BackfillHeadIndex,
+    ),
+    (
+        r'/api/internal/maintenance/backfill_search_tokens$',
+        maintenance.BackfillSearchTokens,
+    ),
     (
         r'/api/v1/rekey-required/([\w\d\_]+)/([\w\d\-]+)$',
         rekey.IsRekeyNeeded,
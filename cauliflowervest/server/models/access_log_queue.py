@@ -0,0 +1,103 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pull queue through which AccessLog entities are written in batches.
+
+When an instance has many AccessLog puts in flight, logs which need not be
+in Datastore before the response is sent are added to the access-log pull
+queue instead. The entities are written with put_multi() by the
+/cron/access_log_flush cron job. Tasks are only deleted once the entities
+are written, so a log is never lost. Keys are allocated when logs are
+queued, so a log written again by a retried flush overwrites itself.
+"""
+
+import threading
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import ndb
+
+from cauliflowervest.server import settings
+
+
+QUEUE_NAME = 'access-log'
+
+# Maximum number of tasks leased by the queue, and so entities per put_multi.
+_BATCH_SIZE = 100
+_LEASE_SECONDS = 60
+
+_lock = threading.Lock()
+_pending_puts = 0
+
+
+def _PutDone():
+  global _pending_puts
+  with _lock:
+    _pending_puts -= 1
+
+
+def TrackPut(future):
+  """Counts future as an AccessLog put in flight until it is done."""
+  global _pending_puts
+  with _lock:
+    _pending_puts += 1
+  future.add_immediate_callback(_PutDone)
+
+
+def IsUnderLoad():
+  """Returns True if logs should be batched through the queue."""
+  with _lock:
+    return _pending_puts >= settings.ACCESS_LOG_MAX_PENDING_PUTS
+
+
+def EnqueueAsync(log):
+  """Adds an unsaved AccessLog entity to the queue.
+
+  Args:
+    log: base.AccessLog instance.
+  Returns:
+    taskqueue RPC; get_result() raises if the log could not be queued.
+  """
+  # Sets the mtime and user of the log now, rather than when it is flushed.
+  log._prepare_for_put()  # pylint: disable=protected-access
+  if log.key is None:
+    # The kind of the key picks the model class in Flush().
+    first, _ = log.allocate_ids(1)
+    log.key = ndb.Key(log.__class__, first)
+  payload = ndb.ModelAdapter().entity_to_pb(log).Encode()
+  return taskqueue.Queue(QUEUE_NAME).add_async(
+      taskqueue.Task(payload=payload, method='PULL'))
+
+
+def Flush(max_batches=50):
+  """Writes queued logs to Datastore.
+
+  Args:
+    max_batches: int, maximum number of put_multi() calls.
+  Returns:
+    int, number of logs written.
+  """
+  queue = taskqueue.Queue(QUEUE_NAME)
+  adapter = ndb.ModelAdapter()
+  written = 0
+  for _ in xrange(max_batches):
+    tasks = queue.lease_tasks(_LEASE_SECONDS, _BATCH_SIZE)
+    if not tasks:
+      break
+    logs = [adapter.pb_to_entity(entity_pb.EntityProto(t.payload))
+            for t in tasks]
+    ndb.put_multi(logs, use_cache=False)
+    queue.delete_tasks(tasks)
+    written += len(logs)
+  return written
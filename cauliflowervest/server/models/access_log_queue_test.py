@@ -0,0 +1,123 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""access_log_queue module tests."""
+
+
+
+from absl.testing import absltest
+import mock
+
+from google.appengine.ext import ndb
+
+from cauliflowervest.server import settings
+from cauliflowervest.server.handlers import test_util
+from cauliflowervest.server.models import access_log_queue
+from cauliflowervest.server.models import volumes
+
+
+class _FakeQueue(object):
+  """Local fake of a taskqueue pull queue."""
+
+  def __init__(self):
+    self.tasks = []
+    self.lease_calls = 0
+
+  def add_async(self, task):
+    self.tasks.append(task)
+    return mock.Mock()
+
+  def lease_tasks(self, unused_lease_seconds, max_tasks):
+    self.lease_calls += 1
+    return self.tasks[:max_tasks]
+
+  def delete_tasks(self, tasks):
+    for task in tasks:
+      self.tasks.remove(task)
+
+
+class AccessLogQueueTest(test_util.BaseTest):
+
+  def setUp(self):
+    super(AccessLogQueueTest, self).setUp()
+    self.queue = _FakeQueue()
+    patches = [
+        mock.patch.object(
+            access_log_queue.taskqueue, 'Queue', return_value=self.queue),
+        mock.patch.dict(
+            settings.__dict__, {'ACCESS_LOG_MAX_PENDING_PUTS': 0}),
+    ]
+    for p in patches:
+      p.start()
+      self.addCleanup(p.stop)
+
+  def testBatchableLogIsQueued(self):
+    volumes.LuksAccessLog.LogAsync(
+        message='Unknown PUT', successful=False, batchable=True).get_result()
+
+    self.assertEqual(1, len(self.queue.tasks))
+    self.assertEqual([], volumes.LuksAccessLog.query().fetch())
+
+    self.assertEqual(1, access_log_queue.Flush())
+
+    logs = volumes.LuksAccessLog.query().fetch()
+    self.assertEqual(1, len(logs))
+    self.assertEqual('Unknown PUT', logs[0].message)
+    self.assertFalse(logs[0].successful)
+    self.assertEqual('stub7@example.com', logs[0].user.email())
+    self.assertIsNotNone(logs[0].mtime)
+    self.assertEqual([], self.queue.tasks)
+
+  def testLogIsNotQueued(self):
+    volumes.LuksAccessLog.LogAsync(message='GET').get_result()
+
+    self.assertEqual([], self.queue.tasks)
+    self.assertEqual(1, len(volumes.LuksAccessLog.query().fetch()))
+
+  @mock.patch.dict(access_log_queue.__dict__, {'_BATCH_SIZE': 2})
+  def testFlushInBatches(self):
+    for _ in range(3):
+      volumes.LuksAccessLog.LogAsync(message='GET', batchable=True)
+
+    self.assertEqual(3, access_log_queue.Flush())
+
+    self.assertEqual(3, self.queue.lease_calls)
+    self.assertEqual(3, len(volumes.LuksAccessLog.query().fetch()))
+
+  def testRetriedFlushDoesNotDuplicateLogs(self):
+    volumes.LuksAccessLog.LogAsync(message='GET', batchable=True)
+    with mock.patch.object(
+        self.queue, 'delete_tasks',
+        side_effect=access_log_queue.taskqueue.Error):
+      self.assertRaises(
+          access_log_queue.taskqueue.Error, access_log_queue.Flush)
+
+    self.assertEqual(1, access_log_queue.Flush())
+
+    self.assertEqual(1, len(volumes.LuksAccessLog.query().fetch()))
+    self.assertEqual([], self.queue.tasks)
+
+  def testIsUnderLoad(self):
+    future = ndb.Future()
+    with mock.patch.dict(
+        settings.__dict__, {'ACCESS_LOG_MAX_PENDING_PUTS': 1}):
+      self.assertFalse(access_log_queue.IsUnderLoad())
+      access_log_queue.TrackPut(future)
+      self.assertTrue(access_log_queue.IsUnderLoad())
+      future.set_result(None)
+      self.assertFalse(access_log_queue.IsUnderLoad())
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -14,7 +14,7 @@
 
 """Models related to Backup Encryption."""
 
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
 from cauliflowervest import settings as base_settings
 from cauliflowervest.server import encrypted_property
@@ -62,8 +62,8 @@ class DuplicityKeyPair(base.BasePassphrase,
   SECRET_PROPERTY_NAME = 'key_pair'
   TARGET_PROPERTY_NAME = 'volume_uuid'
 
-  platform_uuid = db.StringProperty()
+  platform_uuid = ndb.StringProperty()
   key_pair = encrypted_property.EncryptedBlobProperty(
       _DUPLICITY_KEY_PAIR_ENCRYPTION_KEY_NAME)
 
-  volume_uuid = db.StringProperty()  # UUID of the backup.
+  volume_uuid = ndb.StringProperty()  # UUID of the backup.
@@ -14,27 +14,40 @@
 
 """App Engine Models for CauliflowerVest web application."""
 
+import datetime
 import hashlib
+import hmac
+import json
 import logging
+import operator
 
 
 
 import webapp2
 
-from google.appengine.api import memcache
+from google.appengine.api import datastore_errors
 from google.appengine.api import oauth
 from google.appengine.api import users
-from google.appengine.ext import db
+from google.appengine.ext import ndb
+from google.net.proto import ProtocolBuffer
 
 from cauliflowervest import settings as base_settings
+from cauliflowervest.server import crypto
+from cauliflowervest.server import permission_cache
 from cauliflowervest.server import permissions
+from cauliflowervest.server import search_cache
 from cauliflowervest.server import settings
+from cauliflowervest.server.models import access_log_queue
 from cauliflowervest.server.models import errors
 
 
 VOLUME_ACCESS_HANDLER = 'VolumeAccessHandler'
 XSRF_TOKEN_GENERATE_HANDLER = 'XsrfTokenGenerateHandler'
 
+# Length of the n-grams in BasePassphrase.search_tokens, and so the shortest
+# substring which can be searched.
+SEARCH_NGRAM_LENGTH = 3
+
 
 
 
@@ -48,7 +61,7 @@ def _GetApiUser():
   # to "example@example.com" and user ID set to 0 regardless of whether or
   # not a valid OAuth request was made.  So test for oauth last.
   try:
-    # Get the db.User that represents the user on whose behalf the
+    # Get the users.User that represents the user on whose behalf the
     # consumer is making this request.
     user = oauth.get_current_user(base_settings.OAUTH_SCOPE)
     client_id = oauth.get_client_id(base_settings.OAUTH_SCOPE)
@@ -60,39 +73,167 @@ def _GetApiUser():
   raise errors.AccessDeniedError('All authentication methods failed')
 
 
+def _GetOrCreateUser(user):
+  """Returns the User entity of users.User user, creating it for admins.
+
+  Returns:
+    Tuple of the models.User entity and a bool, True if the entity is stored
+    in Datastore.
+  """
+  user_entity = User.get_by_id(user.email())
+  if user_entity:
+    return user_entity, True
+
+  user_entity = User(id=user.email(), user=user)
+  if not users.is_current_user_admin():
+    return user_entity, False
+
+  # Automatically create User entities with full permissions for
+  # users with admin privileges.
+  for permission_type in permissions.TYPES:
+    user_entity.SetPerms(permissions.SET_REGULAR, permission_type)
+  user_entity.user = users.User(user.email())
+  user_entity.put()
+  permission_cache.BumpGeneration()
+  return user_entity, True
+
+
+class RequestContext(object):
+  """Identity and permissions of the current request.
+
+  Each value is computed on first use and then memoized for the lifetime of
+  the request; use GetRequestContext() to get the context of the current
+  request. Permissions of users with a User entity are also cached across
+  requests by permission_cache, so permission checks do not need to load
+  the entity.
+  """
+
+  def __init__(self):
+    self._api_user = None
+    self._auth_error = None
+    self._user = None
+    self._user_stored = False
+    self._permissions = None
+    self._pending_writes = []
+
+  @property
+  def api_user(self):
+    """users.User of the authenticated user.
+
+    Raises:
+      AccessDeniedError: raised when no user is logged in.
+    """
+    if self._auth_error:
+      raise self._auth_error
+    if self._api_user is None:
+      try:
+        self._api_user = _GetApiUser()
+      except errors.AccessDeniedError as e:
+        self._auth_error = e
+        raise
+    return self._api_user
+
+  @property
+  def email(self):
+    """Email address of the authenticated user."""
+    return self.api_user.email()
+
+  @property
+  def user(self):
+    """models.User entity of the authenticated user."""
+    if self._user is None:
+      self._user, self._user_stored = _GetOrCreateUser(self.api_user)
+    return self._user
+
+  @property
+  def permissions(self):
+    """permission_cache.Snapshot of permissions of the user."""
+    if self._permissions is None:
+      generation = permission_cache.GetGeneration()
+      snapshot = permission_cache.Get(generation, self.email)
+      if snapshot is None:
+        snapshot = permission_cache.Snapshot.Compile(
+            self.user.GetPermissions())
+        # Users without an entity are not cached, so that admins are still
+        # bootstrapped by _GetOrCreateUser().
+        if self._user_stored:
+          permission_cache.Put(generation, self.email, snapshot)
+      self._permissions = snapshot
+    return self._permissions
+
+  def HasPerm(self, perm, permission_type):
+    """Like User.HasPerm, for the authenticated user."""
+    return self.permissions.HasPerm(perm, permission_type)
+
+  def PermissionTypesWith(self, perm):
+    """Returns dict of permission type to True if the user has perm."""
+    return self.permissions.PermissionTypesWith(perm)
+
+  def AddPendingWrite(self, future):
+    """Adds a write to wait for in WaitForPendingWrites()."""
+    self._pending_writes.append(future)
+
+  def WaitForPendingWrites(self):
+    """Waits for all pending writes to finish.
+
+    Raises:
+      The exception of the first failed write, once all writes are done.
+    """
+    pending, self._pending_writes = self._pending_writes, []
+    error = None
+    for future in pending:
+      try:
+        future.get_result()
+      except Exception as e:  # pylint: disable=broad-except
+        logging.exception('Pending write failed.')
+        error = error or e
+    if error is not None:
+      raise error  # pylint: disable=raising-bad-type
+
+
+_REQUEST_CONTEXT_KEY = 'cauliflowervest.request_context'
+
+
+def GetRequestContext():
+  """Returns the RequestContext of the current webapp2 request.
+
+  Outside of a request a new, empty RequestContext is returned on every call.
+  """
+  try:
+    request = webapp2.get_request()
+  except AssertionError:
+    return RequestContext()
+
+  context = request.registry.get(_REQUEST_CONTEXT_KEY)
+  if context is None:
+    context = RequestContext()
+    request.registry[_REQUEST_CONTEXT_KEY] = context
+  return context
+
+
 # Here so that AutoUpdatingUserProperty will work without dependency cycles.
 def GetCurrentUser():
   """Returns a models.User object for the currently logged in user.
 
   If the current logged in user is an App Engine admin, a User entity will
   be created for them with permissions.SET_REGULAR permissions and saved to the
-  datastore.
+  datastore. The entity is memoized in the RequestContext.
 
   Returns:
     models.User object.
   Raises:
     AccessDeniedError: raised when no user is logged in.
   """
-  user = _GetApiUser()
-
-  user_entity = User.get_by_key_name(user.email())
-  if not user_entity:
-    user_entity = User(key_name=user.email(), user=user)
-    if users.is_current_user_admin():
-      # Automatically create User entities with full permissions for
-      # users with admin privileges.
-      for permission_type in permissions.TYPES:
-        user_entity.SetPerms(permissions.SET_REGULAR, permission_type)
-      user_entity.user = users.User(user.email())
-      user_entity.put()
+  return GetRequestContext().user
 
-  return user_entity
 
+class AutoUpdatingUserProperty(ndb.UserProperty):
+  """UserProperty that sets the current users.User if not already set.
 
-class AutoUpdatingUserProperty(db.UserProperty):
-  """UserProperty that sets the current users.User if not already set."""
+  The value is set on first access or on put, whichever comes first.
+  """
 
-  def default_value(self):
+  def _default_value(self):
     """Returns the current user logged in."""
     try:
       user = GetCurrentUser()
@@ -100,13 +241,54 @@ class AutoUpdatingUserProperty(db.UserProperty):
     except errors.AccessDeniedError:
       pass
 
-    return self.default
+    return self._default
+
+  def _SetDefault(self, entity):
+    if not self._has_value(entity):
+      self._store_value(entity, self._default_value())
 
+  def _get_value(self, entity):
+    self._SetDefault(entity)
+    return super(AutoUpdatingUserProperty, self)._get_value(entity)
 
-class OwnersProperty(db.StringListProperty):
+  def _prepare_for_put(self, entity):
+    self._SetDefault(entity)
+    super(AutoUpdatingUserProperty, self)._prepare_for_put(entity)
+
+
+def _Hmac(data):
+  """Returns hex keyed-HMAC of data, using the fingerprint key."""
+  key = crypto.ENCRYPTION_KEY_TYPES[settings.KEY_TYPE_DEFAULT_FINGERPRINT]()
+  return hmac.new(key, data, hashlib.sha256).hexdigest()
+
+
+def _Ngrams(value):
+  """Returns the set of lowercase n-grams of value."""
+  value = value.lower()
+  return set(value[i:i + SEARCH_NGRAM_LENGTH]
+             for i in xrange(len(value) - SEARCH_NGRAM_LENGTH + 1))
+
+
+def _CanonicalValue(value):
+  """Returns a JSON serializable value, equal for equal property values."""
+  if isinstance(value, (list, tuple)):
+    return [_CanonicalValue(v) for v in value]
+  if value is None or isinstance(value, (bool, int, long, float)):
+    return value
+  if isinstance(value, users.User):
+    return value.email()
+  return unicode(value)
+
+
+class OwnersProperty(ndb.StringProperty):
   """Property to store emails."""
 
-  def _Normalize(self, value):
+  def __init__(self, *args, **kwargs):
+    kwargs['repeated'] = True
+    super(OwnersProperty, self).__init__(*args, **kwargs)
+
+  def _validate(self, value):
+    """Normalizes each email, called for every item of the list."""
     if not value:
       return value
 
@@ -114,12 +296,8 @@ class OwnersProperty(db.StringListProperty):
       value = '%s@%s' % (value, settings.DEFAULT_EMAIL_DOMAIN)
     return value
 
-  def validate(self, value):
-    value = super(OwnersProperty, self).validate(value)
-    return [self._Normalize(v) for v in value]
 
-
-class BasePassphrase(db.Model):
+class BasePassphrase(ndb.Model):
   """Base model for various types of passphrases."""
 
   def __init__(self, owner=None, **kwds):
@@ -136,18 +314,69 @@ class BasePassphrase(db.Model):
   MUTABLE_PROPERTIES = [
       'force_rekeying', 'hostname', 'owners',
   ]
+  # Fields which can be searched by substring, through search_tokens.
+  SUBSTRING_SEARCH_FIELDS = ['hostname']
+  _FINGERPRINT_PROPERTIES = frozenset(['fingerprint', 'secret_fingerprint'])
+  # Properties derived from others to serve searches.
+  _SEARCH_INDEX_PROPERTIES = frozenset(['search_tokens'])
+  # Properties which are not covered by fingerprint.
+  _UNFINGERPRINTED_PROPERTIES = (
+      _FINGERPRINT_PROPERTIES | _SEARCH_INDEX_PROPERTIES |
+      frozenset(['created']))
+  # Properties left out of ToDict(), besides the fingerprints and search
+  # index.
+  _DICT_EXCLUDED_PROPERTIES = frozenset()
+  # Property name to function formatting its value for ToDict(); other
+  # values are formatted with unicode().
+  _DICT_FORMATTERS = {}
 
   # True for only the most recently escrowed, unique target_id.
-  active = db.BooleanProperty(default=True)
+  active = ndb.BooleanProperty(default=True)
 
-  created = db.DateTimeProperty(auto_now_add=True)
+  created = ndb.DateTimeProperty(auto_now_add=True)
   created_by = AutoUpdatingUserProperty()  # user that created the object.
-  force_rekeying = db.BooleanProperty(default=False)
-  hostname = db.StringProperty()
+  force_rekeying = ndb.BooleanProperty(default=False)
+  hostname = ndb.StringProperty()
 
   owners = OwnersProperty()
 
-  tag = db.StringProperty(default='default')  # Key Slot
+  tag = ndb.StringProperty(default='default')  # Key Slot
+
+  # Keyed-HMAC of the secret, computed when a new entity is put.
+  secret_fingerprint = ndb.StringProperty(indexed=False)
+  # Keyed-HMAC of secret_fingerprint and all other properties except created.
+  # Two entities with equal fingerprints are duplicates.
+  fingerprint = ndb.ComputedProperty(
+      lambda self: self._ComputeFingerprint(), indexed=False)
+  # Field-prefixed n-grams of SUBSTRING_SEARCH_FIELDS, like 'hostname:foo'.
+  # Recomputed on every put, so hostname changes are indexed too.
+  search_tokens = ndb.ComputedProperty(
+      lambda self: self._ComputeSearchTokens(), repeated=True)
+
+  @classmethod
+  def PropertyNames(cls):
+    """Returns the attribute names of all properties of the model."""
+    # pylint: disable=protected-access
+    return [p._code_name for p in cls._properties.itervalues()]
+
+  @classmethod
+  def GetByUrlsafeKey(cls, urlsafe):
+    """Returns the entity with the key from ToDict()['id'], or None.
+
+    Args:
+      urlsafe: str, urlsafe encoded key.
+    Returns:
+      entity of this model, or None if there is no such entity.
+    Raises:
+      datastore_errors.BadKeyError: urlsafe is not a valid key.
+    """
+    try:
+      key = ndb.Key(urlsafe=urlsafe)
+    except (TypeError, ProtocolBuffer.ProtocolBufferDecodeError) as e:
+      raise datastore_errors.BadKeyError(str(e))
+    if key.kind() != cls._get_kind():
+      return None
+    return key.get()
 
   def ChangeOwners(self, new_owners, request=None):
     """Changes owner.
@@ -167,14 +396,66 @@ class BasePassphrase(db.Model):
         message='changes owners of %s from %s to %s' % (
             self.target_id, self.owners, new_owners))
 
-    self._UpdateMutableProperties(self.key(), {
+    self._UpdateMutableProperties(self.key, {
         'owners': new_owners,
         'force_rekeying': True,
     })
     return True
 
+  def ComputeSecretFingerprint(self):
+    """Returns keyed-HMAC of the secret, decrypting it if necessary."""
+    return _Hmac(str(self.secret or ''))
+
+  def _ComputeFingerprint(self):
+    if not self.secret_fingerprint:
+      return None
+    values = {}
+    for p in self.PropertyNames():
+      if (p in self._UNFINGERPRINTED_PROPERTIES
+          or p == self.SECRET_PROPERTY_NAME):
+        continue
+      values[p] = _CanonicalValue(getattr(self, p))
+    values['secret_fingerprint'] = self.secret_fingerprint
+    return _Hmac(json.dumps(values, sort_keys=True))
+
+  def _ComputeSearchTokens(self):
+    tokens = set()
+    for field in self.SUBSTRING_SEARCH_FIELDS:
+      values = getattr(self, field)
+      if not isinstance(values, list):
+        values = [values]
+      for value in values:
+        if value:
+          tokens.update(self.SearchTokens(field, value))
+    return sorted(tokens)
+
+  @classmethod
+  def SearchTokens(cls, field, value):
+    """Returns the search_tokens of value in field.
+
+    Args:
+      field: str, one of SUBSTRING_SEARCH_FIELDS.
+      value: str, field value, or substring of it to search.
+    Returns:
+      list of str, empty if value is shorter than SEARCH_NGRAM_LENGTH.
+    """
+    return ['%s:%s' % (field, gram) for gram in sorted(_Ngrams(value))]
+
+  def _IsDuplicateOf(self, other):
+    """Returns True if other differs from this entity only in created."""
+    if self.secret_fingerprint and other.secret_fingerprint:
+      return self.fingerprint == other.fingerprint
+
+    # other was written before fingerprints were introduced.
+    for prop in self.PropertyNames():
+      if prop in self._UNFINGERPRINTED_PROPERTIES:
+        continue
+      if getattr(self, prop) != getattr(other, prop):
+        return False
+    return True
+
   def __eq__(self, other):
-    for p in self.properties():
+    for p in self.PropertyNames():
       if getattr(self, p) != getattr(other, p):
         return False
     return True
@@ -182,39 +463,145 @@ class BasePassphrase(db.Model):
   def __ne__(self, other):
     return not self.__eq__(other)
 
+  @classmethod
+  def _CompileSerializer(cls, skip_secret):
+    """Returns the ToDict() function of the model, and its version."""
+    names = [p for p in sorted(cls.PropertyNames())
+             if p not in cls._FINGERPRINT_PROPERTIES
+             and p not in cls._SEARCH_INDEX_PROPERTIES
+             and p not in cls._DICT_EXCLUDED_PROPERTIES
+             and (not skip_secret or p != cls.SECRET_PROPERTY_NAME)]
+    fields = [(p, operator.attrgetter(p), cls._DICT_FORMATTERS.get(p, unicode))
+              for p in names]
+
+    def Serialize(entity):
+      passphrase = {p: formatter(getter(entity))
+                    for p, getter, formatter in fields}
+      passphrase['id'] = entity.key.urlsafe()
+      passphrase['active'] = entity.active  # store the bool, not string, value
+      passphrase['target_id'] = entity.target_id
+      passphrase['owners'] = entity.owners
+      return passphrase
+
+    version = hashlib.sha1(repr(names)).hexdigest()[:8]
+    return Serialize, version
+
+  @classmethod
+  def Serializer(cls, skip_secret=False):
+    """Returns the function which ToDict() uses, and its version.
+
+    The function is compiled once per model. Its version changes whenever
+    the serialized properties do.
+    """
+    serializers = cls.__dict__.get('_serializers')
+    if serializers is None:
+      serializers = {}
+      cls._serializers = serializers
+    if skip_secret not in serializers:
+      serializers[skip_secret] = cls._CompileSerializer(skip_secret)
+    return serializers[skip_secret]
+
   def ToDict(self, skip_secret=False):
-    passphrase = {p: unicode(getattr(self, p)) for p in self.properties()
-                  if not skip_secret or p != self.SECRET_PROPERTY_NAME}
-    passphrase['id'] = str(self.key())
-    passphrase['active'] = self.active  # store the bool, not string, value
-    passphrase['target_id'] = self.target_id
-    passphrase['owners'] = self.owners
-    return passphrase
+    return self.Serializer(skip_secret)[0](self)
+
+  def _post_put_hook(self, future):
+    if future.get_exception() is None:
+      # Bumped once the change is visible, so no search of the new generation
+      # sees the old data.
+      ndb.get_context().call_on_commit(
+          lambda: search_cache.BumpGeneration(self.__class__))
+
+  @classmethod
+  def _post_delete_hook(cls, key, future):
+    if future.get_exception() is None:
+      PassphraseSummary.KeyFor(key).delete()
+      ndb.get_context().call_on_commit(
+          lambda: search_cache.BumpGeneration(cls))
 
   @classmethod
   def GetLatestForTarget(cls, target_id, tag='default'):
-    entity = cls.all().filter('tag =', tag).filter(
-        '%s =' % cls.TARGET_PROPERTY_NAME, target_id).order('-created').fetch(1)
+    """Returns the most recent entity for target_id and tag, or None."""
+    latest_key = PassphraseHead.GetLatestKey(cls, target_id, tag)
+    if latest_key:
+      entity = latest_key.get()
+      if entity:
+        return entity
+    return cls.QueryLatestForTarget(target_id, tag)
+
+  @classmethod
+  def QueryLatestForTarget(cls, target_id, tag='default'):
+    """Like GetLatestForTarget, but ignores PassphraseHead."""
+    target_property = getattr(cls, cls.TARGET_PROPERTY_NAME)
+    entity = cls.query(cls.tag == tag, target_property == target_id).order(
+        -cls.created).fetch(1)
     if not entity:
       return None
     return entity[0]
 
   def Clone(self):
-    items = {p.name: getattr(self, p.name) for p in self.properties().values()
-             if not isinstance(p, db.ComputedProperty)}
+    items = {p: getattr(self, p) for p in self.PropertyNames()
+             if not isinstance(getattr(self.__class__, p),
+                               ndb.ComputedProperty)}
     del items['created_by']
     del items['created']
     return self.__class__(**items)
 
-  @db.transactional(xg=True)
-  def _PutNew(self, ancestor_key, *args, **kwargs):
-    ancestor = self.get(ancestor_key)
+  def _AllocateKey(self):
+    """Returns the key of the entity, allocating one for new entities."""
+    if not self.key:
+      first, _ = self.allocate_ids(1)
+      self.key = ndb.Key(self.__class__, first)
+    return self.key
+
+  def _PutWithSummary(self, *others, **ctx_options):
+    """Puts the entity, its PassphraseSummary and others in one batch.
+
+    Unlike put(), existing entities are overwritten.
+
+    Args:
+      *others: more entities to put.
+      **ctx_options: ndb context options.
+    Returns:
+      ndb.Key of the entity.
+    """
+    # The summary is keyed under the entity, so new entities need a key first.
+    self._AllocateKey()
+    entities = [self, PassphraseSummary.FromEntity(self)] + list(others)
+    return ndb.put_multi(entities, **ctx_options)[0]
+
+  @ndb.transactional(xg=True)
+  def _PutNew(self, ancestor_key, **ctx_options):
+    ancestor = ancestor_key.get()
     if not ancestor.active:
       raise self.ACCESS_ERR_CLS(
           'parent entity is inactive: %s.' % self.target_id)
     ancestor.active = False
-    super(BasePassphrase, ancestor).put(*args, **kwargs)
-    return super(BasePassphrase, self).put(*args, **kwargs)
+    ancestor._PutWithSummary(**ctx_options)  # pylint: disable=protected-access
+    return self._PutAsLatest(**ctx_options)
+
+  @ndb.transactional(xg=True)
+  def _PutAsLatest(self, new_target=False, **ctx_options):
+    key = self._AllocateKey()
+    head = PassphraseHead.Get(self.__class__, self.target_id, self.tag)
+    if head is None:
+      # Versions of targets escrowed before heads are only counted once
+      # BackfillHeadIndex created their head.
+      head = PassphraseHead.Make(
+          self.__class__, self.target_id, self.tag, key,
+          versions=1 if new_target else None)
+    else:
+      head.latest = key
+      head.CountVersion()
+    return self._PutWithSummary(head, **ctx_options)
+
+  @ndb.transactional(xg=True)
+  def _PutFromPast(self, **ctx_options):
+    self.active = False
+    head = PassphraseHead.Get(self.__class__, self.target_id, self.tag)
+    if head is None:
+      return self._PutWithSummary(**ctx_options)
+    head.CountVersion()
+    return self._PutWithSummary(head, **ctx_options)
 
   def put(self, parent=None, *args, **kwargs):  # pylint: disable=g-bad-name
     """Disallow updating an existing entity, and enforce key_name.
@@ -243,10 +630,15 @@ class BasePassphrase(db.Model):
       raise self.ACCESS_ERR_CLS(
           'New entity is not active: %s' % self.target_id)
 
-    if self.has_key():
+    if self.key:
       raise self.ACCESS_ERR_CLS(
           'Key should be auto genenrated for %s.' % model_name)
 
+    if not self.created:
+      # auto_now_add is only applied on put, but is compared below.
+      self.created = datetime.datetime.utcnow()
+    self.secret_fingerprint = self.ComputeSecretFingerprint()
+
     existing_entity = parent
     if not existing_entity:
       existing_entity = self.__class__.GetLatestForTarget(
@@ -255,26 +647,21 @@ class BasePassphrase(db.Model):
       if not existing_entity.active:
         raise self.ACCESS_ERR_CLS(
             'parent entity is inactive: %s.' % self.target_id)
-      different_properties = []
-      for prop in self.properties():
-        if getattr(self, prop) != getattr(existing_entity, prop):
-          different_properties.append(prop)
-
-      if not different_properties or different_properties == ['created']:
+      if self._IsDuplicateOf(existing_entity):
         raise errors.DuplicateEntity()
 
       if self.created > existing_entity.created:
-        return self._PutNew(existing_entity.key())
+        return self._PutNew(existing_entity.key, **kwargs)
       else:
         logging.warning('entity from past')
-        self.active = False
+        return self._PutFromPast(**kwargs)
 
-    return super(BasePassphrase, self).put(*args, **kwargs)
+    return self._PutAsLatest(new_target=True, **kwargs)
 
   @classmethod
-  @db.transactional()
+  @ndb.transactional()
   def _UpdateMutableProperties(cls, key, changes):
-    entity = cls.get(key)
+    entity = key.get()
     if not entity.active:
       raise cls.ACCESS_ERR_CLS('entity is inactive: %s.' % entity.target_id)
 
@@ -282,16 +669,16 @@ class BasePassphrase(db.Model):
       if property_name == 'hostname':
         value = cls.NormalizeHostname(value)
       setattr(entity, property_name, value)
-    return super(BasePassphrase, entity).put()
+    return entity._PutWithSummary()  # pylint: disable=protected-access
 
   def UpdateMutableProperty(self, property_name, value):
-    if not self.has_key():
-      raise self.ACCESS_ERR_CLS('Volume should be in the db.')
+    if not self.key:
+      raise self.ACCESS_ERR_CLS('Volume should be in the datastore.')
 
     if property_name not in self.MUTABLE_PROPERTIES:
       raise ValueError
 
-    self._UpdateMutableProperties(self.key(), {property_name: value})
+    self._UpdateMutableProperties(self.key, {property_name: value})
     setattr(self, property_name, value)
 
   @property
@@ -326,7 +713,161 @@ class BasePassphrase(db.Model):
     return hostname.lower()
 
 
-class User(db.Model):
+class PassphraseHead(ndb.Model):
+  """Points at the active version of a passphrase.
+
+  There is one entity per model, target_id and tag, updated in the same
+  transaction which puts a new version, so that the latest version can be
+  fetched by key instead of with a query. The same transactions count the
+  versions, so that they are not counted with a query either.
+  """
+  # id = KeyName(model, target_id, tag).
+  latest = ndb.KeyProperty(indexed=False)
+  # Number of versions, or None for heads of targets escrowed before versions
+  # were counted, until BackfillHeadIndex counts them.
+  versions = ndb.IntegerProperty(indexed=False)
+
+  @classmethod
+  def KeyName(cls, model, target_id, tag):
+    # pylint: disable=protected-access
+    return '%s:%s:%s' % (model._get_kind(), tag, target_id)
+
+  @classmethod
+  def Make(cls, model, target_id, tag, latest_key, versions=None):
+    return cls(id=cls.KeyName(model, target_id, tag), latest=latest_key,
+               versions=versions)
+
+  @classmethod
+  def Get(cls, model, target_id, tag):
+    """Returns the head of target_id and tag, or None."""
+    return cls.get_by_id(cls.KeyName(model, target_id, tag))
+
+  @classmethod
+  def GetLatestKey(cls, model, target_id, tag):
+    """Returns ndb.Key of the active version, or None if there is no head."""
+    head = cls.Get(model, target_id, tag)
+    if not head:
+      return None
+    return head.latest
+
+  @classmethod
+  @ndb.tasklet
+  def GetVersionCountsAsync(cls, model, targets):
+    """Gets the number of versions of many targets with one batch get.
+
+    Args:
+      model: BasePassphrase model.
+      targets: list of (target_id, tag) tuples.
+    Returns:
+      ndb.Future of list of int, in the order of targets, None where the
+      versions are not counted.
+    """
+    heads = yield ndb.get_multi_async([
+        ndb.Key(cls, cls.KeyName(model, target_id, tag))
+        for target_id, tag in targets])
+    raise ndb.Return([head.versions if head else None for head in heads])
+
+  def CountVersion(self):
+    """Counts a new version, in the transaction which puts it."""
+    if self.versions is not None:
+      self.versions += 1
+
+
+class PassphraseSummary(ndb.Model):
+  """Secret-free search result of a passphrase.
+
+  Each passphrase has one, with id 1 under the passphrase's key, put in the
+  same batch as the passphrase. Search fetches the keys of the matching
+  passphrases and gets their summaries, so it never loads secrets.
+  """
+  # Incremented when properties are added, so older summaries are rewritten.
+  _FORMAT = 2
+
+  # ToDict(skip_secret=True) of the passphrase, without id.
+  data = ndb.JsonProperty(indexed=False)
+  # secret_fingerprint of the passphrase, which ToDict() leaves out.
+  secret_fingerprint = ndb.StringProperty(indexed=False)
+  # VersionFor() the model when the summary was written.
+  version = ndb.StringProperty(indexed=False)
+
+  @classmethod
+  def KeyFor(cls, passphrase_key):
+    return ndb.Key(cls, 1, parent=passphrase_key)
+
+  @classmethod
+  def VersionFor(cls, model):
+    """Returns the version of up to date summaries of model."""
+    return '%s.%d' % (model.Serializer(skip_secret=True)[1], cls._FORMAT)
+
+  @classmethod
+  def FromEntity(cls, entity):
+    data = entity.ToDict(skip_secret=True)
+    del data['id']
+    return cls(key=cls.KeyFor(entity.key), data=data,
+               secret_fingerprint=entity.secret_fingerprint,
+               version=cls.VersionFor(entity.__class__))
+
+  @classmethod
+  @ndb.transactional_tasklet
+  def _RewriteAsync(cls, key, version):
+    """Rebuilds the summary of passphrase key, if still missing or stale.
+
+    The transaction makes sure a passphrase put since it was read is not
+    overwritten by a summary of its older data.
+
+    Returns:
+      ndb.Future of the up to date PassphraseSummary, or None if the
+      passphrase was deleted.
+    """
+    entity, summary = yield ndb.get_multi_async([key, cls.KeyFor(key)])
+    if entity is None:
+      raise ndb.Return(None)
+    if summary is None or summary.version != version:
+      summary = cls.FromEntity(entity)
+      yield summary.put_async()
+    raise ndb.Return(summary)
+
+  @classmethod
+  @ndb.tasklet
+  def GetResultsAsync(cls, model, keys, with_secret_fingerprint=False):
+    """Gets search results of passphrases, like ToDict(skip_secret=True).
+
+    Passphrases without an up to date summary are loaded instead, and their
+    summary is rewritten by _RewriteAsync().
+
+    Args:
+      model: BasePassphrase model of keys.
+      keys: list of ndb.Key of passphrases.
+      with_secret_fingerprint: bool, True to add the secret_fingerprint of
+          each passphrase to its result.
+    Returns:
+      ndb.Future of list of dicts, in the order of keys. Deleted passphrases
+      are skipped.
+    """
+    version = cls.VersionFor(model)
+    summaries = yield ndb.get_multi_async([cls.KeyFor(key) for key in keys])
+    stale = [key for key, summary in zip(keys, summaries)
+             if not summary or summary.version != version]
+    rewritten = {}
+    if stale:
+      summaries_of_stale = yield [
+          cls._RewriteAsync(key, version) for key in stale]
+      rewritten = dict(zip(stale, summaries_of_stale))
+
+    results = []
+    for key, summary in zip(keys, summaries):
+      summary = rewritten.get(key, summary)
+      if not summary:
+        continue
+      result = dict(summary.data)
+      result['id'] = key.urlsafe()
+      if with_secret_fingerprint:
+        result['secret_fingerprint'] = summary.secret_fingerprint
+      results.append(result)
+    raise ndb.Return(results)
+
+
+class User(ndb.Model):
   """User of the CauliflowerVest application."""
 
   _PERMISSION_PROPERTIES = {
@@ -340,22 +881,22 @@ class User(db.Model):
       permissions.TYPE_WINDOWS_FIRMWARE: 'windows_firmware_perms',
   }
 
-  # key_name = user's email address.
-  user = db.UserProperty()
+  # id = user's email address.
+  user = ndb.UserProperty()
   # Select BitLocker operational permissions from ALL_PERMISSIONS.
-  bitlocker_perms = db.StringListProperty()
+  bitlocker_perms = ndb.StringProperty(repeated=True)
   # Select Duplicity operational permissions from ALL_PERMISSIONS.
-  duplicity_perms = db.StringListProperty()
+  duplicity_perms = ndb.StringProperty(repeated=True)
   # Select FileVault operational permissions from ALL_PERMISSIONS.
-  filevault_perms = db.StringListProperty()
+  filevault_perms = ndb.StringProperty(repeated=True)
   # Select Luks operational permissions from ALL_PERMISSIONS.
-  luks_perms = db.StringListProperty()
+  luks_perms = ndb.StringProperty(repeated=True)
   # Select Provisioning operational permissions from ALL_PERMISSIONS.
-  provisioning_perms = db.StringListProperty()
+  provisioning_perms = ndb.StringProperty(repeated=True)
   # Select Firmware operational permissions from ALL_PERMISSIONS.
-  apple_firmware_perms = db.StringListProperty()
-  linux_firmware_perms = db.StringListProperty()
-  windows_firmware_perms = db.StringListProperty()
+  apple_firmware_perms = ndb.StringProperty(repeated=True)
+  linux_firmware_perms = ndb.StringProperty(repeated=True)
+  windows_firmware_perms = ndb.StringProperty(repeated=True)
 
   @property
   def email(self):
@@ -379,6 +920,18 @@ class User(db.Model):
     base_perms = settings.DEFAULT_PERMISSIONS.get(permission_type, ())
     return perm in base_perms or perm in getattr(self, perm_prop, [])
 
+  def GetPermissions(self):
+    """Returns dict of permission type to frozenset of permissions.
+
+    Permissions include settings.DEFAULT_PERMISSIONS.
+    """
+    perms = {}
+    for permission_type, perm_prop in self._PERMISSION_PROPERTIES.iteritems():
+      perms[permission_type] = frozenset(
+          settings.DEFAULT_PERMISSIONS.get(permission_type, ())).union(
+              getattr(self, perm_prop, []))
+    return perms
+
   def SetPerms(self, perms, permission_type):
     """Sets the permissions to the User object.
 
@@ -394,23 +947,24 @@ class User(db.Model):
     setattr(self, perm_prop, list(perms))
 
 
-class AccessLog(db.Model):
-  """Model for logging access to passphrases."""
-  ip_address = db.StringProperty()
-  message = db.StringProperty()
-  mtime = db.DateTimeProperty(auto_now_add=True)
-  query = db.StringProperty()
-  successful = db.BooleanProperty(default=True)
-  user = AutoUpdatingUserProperty()
+class AccessLog(ndb.Model):
+  """Model for logging access to passphrases.
 
-  # Guaranteed unique, for pagination.
-  paginate_mtime = db.StringProperty()
+  Logs are never read by key, so they are not cached in memcache.
+  """
+  _use_memcache = False
+
+  ip_address = ndb.StringProperty()
+  message = ndb.StringProperty()
+  mtime = ndb.DateTimeProperty(auto_now_add=True)
+  query_string = ndb.StringProperty('query')
+  successful = ndb.BooleanProperty(default=True)
+  # target_id of the entity passed to Log(), if any.
+  target_id = ndb.StringProperty()
+  user = AutoUpdatingUserProperty()
 
-  def put(self):  # pylint: disable=g-bad-name
-    """Override put to automatically calculate pagination properties."""
-    counter = memcache.incr('AccessLogCounter', initial_value=0)
-    self.paginate_mtime = '%s_%s' % (self.mtime, counter)
-    super(AccessLog, self).put()
+  # Written by older versions for pagination; logs are now paged by mtime.
+  paginate_mtime = ndb.StringProperty()
 
   @classmethod
   def Log(cls, request=None, **kwargs):
@@ -421,11 +975,80 @@ class AccessLog(db.Model):
        **kwargs: any key/value pair with a key corresponding to an existing
           AccessLog property name.
     """
+    cls.LogAsync(request=request, **kwargs).get_result()
+
+  @classmethod
+  def LogAsync(cls, request=None, batchable=False, **kwargs):
+    """Starts to put a new AccessLog entity into Datastore.
+
+    Within a request the write is joined by BaseHandler once the handler
+    returns. Callers which must not respond before the log is committed,
+    e.g. because the response contains a secret, call get_result() first.
+
+    Args:
+       request: a webapp Request object to fetch obtain details from.
+       batchable: bool, True if the log may be written in a batch by the
+          access_log_queue when the instance is under load.
+       **kwargs: any key/value pair with a key corresponding to an existing
+          AccessLog property name, or entity, the BasePassphrase accessed.
+    Returns:
+      Future-like object; get_result() raises if the log was not written.
+    """
     log = cls()
-    for p in log.properties():
-      if p in kwargs:
-        setattr(log, p, kwargs[p])
+    for prop in log._properties.itervalues():
+      if prop._code_name in kwargs:
+        setattr(log, prop._code_name, kwargs[prop._code_name])
+    entity = kwargs.get('entity')
+    if entity is not None and log.target_id is None:
+      log.target_id = entity.target_id
     if request:
-      log.query = '%s?%s' % (request.path, request.query_string)
+      log.query_string = '%s?%s' % (request.path, request.query_string)
       log.ip_address = request.remote_addr
-    log.put()
+
+    if batchable and access_log_queue.IsUnderLoad():
+      future = access_log_queue.EnqueueAsync(log)
+    else:
+      future = log.put_async()
+      access_log_queue.TrackPut(future)
+    GetRequestContext().AddPendingWrite(future)
+    return future
+
+
+class AccessLogDailySummary(ndb.Model):
+  """Counts of the AccessLog entities of one log type and day.
+
+  Written by cron/access_log_rollup before the counted logs are deleted, and
+  read for statistics over long time ranges. The id is
+  '<log_type>/<YYYY-MM-DD>'; use KeyFor().
+  """
+  _use_memcache = False
+
+  log_type = ndb.StringProperty()
+  date = ndb.DateProperty()
+  total = ndb.IntegerProperty(default=0, indexed=False)
+  # Dicts of name to count. Actions are the first word of the log message,
+  # e.g. GET or PUT.
+  by_user = ndb.JsonProperty(compressed=True)
+  by_action = ndb.JsonProperty(compressed=True)
+  by_outcome = ndb.JsonProperty(compressed=True)
+  by_target = ndb.JsonProperty(compressed=True)
+  # Urlsafe cursor of the next log to count, while logs are being counted.
+  cursor = ndb.StringProperty(indexed=False)
+  # True once all logs of the day are counted.
+  complete = ndb.BooleanProperty(default=False, indexed=False)
+
+  @classmethod
+  def KeyFor(cls, log_type, date):
+    return ndb.Key(cls, '%s/%s' % (log_type, date.isoformat()))
+
+  def Count(self, log):
+    """Adds log to the counts."""
+    self.total += 1
+    for prop, name in (
+        ('by_user', log.user.email() if log.user else 'unknown'),
+        ('by_action', (log.message or '').split(' ', 1)[0] or 'unknown'),
+        ('by_outcome', 'successful' if log.successful else 'failed'),
+        ('by_target', log.target_id or 'unknown')):
+      counts = getattr(self, prop) or {}
+      counts[name] = counts.get(name, 0) + 1
+      setattr(self, prop, counts)
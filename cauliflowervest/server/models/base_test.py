@@ -20,10 +20,14 @@ import os
 
 from absl.testing import absltest
 import mock
+import webapp2
 
-from google.appengine.ext import db
+from google.appengine.api import datastore
+from google.appengine.ext import ndb
 
 from cauliflowervest import settings as base_settings
+from cauliflowervest.server import permission_cache
+from cauliflowervest.server import permissions
 from cauliflowervest.server.handlers import test_util
 from cauliflowervest.server.models import base
 from cauliflowervest.server.models import errors
@@ -32,7 +36,7 @@ from cauliflowervest.server.models import errors
 class GetCurrentUserTest(test_util.BaseTest):
 
   def testAutoUpdatingUserProperty(self):
-    class FooModel(db.Model):
+    class FooModel(ndb.Model):
       user = base.AutoUpdatingUserProperty()
 
     appengine_user = base.users.get_current_user()
@@ -69,6 +73,23 @@ class GetCurrentUserTest(test_util.BaseTest):
     self.assertNotEqual(0, len(user.filevault_perms))
     self.assertNotEqual(0, len(user.luks_perms))
 
+  def testGetCurrentUserFromContextCache(self):
+    base.User(id='stub7@example.com', user=base.users.get_current_user()).put()
+
+    self.assertIs(base.GetCurrentUser(), base.GetCurrentUser())
+
+  def testGetCurrentUserFromMemcache(self):
+    key = base.User(
+        id='stub7@example.com', user=base.users.get_current_user(),
+        luks_perms=['retrieve']).put()
+    base.GetCurrentUser()
+
+    # Delete bypassing ndb, then start a new request.
+    datastore.Delete(key.to_old_key())
+    ndb.get_context().clear_cache()
+
+    self.assertEqual(['retrieve'], base.GetCurrentUser().luks_perms)
+
   def testWithInvalidOauthId(self):
     self.testbed.setup_env(
         user_email='', oauth_email='zaspire@example.com',
@@ -77,6 +98,90 @@ class GetCurrentUserTest(test_util.BaseTest):
 
 
 
+class RequestContextTest(test_util.BaseTest):
+
+  def setUp(self):
+    super(RequestContextTest, self).setUp()
+    base.User(
+        id='stub7@example.com', user=base.users.get_current_user(),
+        luks_perms=[permissions.RETRIEVE]).put()
+
+    app = webapp2.WSGIApplication()
+    app.set_globals(app=app, request=webapp2.Request.blank('/'))
+    self.addCleanup(app.clear_globals)
+
+  def testMemoizedPerRequest(self):
+    with mock.patch.object(
+        base, '_GetApiUser', wraps=base._GetApiUser) as get_api_user:
+      user = base.GetCurrentUser()
+      self.assertIs(user, base.GetCurrentUser())
+      self.assertIs(base.GetRequestContext(), base.GetRequestContext())
+
+    self.assertEqual(1, get_api_user.call_count)
+
+  def testAuthErrorMemoized(self):
+    self.Logout()
+    with mock.patch.object(
+        base, '_GetApiUser', wraps=base._GetApiUser) as get_api_user:
+      self.assertRaises(errors.AccessDeniedError, base.GetCurrentUser)
+      self.assertRaises(errors.AccessDeniedError, base.GetCurrentUser)
+
+    self.assertEqual(1, get_api_user.call_count)
+
+  def testPermissions(self):
+    context = base.GetRequestContext()
+
+    self.assertTrue(
+        context.HasPerm(permissions.RETRIEVE, permissions.TYPE_LUKS))
+    self.assertFalse(
+        context.HasPerm(permissions.RETRIEVE, permissions.TYPE_FILEVAULT))
+    self.assertRaises(ValueError, context.HasPerm, permissions.RETRIEVE, 'foo')
+    perms = context.PermissionTypesWith(permissions.RETRIEVE)
+    self.assertEqual(set(permissions.TYPES), set(perms))
+    self.assertTrue(perms[permissions.TYPE_LUKS])
+    self.assertFalse(perms[permissions.TYPE_FILEVAULT])
+
+  def testWaitForPendingWrites(self):
+    context = base.GetRequestContext()
+    failed = ndb.Future()
+    failed.set_exception(ValueError('write failed'))
+    done = ndb.Future()
+    done.set_result(None)
+    context.AddPendingWrite(failed)
+    context.AddPendingWrite(done)
+
+    self.assertRaises(ValueError, context.WaitForPendingWrites)
+    context.WaitForPendingWrites()
+
+  def testPermissionsCachedAcrossRequests(self):
+    base.RequestContext().HasPerm(permissions.RETRIEVE, permissions.TYPE_LUKS)
+
+    with mock.patch.object(base, '_GetOrCreateUser') as get_or_create_user:
+      self.assertTrue(base.RequestContext().HasPerm(
+          permissions.RETRIEVE, permissions.TYPE_LUKS))
+
+    self.assertFalse(get_or_create_user.called)
+
+  def testPermissionsCacheMissReadsUserOnce(self):
+    with mock.patch.object(
+        base.User, 'get_by_id', wraps=base.User.get_by_id) as get_by_id:
+      self.assertTrue(base.RequestContext().HasPerm(
+          permissions.RETRIEVE, permissions.TYPE_LUKS))
+
+    self.assertEqual(1, get_by_id.call_count)
+
+  def testPermissionsInvalidatedByBumpGeneration(self):
+    base.RequestContext().HasPerm(permissions.RETRIEVE, permissions.TYPE_LUKS)
+
+    user = base.User.get_by_id('stub7@example.com')
+    user.SetPerms([], permissions.TYPE_LUKS)
+    user.put()
+    permission_cache.BumpGeneration()
+
+    self.assertFalse(base.RequestContext().HasPerm(
+        permissions.RETRIEVE, permissions.TYPE_LUKS))
+
+
 class NormalizeHostnameTest(test_util.BaseTest):
   """Tests the NormalizeHostname classmethod for all escrow types."""
 
@@ -92,15 +197,14 @@ class AccessLogTest(test_util.BaseTest):
   """Tests AccessLog class."""
 
   @mock.patch.object(base, 'GetCurrentUser')
-  @mock.patch.object(base.memcache, 'incr')
-  def testPut(self, incr, get_current_user):
-    incr.return_value = 1
+  def testPut(self, get_current_user):
     get_current_user.side_effect = errors.AccessDeniedError('no user')
 
     log = base.AccessLog()
     log.put()
 
-    incr.assert_called_once_with('AccessLogCounter', initial_value=0)
+    self.assertIsNotNone(log.mtime)
+    self.assertIsNone(log.paginate_mtime)
 
 
 class OwnerPropertyTest(test_util.BaseTest):
@@ -14,7 +14,7 @@
 
 """Models related to Firmware Encryption."""
 
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
 from cauliflowervest.server import encrypted_property
 from cauliflowervest.server.models import base
@@ -30,13 +30,10 @@ class _BaseFirmwarePassword(base.BasePassphrase):
   """Base class for Firmware models."""
   ACCESS_ERR_CLS = errors.AccessError
   ALLOW_OWNER_CHANGE = True
+  SUBSTRING_SEARCH_FIELDS = ['asset_tags', 'hostname', 'serial']
+  _DICT_FORMATTERS = {'asset_tags': ', '.join}
 
-  asset_tags = db.StringListProperty()
-
-  def ToDict(self, skip_secret=False):
-    o = super(_BaseFirmwarePassword, self).ToDict(skip_secret)
-    o['asset_tags'] = ', '.join(self.asset_tags)
-    return o
+  asset_tags = ndb.StringProperty(repeated=True)
 
 
 class AppleFirmwarePasswordAccessLog(base.AccessLog):
@@ -63,8 +60,8 @@ class AppleFirmwarePassword(_BaseFirmwarePassword):
   password = encrypted_property.EncryptedBlobProperty(
       _APPLE_FIRMWARE_PASSWORD_ENCRYPTION_KEY_NAME)
 
-  serial = db.StringProperty()
-  platform_uuid = db.StringProperty()  # sp_platform_uuid in facter.
+  serial = ndb.StringProperty()
+  platform_uuid = ndb.StringProperty()  # sp_platform_uuid in facter.
 
 
 class LinuxFirmwarePasswordAccessLog(base.AccessLog):
@@ -74,7 +71,7 @@ class LinuxFirmwarePasswordAccessLog(base.AccessLog):
 class LinuxFirmwarePassword(_BaseFirmwarePassword):
   """Model for storing Linux Firmware passwords, with various metadata."""
   AUDIT_LOG_MODEL = LinuxFirmwarePasswordAccessLog
-  TARGET_PROPERTY_NAME = '_manufacturer_serial_machine_uuid'
+  TARGET_PROPERTY_NAME = 'manufacturer_serial_machine_uuid'
   ESCROW_TYPE_NAME = 'linux_firmware'
   SECRET_PROPERTY_NAME = 'password'
 
@@ -92,11 +89,14 @@ class LinuxFirmwarePassword(_BaseFirmwarePassword):
   password = encrypted_property.EncryptedBlobProperty(
       _LINUX_FIRMWARE_PASSWORD_ENCRYPTION_KEY_NAME)
 
-  manufacturer = db.StringProperty()  # /sys/class/dmi/id/sys_vendor.
-  serial = db.StringProperty()  # /sys/class/dmi/id/product_serial.
-  machine_uuid = db.StringProperty()  # /sys/class/dmi/id/product_uuid.
-  _manufacturer_serial_machine_uuid = db.ComputedProperty(
-      lambda self: self.manufacturer + self.serial + self.machine_uuid)
+  manufacturer = ndb.StringProperty()  # /sys/class/dmi/id/sys_vendor.
+  serial = ndb.StringProperty()  # /sys/class/dmi/id/product_serial.
+  machine_uuid = ndb.StringProperty()  # /sys/class/dmi/id/product_uuid.
+  # Stored under the name it had before the model was ported to ndb, which
+  # does not allow attribute names with a leading underscore.
+  manufacturer_serial_machine_uuid = ndb.ComputedProperty(
+      lambda self: self.manufacturer + self.serial + self.machine_uuid,
+      name='_manufacturer_serial_machine_uuid')
 
 
 class WindowsFirmwarePasswordAccessLog(base.AccessLog):
@@ -124,6 +124,6 @@ class WindowsFirmwarePassword(_BaseFirmwarePassword):
       _WINDOWS_FIRMWARE_PASSWORD_ENCRYPTION_KEY_NAME)
 
   # serial from WMI query: 'Select SerialNumber from Win32_BIOS'
-  serial = db.StringProperty()
+  serial = ndb.StringProperty()
   # smbios_guid from WMI query: 'Select UUID from Win32_ComputerSystemProduct'
-  smbios_guid = db.StringProperty()
+  smbios_guid = ndb.StringProperty()
@@ -0,0 +1,57 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of latest version lookup by query and by PassphraseHead."""
+
+import random
+import timeit
+
+
+
+from absl.testing import absltest
+
+from google.appengine.ext import ndb
+
+from cauliflowervest.server.handlers import test_util
+from cauliflowervest.server.models import volumes
+
+
+_SIZES = (100, 1000, 5000)
+_LOOKUPS = 100
+
+
+class GetLatestForTargetBenchmark(test_util.BaseTest):
+
+  def testQueryVsGet(self):
+    # Measure Datastore lookups, not the ndb caches.
+    ndb.get_context().set_cache_policy(False)
+    ndb.get_context().set_memcache_policy(False)
+    model = volumes.FileVaultVolume
+    target_ids = []
+    for size in _SIZES:
+      while len(target_ids) < size:
+        target_ids.append(test_util.MakeFileVaultVolume().volume_uuid)
+      sample = random.sample(target_ids, _LOOKUPS)
+
+      query = timeit.timeit(
+          lambda: [model.QueryLatestForTarget(t) for t in sample], number=1)
+      get = timeit.timeit(
+          lambda: [model.GetLatestForTarget(t) for t in sample], number=1)
+
+      print '%d entities: query %.2f ms, get by key %.2f ms per lookup' % (
+          size, query / _LOOKUPS * 1e3, get / _LOOKUPS * 1e3)
+
+
+if __name__ == '__main__':
+  absltest.main()
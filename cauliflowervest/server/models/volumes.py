@@ -15,7 +15,7 @@
 """Models related to Volume Encryption."""
 import datetime
 
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
 from cauliflowervest import settings as base_settings
 from cauliflowervest.server import encrypted_property
@@ -69,7 +69,7 @@ class _BaseVolume(base.BasePassphrase,
   TARGET_PROPERTY_NAME = 'volume_uuid'
   ESCROW_TYPE_NAME = 'base_volume'
 
-  volume_uuid = db.StringProperty()  # Volume UUID of the encrypted volume.
+  volume_uuid = ndb.StringProperty()  # Volume UUID of the encrypted volume.
 
 
 class FileVaultVolume(_BaseVolume):
@@ -89,6 +89,7 @@ class FileVaultVolume(_BaseVolume):
       ('platform_uuid', 'Platform UUID'),
       ('volume_uuid', 'Volume UUID'),
   ]
+  SUBSTRING_SEARCH_FIELDS = ['hdd_serial', 'hostname', 'serial']
   SECRET_PROPERTY_NAME = 'passphrase'
   ALLOW_OWNER_CHANGE = True
 
@@ -97,9 +98,9 @@ class FileVaultVolume(_BaseVolume):
   #   via machine/certificate-based auth.
   passphrase = encrypted_property.EncryptedBlobProperty(
       _FILEVAULT_PASSPHRASE_ENCRYPTION_KEY_NAME)
-  platform_uuid = db.StringProperty()  # sp_platform_uuid in facter.
-  serial = db.StringProperty()  # serial number of the machine.
-  hdd_serial = db.StringProperty()  # hard drive disk serial number.
+  platform_uuid = ndb.StringProperty()  # sp_platform_uuid in facter.
+  serial = ndb.StringProperty()  # serial number of the machine.
+  hdd_serial = ndb.StringProperty()  # hard drive disk serial number.
 
   @classmethod
   def NormalizeHostname(cls, hostname):
@@ -123,14 +124,16 @@ class BitLockerVolume(_BaseVolume):
       ('volume_uuid', 'Volume UUID'),
   ]
   SECRET_PROPERTY_NAME = 'recovery_key'
+  # 'created' is the time of the AD sync.
+  _DICT_EXCLUDED_PROPERTIES = frozenset(['created'])
 
   recovery_key = encrypted_property.EncryptedBlobProperty(
       _BITLOCKER_PASSPHRASE_ENCRYPTION_KEY_NAME)
-  dn = db.StringProperty()
-  parent_guid = db.StringProperty()
-  recovery_guid = db.StringProperty()
+  dn = ndb.StringProperty()
+  parent_guid = ndb.StringProperty()
+  recovery_guid = ndb.StringProperty()
   # Real creation time. 'created' property contains time of AD sync.
-  when_created = db.DateTimeProperty()
+  when_created = ndb.DateTimeProperty()
 
   @classmethod
   def NormalizeHostname(cls, hostname):
@@ -138,13 +141,6 @@ class BitLockerVolume(_BaseVolume):
     return super(BitLockerVolume, cls).NormalizeHostname(
         hostname, strip_fqdn=True).upper()
 
-  def ToDict(self, skip_secret=False):
-    d = super(BitLockerVolume, self).ToDict(skip_secret)
-    # remove AD sync time.
-    del d['created']
-    return d
-
-
 
 class LuksVolume(_BaseVolume):
   """Model for storing Luks passphrases."""
@@ -167,12 +163,13 @@ class LuksVolume(_BaseVolume):
       ('platform_uuid', 'MrMagoo Host UUID'),
       ('hdd_serial', 'Hard Drive Serial Number'),
   ]
+  SUBSTRING_SEARCH_FIELDS = ['hdd_serial', 'hostname']
   SECRET_PROPERTY_NAME = 'passphrase'
 
   passphrase = encrypted_property.EncryptedBlobProperty(
       _LUKS_PASSPHRASE_ENCRYPTION_KEY_NAME)
-  hdd_serial = db.StringProperty()
-  platform_uuid = db.StringProperty()
+  hdd_serial = ndb.StringProperty()
+  platform_uuid = ndb.StringProperty()
 
 
 class ProvisioningVolume(_BaseVolume):
@@ -192,6 +189,7 @@ class ProvisioningVolume(_BaseVolume):
       ('platform_uuid', 'Platform UUID'),
       ('volume_uuid', 'Volume UUID'),
   ]
+  SUBSTRING_SEARCH_FIELDS = ['hdd_serial', 'hostname', 'serial']
   SECRET_PROPERTY_NAME = 'passphrase'
 
   # NOTE(ogle): For self-service encryption, owner/created_by may the same.
@@ -199,9 +197,9 @@ class ProvisioningVolume(_BaseVolume):
   #   via machine/certificate-based auth.
   passphrase = encrypted_property.EncryptedBlobProperty(
       _PROVISIONING_PASSPHRASE_ENCRYPTION_KEY_NAME)
-  platform_uuid = db.StringProperty()  # sp_platform_uuid in facter.
-  serial = db.StringProperty()  # serial number of the machine.
-  hdd_serial = db.StringProperty()  # hard drive disk serial number.
+  platform_uuid = ndb.StringProperty()  # sp_platform_uuid in facter.
+  serial = ndb.StringProperty()  # serial number of the machine.
+  hdd_serial = ndb.StringProperty()  # hard drive disk serial number.
 
   @classmethod
   def NormalizeHostname(cls, hostname):
@@ -20,11 +20,16 @@ import hashlib
 
 
 from absl.testing import absltest
+import mock
+
 from google.appengine.api import users
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
+from cauliflowervest.server import crypto
 from cauliflowervest.server import settings
 from cauliflowervest.server.handlers import test_util
+from cauliflowervest.server.models import base
+from cauliflowervest.server.models import errors
 from cauliflowervest.server.models import volumes as models
 
 
@@ -75,17 +80,18 @@ class FileVaultVolumeTest(test_util.BaseTest):
   def testPutWithExistingDataModified(self):
     self.fvv.put()
     num_of_modifications = 1
-    for name, prop in self.fvv.properties().iteritems():
+    for name in self.fvv.PropertyNames():
+      prop = getattr(models.FileVaultVolume, name)
       old_value = getattr(self.fvv, name)
-      if name == 'active':
+      if name in ('active', 'fingerprint', 'secret_fingerprint'):
         continue
-      if isinstance(prop, db.DateTimeProperty):
+      if isinstance(prop, ndb.DateTimeProperty):
         continue
-      elif isinstance(prop, db.BooleanProperty):
+      elif isinstance(prop, ndb.BooleanProperty):
         new_value = not bool(old_value)
-      elif isinstance(prop, db.UserProperty):
+      elif isinstance(prop, ndb.UserProperty):
         new_value = users.User('junk@example.com')
-      elif isinstance(prop, db.StringListProperty):
+      elif prop._repeated:  # pylint: disable=protected-access
         #  owners does not have setter yet.
         continue
       else:
@@ -97,9 +103,72 @@ class FileVaultVolumeTest(test_util.BaseTest):
       fvv.put()
       num_of_modifications += 1
 
-      volumes = models.FileVaultVolume.all().fetch(999)
+      volumes = models.FileVaultVolume.query().fetch(999)
       self.assertEqual(num_of_modifications, len(volumes))
 
+  def testPutDuplicateDoesNotDecrypt(self):
+    self.fvv.put()
+    crypto.Decrypt.reset_mock()
+
+    fvv = models.FileVaultVolume(**self.fvv_data)
+    self.assertRaises(errors.DuplicateEntity, fvv.put)
+    self.assertEqual(0, crypto.Decrypt.call_count)
+
+  def testPutDuplicateOfEntityWithoutFingerprint(self):
+    self.fvv.put()
+    self.fvv.secret_fingerprint = None
+    ndb.Model.put(self.fvv)
+
+    fvv = models.FileVaultVolume(**self.fvv_data)
+    self.assertRaises(errors.DuplicateEntity, fvv.put)
+
+  def testFingerprintFollowsMutableProperties(self):
+    self.fvv.put()
+    self.fvv.UpdateMutableProperty('force_rekeying', True)
+
+    fvv = models.FileVaultVolume(**self.fvv_data)
+    fvv.put()
+
+    self.assertEqual(2, len(models.FileVaultVolume.query().fetch(999)))
+
+  def testGetLatestForTargetUsesHead(self):
+    self.fvv.put()
+    fvv = models.FileVaultVolume(**self.fvv_data)
+    fvv.owners = ['new_owner']
+    fvv.put()
+
+    with mock.patch.object(
+        models.FileVaultVolume, 'QueryLatestForTarget') as query:
+      latest = models.FileVaultVolume.GetLatestForTarget(
+          self.fvv_data['volume_uuid'])
+
+    self.assertEqual(fvv.key, latest.key)
+    self.assertFalse(query.called)
+
+  def testGetLatestForTargetWithoutHead(self):
+    self.fvv.put()
+    base.PassphraseHead.query().get(keys_only=True).delete()
+
+    latest = models.FileVaultVolume.GetLatestForTarget(
+        self.fvv_data['volume_uuid'])
+
+    self.assertEqual(self.fvv.key, latest.key)
+
+  def testHeadCountsVersions(self):
+    self.fvv.put()
+    new = self.fvv.Clone()
+    new.hdd_serial = 'XX654321'
+    new.put()
+    old = models.FileVaultVolume(**self.fvv_data)
+    old.hdd_serial = 'XX000000'
+    old.created = datetime.datetime(2000, 1, 1)
+    old.put()
+
+    head = base.PassphraseHead.Get(
+        models.FileVaultVolume, self.fvv_data['volume_uuid'], 'default')
+    self.assertEqual(3, head.versions)
+    self.assertEqual(new.key, head.latest)
+
   def testPutWithExistingOwnerModified(self):
     self.fvv.put()
     fvv = models.FileVaultVolume(**self.fvv_data)
@@ -117,7 +186,7 @@ class FileVaultVolumeTest(test_util.BaseTest):
     clone_volume1 = self.fvv.Clone()
     clone_volume1.owners = ['changed so we will have one different property']
     clone_volume1.put()
-    self.fvv = db.get(self.fvv.key())
+    self.fvv = self.fvv.key.get()
     self.assertTrue(clone_volume1.active)
     self.assertFalse(self.fvv.active)
 
@@ -125,13 +194,13 @@ class FileVaultVolumeTest(test_util.BaseTest):
     clone_volume2 = clone_volume1.Clone()
     clone_volume2.owners = ['one different property2']
     clone_volume2.put(parent=clone_volume1)
-    clone_volume1 = db.get(clone_volume1.key())
+    clone_volume1 = clone_volume1.key.get()
     self.assertTrue(clone_volume2.active)
     self.assertFalse(clone_volume1.active)
 
   def testPutWithEmptyRequiredProperty(self):
     key_name = u'foo'
-    fvv = models.FileVaultVolume(key_name=key_name)
+    fvv = models.FileVaultVolume(id=key_name)
 
     self.assertRaises(models.FileVaultAccessError, fvv.put)
 
@@ -147,16 +216,81 @@ class FileVaultVolumeTest(test_util.BaseTest):
     self.fvv.hostname = hostname
     self.fvv.put()
 
-    v = models.FileVaultVolume.all().fetch(1)[0]
+    v = models.FileVaultVolume.query().fetch(1)[0]
     self.assertEqual(hostname, v.ToDict()['hostname'])
 
   def testToDictMultiOwners(self):
     self.fvv.owners = ['zerocool']
     self.fvv.put()
 
-    v = models.FileVaultVolume.all().fetch(1)[0]
+    v = models.FileVaultVolume.query().fetch(1)[0]
     self.assertEqual(['zerocool@example.com'], v.ToDict()['owners'])
 
+  def testSearchTokens(self):
+    self.fvv.hostname = 'Host1'
+    self.fvv.hdd_serial = 'ab'
+    self.fvv.put()
+
+    self.assertEqual(
+        ['hostname:hos', 'hostname:ost', 'hostname:st1',
+         'serial:123', 'serial:234', 'serial:345', 'serial:456',
+         'serial:x12', 'serial:xx1'],
+        self.fvv.search_tokens)
+
+  def testSearchTokensFollowMutableProperties(self):
+    key = self.fvv.put()
+
+    self.fvv.UpdateMutableProperty('hostname', 'newhost')
+
+    query = models.FileVaultVolume.query(
+        models.FileVaultVolume.search_tokens == 'hostname:who')
+    self.assertEqual([key], query.fetch(keys_only=True))
+
+  def testSummaryFollowsPuts(self):
+    self.fvv.hostname = 'host1'
+    key = self.fvv.put()
+
+    summary = base.PassphraseSummary.KeyFor(key).get()
+    self.assertEqual('host1', summary.data['hostname'])
+    self.assertNotIn('passphrase', summary.data)
+    self.assertNotIn('id', summary.data)
+
+    self.fvv.UpdateMutableProperty('hostname', 'host2')
+
+    summary = base.PassphraseSummary.KeyFor(key).get()
+    self.assertEqual('host2', summary.data['hostname'])
+
+  def testSummaryFollowsNewVersions(self):
+    old_key = self.fvv.put()
+    new = self.fvv.Clone()
+    new.hdd_serial = 'XX654321'
+    new_key = new.put()
+
+    self.assertFalse(base.PassphraseSummary.KeyFor(old_key).get().data[
+        'active'])
+    summary = base.PassphraseSummary.KeyFor(new_key).get()
+    self.assertTrue(summary.data['active'])
+    self.assertEqual('XX654321', summary.data['hdd_serial'])
+
+  def testSummaryOfEntityFromPast(self):
+    self.fvv.put()
+    old = models.FileVaultVolume(**self.fvv_data)
+    old.hdd_serial = 'XX654321'
+    old.created = datetime.datetime(2000, 1, 1)
+
+    key = old.put()
+
+    summary = base.PassphraseSummary.KeyFor(key).get()
+    self.assertFalse(summary.data['active'])
+    self.assertEqual('XX654321', summary.data['hdd_serial'])
+
+  def testSummaryDeletedWithPassphrase(self):
+    key = self.fvv.put()
+
+    key.delete()
+
+    self.assertIsNone(base.PassphraseSummary.KeyFor(key).get())
+
 
 class NormalizeHostnameTest(absltest.TestCase):
   """Tests the NormalizeHostname classmethod for all escrow types."""
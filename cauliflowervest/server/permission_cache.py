@@ -0,0 +1,156 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cross-request cache of compiled user permissions.
+
+Snapshots are cached in memcache and in the instance, keyed by a generation
+number. BumpGeneration() is called whenever User entities change, which
+drops all cached snapshots at once.
+"""
+
+import hashlib
+import threading
+import time
+
+from google.appengine.api import memcache
+
+from cauliflowervest.server import permissions
+from cauliflowervest.server import settings
+
+
+_NAMESPACE = 'permission_cache'
+_GENERATION_KEY = 'generation'
+
+_BITS = {perm: 1 << i for i, perm in enumerate(permissions.ALL)}
+
+# Snapshots compiled with other DEFAULT_PERMISSIONS, e.g. by another version
+# of the app, are not used.
+_SETTINGS_DIGEST = hashlib.sha1(repr((
+    permissions.ALL, sorted(settings.DEFAULT_PERMISSIONS.items()),
+))).hexdigest()[:8]
+
+_lock = threading.Lock()
+_instance_generation = None
+_instance_snapshots = {}
+
+
+class Snapshot(object):
+  """Permissions of a user, as a bitmask per permission type."""
+
+  def __init__(self, masks):
+    self.masks = masks
+
+  @classmethod
+  def Compile(cls, perms):
+    """Returns a Snapshot of perms.
+
+    Args:
+      perms: dict of permission type to iterable of permissions, like
+          base.User.GetPermissions() returns.
+    Returns:
+      Snapshot.
+    """
+    masks = {}
+    for permission_type, type_perms in perms.iteritems():
+      mask = 0
+      for perm in type_perms:
+        mask |= _BITS.get(perm, 0)
+      masks[permission_type] = mask
+    return cls(masks)
+
+  def HasPerm(self, perm, permission_type):
+    """Like base.User.HasPerm.
+
+    Raises:
+      ValueError: the requested permission_type was invalid or unknown.
+    """
+    mask = self.masks.get(permission_type)
+    if mask is None:
+      raise ValueError('unknown permission_type: %s' % permission_type)
+    return bool(mask & _BITS.get(perm, 0))
+
+  def PermissionTypesWith(self, perm):
+    """Returns dict of permission type to True if the user has perm."""
+    bit = _BITS.get(perm, 0)
+    return {t: bool(mask & bit) for t, mask in self.masks.iteritems()}
+
+
+def _MemcacheKey(generation, email):
+  return '%s:%s:%s' % (_SETTINGS_DIGEST, generation, email)
+
+
+def _InitialGeneration():
+  # Never reuses a generation if the counter is evicted from memcache.
+  return int(time.time() * 1000)
+
+
+def GetGeneration():
+  """Returns the current generation, or None if memcache is unavailable."""
+  generation = memcache.get(_GENERATION_KEY, namespace=_NAMESPACE)
+  if generation is None:
+    memcache.add(
+        _GENERATION_KEY, _InitialGeneration(), namespace=_NAMESPACE)
+    generation = memcache.get(_GENERATION_KEY, namespace=_NAMESPACE)
+  return generation
+
+
+def BumpGeneration():
+  """Invalidates all cached snapshots."""
+  memcache.incr(
+      _GENERATION_KEY, initial_value=_InitialGeneration(),
+      namespace=_NAMESPACE)
+
+
+def Get(generation, email):
+  """Returns the cached Snapshot of email, or None."""
+  global _instance_generation
+  if generation is None:
+    return None
+
+  with _lock:
+    if _instance_generation != generation:
+      _instance_snapshots.clear()
+      _instance_generation = generation
+    snapshot = _instance_snapshots.get(email)
+  if snapshot is not None:
+    return snapshot
+
+  masks = memcache.get(_MemcacheKey(generation, email), namespace=_NAMESPACE)
+  if masks is None:
+    return None
+  snapshot = Snapshot(masks)
+  with _lock:
+    if _instance_generation == generation:
+      _instance_snapshots[email] = snapshot
+  return snapshot
+
+
+def Put(generation, email, snapshot):
+  """Caches snapshot of email, compiled in generation."""
+  if generation is None:
+    return
+
+  memcache.set(
+      _MemcacheKey(generation, email), snapshot.masks, namespace=_NAMESPACE)
+  with _lock:
+    if _instance_generation == generation:
+      _instance_snapshots[email] = snapshot
+
+
+def ClearInstanceCache():
+  """Drops snapshots cached in the instance."""
+  global _instance_generation
+  with _lock:
+    _instance_snapshots.clear()
+    _instance_generation = None
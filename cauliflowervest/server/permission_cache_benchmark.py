@@ -0,0 +1,102 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmark of permission check latency with and without the cache."""
+
+import httplib
+import timeit
+import uuid
+
+
+
+from absl.testing import absltest
+import mock
+import webtest
+
+from google.appengine.api import users
+
+from cauliflowervest.server import main as gae_main
+from cauliflowervest.server import permission_cache
+from cauliflowervest.server import permissions
+from cauliflowervest.server import settings
+from cauliflowervest.server.handlers import test_util
+from cauliflowervest.server.models import base
+from cauliflowervest.server.models import volumes
+
+
+_ITERATIONS = 250
+_REQUESTS = 100
+
+
+class PermissionCheckBenchmark(test_util.BaseTest):
+
+  def setUp(self):
+    super(PermissionCheckBenchmark, self).setUp()
+    user = base.User(id='stub7@example.com')
+    user.user = users.User('stub7@example.com')
+    user.SetPerms([permissions.RETRIEVE], permissions.TYPE_BITLOCKER)
+    user.SetPerms([permissions.RETRIEVE_OWN], permissions.TYPE_LUKS)
+    user.put()
+
+  def _Check(self):
+    # A new RequestContext for every call, like a new request.
+    base.RequestContext().HasPerm(
+        permissions.RETRIEVE, permission_type=permissions.TYPE_BITLOCKER)
+
+  def _CheckUncached(self):
+    permission_cache.BumpGeneration()
+    self._Check()
+
+  def testCheckLatency(self):
+    uncached = timeit.timeit(self._CheckUncached, number=_ITERATIONS)
+    cached = timeit.timeit(self._Check, number=_ITERATIONS)
+
+    print 'Permission check per request: %.1f us uncached, %.1f us cached' % (
+        uncached / _ITERATIONS * 1e6, cached / _ITERATIONS * 1e6)
+
+
+class RetrievalPermissionBenchmark(PermissionCheckBenchmark):
+  """Permission checks of the whole retrieval handler path."""
+
+  def setUp(self):
+    super(RetrievalPermissionBenchmark, self).setUp()
+    self.testapp = webtest.TestApp(gae_main.app)
+    self.volume_uuid = str(uuid.uuid4()).upper()
+    volumes.LuksVolume(
+        owners=['stub7'], hdd_serial='stub', hostname='stub',
+        passphrase=str(uuid.uuid4()), platform_uuid='stub',
+        volume_uuid=self.volume_uuid).put()
+
+  def _Check(self):
+    self.testapp.get(
+        '/luks/%s?json=1' % self.volume_uuid, status=httplib.OK)
+
+  @mock.patch.dict(settings.__dict__, {'XSRF_PROTECTION_ENABLED': False})
+  def testCheckLatency(self):
+    with mock.patch.object(
+        base.User, 'get_by_id', wraps=base.User.get_by_id) as get_by_id:
+      uncached = timeit.timeit(self._CheckUncached, number=_REQUESTS)
+      uncached_reads = get_by_id.call_count
+      get_by_id.reset_mock()
+      cached = timeit.timeit(self._Check, number=_REQUESTS)
+      cached_reads = get_by_id.call_count
+
+    print ('Retrieval per request: %.1f us and %.2f User reads uncached, '
+           '%.1f us and %.2f User reads cached' % (
+               uncached / _REQUESTS * 1e6, float(uncached_reads) / _REQUESTS,
+               cached / _REQUESTS * 1e6, float(cached_reads) / _REQUESTS))
+
+
+if __name__ == '__main__':
+  absltest.main()
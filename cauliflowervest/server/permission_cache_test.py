@@ -0,0 +1,95 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""permission_cache module tests."""
+
+
+
+from absl.testing import absltest
+
+from cauliflowervest.server import permission_cache
+from cauliflowervest.server import permissions
+from cauliflowervest.server.handlers import test_util
+
+
+class SnapshotTest(absltest.TestCase):
+
+  def setUp(self):
+    super(SnapshotTest, self).setUp()
+    self.snapshot = permission_cache.Snapshot.Compile({
+        permissions.TYPE_BITLOCKER: frozenset([permissions.RETRIEVE]),
+        permissions.TYPE_FILEVAULT: frozenset(),
+    })
+
+  def testHasPerm(self):
+    self.assertTrue(self.snapshot.HasPerm(
+        permissions.RETRIEVE, permissions.TYPE_BITLOCKER))
+    self.assertFalse(self.snapshot.HasPerm(
+        permissions.ESCROW, permissions.TYPE_BITLOCKER))
+    self.assertFalse(self.snapshot.HasPerm(
+        permissions.RETRIEVE, permissions.TYPE_FILEVAULT))
+
+  def testHasPermUnknownType(self):
+    with self.assertRaises(ValueError):
+      self.snapshot.HasPerm(permissions.RETRIEVE, 'unknown')
+
+  def testPermissionTypesWith(self):
+    self.assertEqual(
+        {permissions.TYPE_BITLOCKER: True, permissions.TYPE_FILEVAULT: False},
+        self.snapshot.PermissionTypesWith(permissions.RETRIEVE))
+
+
+class PermissionCacheTest(test_util.BaseTest):
+
+  def setUp(self):
+    super(PermissionCacheTest, self).setUp()
+    self.snapshot = permission_cache.Snapshot.Compile(
+        {permissions.TYPE_BITLOCKER: frozenset([permissions.RETRIEVE])})
+
+  def testPutGet(self):
+    generation = permission_cache.GetGeneration()
+    self.assertIsNone(permission_cache.Get(generation, 'a@example.com'))
+
+    permission_cache.Put(generation, 'a@example.com', self.snapshot)
+
+    self.assertIs(
+        self.snapshot, permission_cache.Get(generation, 'a@example.com'))
+    self.assertIsNone(permission_cache.Get(generation, 'b@example.com'))
+
+  def testGetFromMemcache(self):
+    generation = permission_cache.GetGeneration()
+    permission_cache.Put(generation, 'a@example.com', self.snapshot)
+    permission_cache.ClearInstanceCache()
+
+    snapshot = permission_cache.Get(generation, 'a@example.com')
+
+    self.assertEqual(self.snapshot.masks, snapshot.masks)
+
+  def testBumpGeneration(self):
+    generation = permission_cache.GetGeneration()
+    permission_cache.Put(generation, 'a@example.com', self.snapshot)
+
+    permission_cache.BumpGeneration()
+
+    new_generation = permission_cache.GetGeneration()
+    self.assertNotEqual(generation, new_generation)
+    self.assertIsNone(permission_cache.Get(new_generation, 'a@example.com'))
+
+  def testNoGeneration(self):
+    permission_cache.Put(None, 'a@example.com', self.snapshot)
+    self.assertIsNone(permission_cache.Get(None, 'a@example.com'))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -23,6 +23,9 @@ MASTER = 'master'
 SILENT_RETRIEVE_WITH_AUDIT_EMAIL = 'silent_retrieve'
 SILENT_RETRIEVE = 'true_silent_retrieve'
 CHANGE_OWNER = 'change_owner'
+# All permissions, in a stable order.
+ALL = (RETRIEVE, RETRIEVE_OWN, RETRIEVE_CREATED_BY, ESCROW, SEARCH, MASTER,
+       SILENT_RETRIEVE_WITH_AUDIT_EMAIL, SILENT_RETRIEVE, CHANGE_OWNER)
 
 SET_REGULAR = (RETRIEVE, ESCROW, SEARCH, MASTER, CHANGE_OWNER)
 SET_PROVISIONING = (RETRIEVE_CREATED_BY, SEARCH)
@@ -0,0 +1,91 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cross-request cache of secret-free search results.
+
+Pages are cached in memcache, keyed by the search conditions and a write
+generation of the searched model. BumpGeneration() is called whenever
+passphrases of the model change, which drops all cached pages of the model
+at once.
+"""
+
+import hashlib
+import json
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+
+_NAMESPACE = 'search_cache'
+
+# Bounds how long a page may miss writes which its query did not see yet,
+# as indexes of non-ancestor queries are eventually consistent.
+CACHE_SECONDS = 300
+
+
+def _GenerationKey(model):
+  return 'generation:%s' % model.ESCROW_TYPE_NAME
+
+
+def _InitialGeneration():
+  # Never reuses a generation if the counter is evicted from memcache.
+  return int(time.time() * 1000)
+
+
+@ndb.tasklet
+def GetGenerationAsync(model):
+  """Returns ndb.Future of the generation of model, or None if unavailable."""
+  context = ndb.get_context()
+  key = _GenerationKey(model)
+  generation = yield context.memcache_get(key, namespace=_NAMESPACE)
+  if generation is None:
+    yield context.memcache_add(
+        key, _InitialGeneration(), namespace=_NAMESPACE)
+    generation = yield context.memcache_get(key, namespace=_NAMESPACE)
+  raise ndb.Return(generation)
+
+
+def BumpGeneration(model):
+  """Invalidates all cached pages of model."""
+  memcache.incr(
+      _GenerationKey(model), initial_value=_InitialGeneration(),
+      namespace=_NAMESPACE)
+
+
+def _PageKey(model, generation, conditions):
+  # Pages serialized by other versions of the model are not used.
+  version = model.Serializer(skip_secret=True)[1]
+  digest = hashlib.sha1(json.dumps(conditions)).hexdigest()
+  return '%s:%s:%s:%s' % (
+      model.ESCROW_TYPE_NAME, version, generation, digest)
+
+
+def GetAsync(model, generation, conditions):
+  """Returns ndb.Future of the cached page, or None.
+
+  Args:
+    model: base.BasePassphrase model.
+    generation: int, from GetGenerationAsync().
+    conditions: JSON serializable list of all conditions of the search.
+  """
+  return ndb.get_context().memcache_get(
+      _PageKey(model, generation, conditions), namespace=_NAMESPACE)
+
+
+def PutAsync(model, generation, conditions, page):
+  """Caches page, searched in generation; returns ndb.Future."""
+  return ndb.get_context().memcache_set(
+      _PageKey(model, generation, conditions), page, time=CACHE_SECONDS,
+      namespace=_NAMESPACE)
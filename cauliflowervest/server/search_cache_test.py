@@ -0,0 +1,66 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""search_cache module tests."""
+
+
+
+from absl.testing import absltest
+
+from cauliflowervest.server import search_cache
+from cauliflowervest.server.handlers import test_util
+from cauliflowervest.server.models import volumes
+
+
+class SearchCacheTest(test_util.BaseTest):
+
+  def _Generation(self):
+    return search_cache.GetGenerationAsync(volumes.LuksVolume).get_result()
+
+  def testPutGet(self):
+    generation = self._Generation()
+    search_cache.PutAsync(
+        volumes.LuksVolume, generation, ['hostname', 'foo'],
+        ([], None, False)).get_result()
+
+    self.assertEqual(([], None, False), search_cache.GetAsync(
+        volumes.LuksVolume, generation, ['hostname', 'foo']).get_result())
+    self.assertIsNone(search_cache.GetAsync(
+        volumes.LuksVolume, generation, ['hostname', 'bar']).get_result())
+    self.assertIsNone(search_cache.GetAsync(
+        volumes.FileVaultVolume, generation,
+        ['hostname', 'foo']).get_result())
+
+  def testBumpGeneration(self):
+    generation = self._Generation()
+
+    search_cache.BumpGeneration(volumes.LuksVolume)
+
+    self.assertNotEqual(generation, self._Generation())
+
+  def testWritesBumpGeneration(self):
+    generation = self._Generation()
+    filevault_generation = search_cache.GetGenerationAsync(
+        volumes.FileVaultVolume).get_result()
+
+    test_util.MakeFileVaultVolume().key.delete()
+
+    self.assertEqual(generation, self._Generation())
+    self.assertNotEqual(
+        filevault_generation,
+        search_cache.GetGenerationAsync(volumes.FileVaultVolume).get_result())
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -14,17 +14,17 @@
 
 """Service abstraction layer."""
 # pylint: disable=unused-argument
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
 
-class InventoryServiceVolumePassphraseProperties(db.Model):
+class InventoryServiceVolumePassphraseProperties(ndb.Model):
   """Extra properties for volume._BaseVolume.
 
   Contains properties that specific for InventoryService.
   """
 
 
-class InventoryServiceBackupPassphraseProperties(db.Model):
+class InventoryServiceBackupPassphraseProperties(ndb.Model):
   """Extra properties for backup.DuplicityKeyPair.
 
   Contains properties that specific for InventoryService.
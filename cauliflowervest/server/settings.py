@@ -28,6 +28,23 @@ TEST = 'unittest2' in sys.modules or 'unittest' in sys.modules
 
 DEFAULT_CRYPTO_BACKEND = 'keyczar'
 
+# Limits of the in-memory cache of unwrapped data encryption keys used by the
+# envelope_cloud_kms crypto backend. Set either to 0 to disable the cache.
+ENVELOPE_DEK_CACHE_SIZE = 256
+ENVELOPE_DEK_CACHE_TTL = 60  # Seconds.
+# Maximum number of secrets which share one data encryption key inside an
+# encrypted_property.EncryptionBatch.
+ENVELOPE_BATCH_SIZE = 100
+
+# AccessLog writes which may be batched, like those of failed requests, go
+# through the access-log pull queue while an instance has at least this many
+# AccessLog puts in flight.
+ACCESS_LOG_MAX_PENDING_PUTS = 20
+# AccessLog entities older than this many days are counted into daily
+# AccessLogDailySummary entities and deleted by the access_log_rollup cron
+# job. None keeps all logs.
+ACCESS_LOG_RETENTION_DAYS = None
+
 DEFAULT_EMAIL_DOMAIN = 'example.com'
 DEFAULT_EMAIL_SENDER = 'user@example.com'
 DEFAULT_EMAIL_REPLY_TO = 'diff-user@example.com'
@@ -71,6 +88,8 @@ KEY_TYPE_DATASTORE_FILEVAULT = 'key_type_datastore_filevault'
 KEY_TYPE_DEFAULT_FILEVAULT = KEY_TYPE_DATASTORE_FILEVAULT
 KEY_TYPE_DATASTORE_XSRF = 'key_type_datastore_xsrf'
 KEY_TYPE_DEFAULT_XSRF = KEY_TYPE_DATASTORE_XSRF
+KEY_TYPE_DATASTORE_FINGERPRINT = 'key_type_datastore_fingerprint'
+KEY_TYPE_DEFAULT_FINGERPRINT = KEY_TYPE_DATASTORE_FINGERPRINT
 
 # Turn to False to support v0.8 clients.
 XSRF_PROTECTION_ENABLED = True
@@ -90,6 +109,9 @@ DEMO_KEYS = [
 ]
 # This DEMO value should be kept secret and safe in a similar manner.
 DEMO_XSRF_SECRET = os.environ.get('CURRENT_VERSION_ID', 'random_default_value')
+# HMAC key of stored secret fingerprints. Must not change between versions,
+# otherwise duplicate escrows are no longer detected.
+DEMO_FINGERPRINT_SECRET = 'random_default_value'
 
 # These email addresses will be notified when a user of the named permission
 # fetches a passphrase, in addition to the default behavior.
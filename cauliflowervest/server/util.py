@@ -104,7 +104,7 @@ def SendEmail(recipients, subject, body, sender=None, reply_to=None,
 def XsrfTokenGenerate(action, user=None, timestamp=None):
   """Generate an XSRF token."""
   if not user:
-    user = base.GetCurrentUser().email
+    user = base.GetRequestContext().email
   if not timestamp:
     timestamp = time.time()
   timestr = str(timestamp)
@@ -119,7 +119,7 @@ def XsrfTokenValidate(token, action, user=None, timestamp=None, time_=time):
   if not token:
     return False
   if not user:
-    user = base.GetCurrentUser().email
+    user = base.GetRequestContext().email
   if not timestamp:
     try:
       # Request objects return Unicode encoded tokens.
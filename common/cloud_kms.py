@@ -7,6 +7,8 @@ clear_text = cloud_kms.Decrypt(cyper_text, KEY_NAME, KEYRING_NAME)
 """
 
 import base64
+import os
+import threading
 
 
 
@@ -17,18 +19,45 @@ from oauth2client import client
 from google.appengine.api import app_identity
 
 _LOCATION = 'global'
-_client = None
+_SCOPES = ['https://www.googleapis.com/auth/cloudkms']
+# Bundled copy of the discovery document, so that building a client does not
+# fetch it over the network.
+_DISCOVERY_DOCUMENT_PATH = os.path.join(
+    os.path.dirname(__file__), 'cloudkms_v1_discovery.json')
+# Socket timeout in seconds of each API call.
+_HTTP_TIMEOUT = 10
+
+_discovery_document = None
+_credentials = None
+_lock = threading.Lock()
+# httplib2.Http is not thread-safe, so every thread gets its own client, which
+# keeps its connection open between calls.
+_clients = threading.local()
+
+
+def _GetDiscoveryDocument():
+  global _discovery_document
+  if _discovery_document is None:
+    with open(_DISCOVERY_DOCUMENT_PATH) as f:
+      _discovery_document = f.read()
+  return _discovery_document
+
+
+def _GetCredentials():
+  global _credentials
+  with _lock:
+    if _credentials is None:
+      _credentials = (
+          client.GoogleCredentials.get_application_default().create_scoped(
+              _SCOPES))
+  return _credentials
 
 
 def _BuildClient():
-  discovery_uri = ('https://{api}.googleapis.com/$discovery/'
-                   'google_rest_simple_uri?version={apiVersion}')
-  creds = client.GoogleCredentials.get_application_default().create_scoped(
-      ['https://www.googleapis.com/auth/cloudkms'])
-  http_auth = creds.authorize(httplib2.Http())
+  http_auth = _GetCredentials().authorize(httplib2.Http(timeout=_HTTP_TIMEOUT))
 
-  return discovery.build('cloudkms', 'v1', http=http_auth,
-                         discoveryServiceUrl=discovery_uri)
+  return discovery.build_from_document(
+      _GetDiscoveryDocument(), http=http_auth)
 
 
 def _GetAppId():
@@ -36,13 +65,13 @@ def _GetAppId():
 
 
 def _GetClient():
-  global _client
-  if _client:
-    return _client
+  cloudkms = getattr(_clients, 'cloudkms', None)
+  if cloudkms:
+    return cloudkms
 
-  _client = _BuildClient()
+  _clients.cloudkms = _BuildClient()
 
-  return _client
+  return _clients.cloudkms
 
 
 def Encrypt(data, key_name, key_ring, key_location=_LOCATION):